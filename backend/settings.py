@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'deepimage.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -129,3 +130,159 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Deepfake detector inference
+# Concurrent predictions are grouped into batches of up to
+# DEEPIMAGE_INFERENCE_BATCH_SIZE images, waiting at most
+# DEEPIMAGE_INFERENCE_BATCH_WAIT_MS for a batch to fill. A batch size of 1
+# disables micro-batching.
+DEEPIMAGE_INFERENCE_BATCH_SIZE = int(os.environ.get('DEEPIMAGE_INFERENCE_BATCH_SIZE', 8))
+DEEPIMAGE_INFERENCE_BATCH_WAIT_MS = float(os.environ.get('DEEPIMAGE_INFERENCE_BATCH_WAIT_MS', 10))
+
+# Predictions are cached by file SHA-256 and model version, in an in-process
+# LRU of DEEPIMAGE_PREDICTION_CACHE_SIZE entries backed by the database.
+DEEPIMAGE_PREDICTION_CACHE_SIZE = int(os.environ.get('DEEPIMAGE_PREDICTION_CACHE_SIZE', 1024))
+DEEPIMAGE_PREDICTION_CACHE_PERSIST = True
+
+# Background analysis jobs submitted through /api/analysis/submit/ run on
+# DEEPIMAGE_ANALYSIS_WORKERS threads. Once DEEPIMAGE_ANALYSIS_QUEUE_SIZE jobs
+# are waiting, new submissions are rejected with 503.
+DEEPIMAGE_ANALYSIS_WORKERS = int(os.environ.get('DEEPIMAGE_ANALYSIS_WORKERS', 2))
+DEEPIMAGE_ANALYSIS_QUEUE_SIZE = int(os.environ.get('DEEPIMAGE_ANALYSIS_QUEUE_SIZE', 32))
+
+# Upper bound on images accepted by one /api/predict/batch/ request
+DEEPIMAGE_BATCH_PREDICT_MAX_IMAGES = int(os.environ.get('DEEPIMAGE_BATCH_PREDICT_MAX_IMAGES', 1000))
+
+# Analysis results from concurrent requests are committed together, up to
+# DEEPIMAGE_RESULT_WRITER_BATCH_SIZE analyses per transaction. A batch size
+# of 1 writes each analysis in its own transaction.
+DEEPIMAGE_RESULT_WRITER_BATCH_SIZE = int(os.environ.get('DEEPIMAGE_RESULT_WRITER_BATCH_SIZE', 32))
+DEEPIMAGE_RESULT_WRITER_WAIT_MS = float(os.environ.get('DEEPIMAGE_RESULT_WRITER_WAIT_MS', 5))
+
+# The detector is built on first use. DEEPIMAGE_WARMUP controls loading it at
+# startup instead: 'background' (default), 'blocking' or 'off'. Only server
+# processes (runserver, gunicorn, uvicorn, daphne, uWSGI...) warm up;
+# DEEPIMAGE_FAST_START=1 skips warm-up everywhere and =0 forces it.
+DEEPIMAGE_MODEL_PATH = os.path.join(BASE_DIR, 'deepimage', 'utils', 'best_model.pth')
+DEEPIMAGE_WARMUP = os.environ.get('DEEPIMAGE_WARMUP', 'background')
+# Start the dummy model (used when the checkpoint is missing) from downloaded
+# ImageNet weights rather than random initialisation
+DEEPIMAGE_DUMMY_PRETRAINED = False
+
+# CPU inference backend: 'eager', 'torchscript', 'channels_last',
+# 'dynamic_int8' or 'static_int8'. Non-eager backends are checked against
+# eager on DEEPIMAGE_CALIBRATION_DIR (synthetic images when unset) at load
+# time and disabled if they agree on fewer than
+# DEEPIMAGE_BACKEND_MIN_AGREEMENT of the predictions.
+DEEPIMAGE_INFERENCE_BACKEND = os.environ.get('DEEPIMAGE_INFERENCE_BACKEND', 'eager')
+DEEPIMAGE_CALIBRATION_DIR = os.environ.get('DEEPIMAGE_CALIBRATION_DIR') or None
+DEEPIMAGE_VERIFY_BACKEND = True
+DEEPIMAGE_BACKEND_MIN_AGREEMENT = 0.95
+# Intra-op threads used by torch; None keeps torch's default
+DEEPIMAGE_TORCH_THREADS = int(os.environ['DEEPIMAGE_TORCH_THREADS']) if os.environ.get('DEEPIMAGE_TORCH_THREADS') else None
+
+# Inference engine: 'torch' or 'onnx'. The ONNX engine serves the model
+# exported by 'manage.py export_onnx' with onnxruntime on CPU and does not
+# import torch. Thread counts of None leave onnxruntime's defaults.
+DEEPIMAGE_INFERENCE_ENGINE = os.environ.get('DEEPIMAGE_INFERENCE_ENGINE', 'torch')
+DEEPIMAGE_ONNX_PATH = os.environ.get('DEEPIMAGE_ONNX_PATH') or os.path.join(BASE_DIR, 'deepimage', 'utils', 'best_model.onnx')
+DEEPIMAGE_ONNX_INTRA_OP_THREADS = int(os.environ['DEEPIMAGE_ONNX_INTRA_OP_THREADS']) if os.environ.get('DEEPIMAGE_ONNX_INTRA_OP_THREADS') else None
+DEEPIMAGE_ONNX_INTER_OP_THREADS = int(os.environ['DEEPIMAGE_ONNX_INTER_OP_THREADS']) if os.environ.get('DEEPIMAGE_ONNX_INTER_OP_THREADS') else None
+
+# Grad-CAM heatmaps for forensic analyses, stored as PNG overlays under
+# MEDIA_ROOT/heatmaps and reused for identical content. 'eager' renders them
+# from the prediction's forward pass, 'lazy' (default) only when a report or
+# PDF shows them, 'off' disables them. They need the torch inference engine.
+DEEPIMAGE_HEATMAP_MODE = os.environ.get('DEEPIMAGE_HEATMAP_MODE', 'lazy')
+
+# Artifact detectors share one decoded image pyramid and are skipped once
+# an image would exceed DEEPIMAGE_ARTIFACT_BUDGET_MS. JPEGs over
+# DEEPIMAGE_ARTIFACT_MAX_PIXELS are decoded at reduced scale, which disables
+# the block-grid and error level detectors for them.
+DEEPIMAGE_ARTIFACT_BUDGET_MS = float(os.environ.get('DEEPIMAGE_ARTIFACT_BUDGET_MS', 250))
+DEEPIMAGE_ARTIFACT_MIN_CONFIDENCE = 0.5
+DEEPIMAGE_ARTIFACT_MAX_PIXELS = int(os.environ.get('DEEPIMAGE_ARTIFACT_MAX_PIXELS', 4_000_000))
+
+# Analysis stages (artifact detection, toolkit signatures) run alongside the
+# model's forward pass on a pool of up to DEEPIMAGE_ANALYSIS_STAGE_WORKERS
+# threads per analysis. A stage not finished within its timeout is recorded
+# as skipped in ForensicAnalysis.stage_timings and left out of the report.
+# Timeouts in ms per stage name override the defaults the stages are
+# registered with.
+DEEPIMAGE_ANALYSIS_STAGE_WORKERS = int(os.environ.get('DEEPIMAGE_ANALYSIS_STAGE_WORKERS', 4))
+DEEPIMAGE_ANALYSIS_STAGE_TIMEOUTS_MS = {}
+
+# Model ensemble for forensic analyses. Each member is a dict with a 'name',
+# a test-time augmentation 'view' ('identity', 'hflip', 'crop' or
+# 'crop_hflip'), a 'weight' and an optional 'checkpoint' (.pth or .onnx;
+# the serving model when omitted). Views of one checkpoint share a single
+# batched forward pass. Scores are fused by 'weighted' mean or 'median'
+# (weights ignored). When the first member is at least
+# DEEPIMAGE_ENSEMBLE_EARLY_EXIT_CONFIDENCE percent confident the other
+# members are skipped. DEEPIMAGE_ENSEMBLE=tta enables flip and crop TTA of
+# the serving model.
+DEEPIMAGE_ENSEMBLE_MEMBERS = [
+    {'name': 'resnet50', 'view': 'identity', 'weight': 1.0},
+    {'name': 'resnet50-hflip', 'view': 'hflip', 'weight': 1.0},
+    {'name': 'resnet50-crop', 'view': 'crop', 'weight': 0.5},
+    {'name': 'resnet50-crop-hflip', 'view': 'crop_hflip', 'weight': 0.5},
+] if os.environ.get('DEEPIMAGE_ENSEMBLE', 'off') == 'tta' else []
+DEEPIMAGE_ENSEMBLE_FUSION = os.environ.get('DEEPIMAGE_ENSEMBLE_FUSION', 'weighted')
+DEEPIMAGE_ENSEMBLE_EARLY_EXIT_CONFIDENCE = float(os.environ.get('DEEPIMAGE_ENSEMBLE_EARLY_EXIT_CONFIDENCE', 95))
+
+# Prefetching pipeline used by the batch prediction endpoint: worker
+# threads decode and normalize images into preallocated batch buffers up to
+# DEEPIMAGE_PREFETCH_BATCHES batches ahead of the model. Batches hold
+# DEEPIMAGE_INFERENCE_BATCH_SIZE images. 'manage.py scan' takes its own
+# --workers and --prefetch-batches.
+DEEPIMAGE_PREFETCH_WORKERS = int(os.environ.get('DEEPIMAGE_PREFETCH_WORKERS', 4))
+DEEPIMAGE_PREFETCH_BATCHES = int(os.environ.get('DEEPIMAGE_PREFETCH_BATCHES', 2))
+
+# PDF exports are rendered once per analysis state and template version by
+# a background worker after the analysis completes, stored under
+# MEDIA_ROOT/reports and served with an ETag. With prerendering off they
+# are rendered on first download.
+DEEPIMAGE_PDF_PRERENDER = os.environ.get('DEEPIMAGE_PDF_PRERENDER', '1').lower() in ('1', 'true', 'yes')
+DEEPIMAGE_PDF_WORKERS = 1
+DEEPIMAGE_PDF_QUEUE_SIZE = 256
+
+# Bulk exports (report/export/ and 'manage.py export_reports') render missing
+# PDFs on a pool of DEEPIMAGE_EXPORT_WORKERS spawned processes (0 renders
+# them in the exporting process) and stream them into a ZIP. The endpoint
+# refuses filters matching more than DEEPIMAGE_EXPORT_MAX_REPORTS reports.
+DEEPIMAGE_EXPORT_WORKERS = int(os.environ.get('DEEPIMAGE_EXPORT_WORKERS', 2))
+DEEPIMAGE_EXPORT_MAX_REPORTS = int(os.environ.get('DEEPIMAGE_EXPORT_MAX_REPORTS', 10000))
+
+# Near-duplicate search. Every analysed image gets a 64-bit pHash and dHash
+# and, from the eager torch model's forward pass, an embedding of its
+# penultimate features; the codes of all analyses are searched in memory.
+# Earlier analyses within DEEPIMAGE_NEAR_DUPLICATE_MAX_DISTANCE bits on both
+# hashes, or with embedding cosine similarity of at least
+# DEEPIMAGE_NEAR_DUPLICATE_SIMILARITY, are recorded in cross_correlation. The
+# search runs before the model, using an embedding stored for the same
+# content if there is one, and again with the embedding from the forward
+# pass otherwise. A high-confidence verdict of the same model within
+# DEEPIMAGE_NEAR_DUPLICATE_REUSE_DISTANCE bits, found by the first search, is
+# reused without running the model (-1 turns reuse off).
+DEEPIMAGE_NEAR_DUPLICATES = os.environ.get('DEEPIMAGE_NEAR_DUPLICATES', '1').lower() in ('1', 'true', 'yes')
+DEEPIMAGE_NEAR_DUPLICATE_MAX_DISTANCE = 10
+DEEPIMAGE_NEAR_DUPLICATE_CODE_DISTANCE = 12
+DEEPIMAGE_NEAR_DUPLICATE_SIMILARITY = 0.95
+DEEPIMAGE_NEAR_DUPLICATE_REUSE_DISTANCE = int(os.environ.get('DEEPIMAGE_NEAR_DUPLICATE_REUSE_DISTANCE', 4))
+DEEPIMAGE_NEAR_DUPLICATE_MAX_MATCHES = 10
+DEEPIMAGE_NEAR_DUPLICATE_REFRESH_SECONDS = 5.0
+
+# Prometheus metrics on /metrics: per-step latency histograms (decode,
+# transform, forward, hash, exif, db_write, pdf_render), per-view request
+# latency, error counters, queue depths and prediction cache counters. Each
+# observation is a few integer additions in process memory; gauges and cache
+# counters are only read when the endpoint is scraped.
+DEEPIMAGE_METRICS = os.environ.get('DEEPIMAGE_METRICS', '1').lower() in ('1', 'true', 'yes')
+
+# Async views (api/predict/, forensic-analysis/ and the report exports) run
+# decoding, hashing, inference and PDF rendering on a pool of
+# DEEPIMAGE_ASYNC_INFERENCE_WORKERS threads and answer 503 once
+# DEEPIMAGE_ASYNC_INFERENCE_QUEUE_SIZE calls are in flight. Serve the project
+# with an ASGI server (backend.asgi) to hold many uploads per process.
+DEEPIMAGE_ASYNC_INFERENCE_WORKERS = int(os.environ.get('DEEPIMAGE_ASYNC_INFERENCE_WORKERS', 4))
+DEEPIMAGE_ASYNC_INFERENCE_QUEUE_SIZE = int(os.environ.get('DEEPIMAGE_ASYNC_INFERENCE_QUEUE_SIZE', 64))
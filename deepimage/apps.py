@@ -1,6 +1,77 @@
+import logging
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Programs that serve requests, and so benefit from a warm model
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'granian', 'uwsgi', 'waitress-serve', 'mod_wsgi-express')
+
+def program_name():
+    """Name of the running program, taking ``python -m package`` into account"""
+    program = sys.argv[0] if sys.argv else ''
+    if os.path.basename(program) == '__main__.py':
+        return os.path.basename(os.path.dirname(program))
+    return os.path.basename(program)
+
+def is_fast_start():
+    """Whether this process should skip model warm-up.
+
+    Only server processes warm up: runserver's serving process, the servers
+    in SERVER_PROGRAMS and processes embedded in uWSGI or mod_wsgi. Other
+    management commands, test runners, ``python -c`` and scripts load the
+    model lazily on first use. DEEPIMAGE_FAST_START=1 skips warm-up anywhere
+    and DEEPIMAGE_FAST_START=0 forces it, e.g. for a server not listed here.
+    """
+    forced = os.environ.get('DEEPIMAGE_FAST_START', '').lower()
+    if forced in ('1', 'true', 'yes'):
+        return True
+    if forced in ('0', 'false', 'no'):
+        return False
+    if getattr(settings, 'DEEPIMAGE_FAST_START', False):
+        return True
+
+    program = program_name()
+    if program in ('manage.py', 'django-admin', 'django-admin.py', 'django'):
+        command = sys.argv[1] if len(sys.argv) > 1 else ''
+        if command != 'runserver':
+            return True
+        # Only the autoreloader's child process serves requests
+        return '--noreload' not in sys.argv and os.environ.get('RUN_MAIN') != 'true'
+    if program in SERVER_PROGRAMS or 'uwsgi' in sys.modules or 'mod_wsgi' in sys.modules:
+        return False
+    return True
 
 
 class DeepimageConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'deepimage'
+
+    def ready(self):
+        from django.core.signals import request_started
+        from django.db.models.signals import post_save
+        from .utils.export_utils import analysis_saved
+        from .utils.job_queue import fail_interrupted_analyses
+        post_save.connect(analysis_saved, sender='deepimage.ForensicAnalysis', dispatch_uid='deepimage-pdf-refresh')
+        # Database access is discouraged during ready(), so recovery waits for the first request
+        request_started.connect(fail_interrupted_analyses, dispatch_uid='deepimage-job-recovery')
+
+        warmup = getattr(settings, 'DEEPIMAGE_WARMUP', 'background')
+        if warmup == 'off' or is_fast_start():
+            return
+
+        from .utils.registry import detector
+        if warmup == 'blocking':
+            detector.warm_up()
+        else:
+            threading.Thread(target=self._warm_up, args=(detector,), name='deepimage-warmup', daemon=True).start()
+
+    def _warm_up(self, detector):
+        try:
+            detector.warm_up()
+        except Exception as e:
+            logger.error(f"Detector warm-up failed: {str(e)}")
@@ -0,0 +1,72 @@
+import json
+import time
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from deepimage.utils import inference_backends
+from deepimage.utils.benchmarking import latency_summary
+from deepimage.utils.model_loader import DeepFakeDetector, detector
+
+class Command(BaseCommand):
+    help = "Report images/sec, p50/p99 latency and agreement with eager for each inference backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', default=list(inference_backends.BACKENDS),
+                            choices=inference_backends.BACKENDS, help="Backends to benchmark")
+        parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 8], help="Batch sizes to time")
+        parser.add_argument('--iterations', type=int, default=20, help="Timed forward passes per batch size")
+        parser.add_argument('--validation-dir', default=getattr(settings, 'DEEPIMAGE_CALIBRATION_DIR', None),
+                            help="Images used for calibration and the agreement check")
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        # Backends are built from the eager torch model even when the server runs the ONNX engine
+        torch_detector = detector if detector.engine == 'torch' else DeepFakeDetector()
+        eager = torch_detector.model
+        device = torch_detector.device
+        validation_dir = options['validation_dir']
+        self.stdout.write(f"Device {device}, {torch.get_num_threads()} threads, model {torch_detector.model_version}")
+
+        results = []
+        for mode in options['modes']:
+            if device != 'cpu' and mode in inference_backends.CPU_ONLY_BACKENDS:
+                self.stdout.write(f"{mode:>14}: skipped (CPU only)")
+                continue
+
+            started = time.perf_counter()
+            runner = inference_backends.build_backend(mode, eager, validation_dir)
+            build_seconds = time.perf_counter() - started
+            check = inference_backends.check_agreement(
+                eager, runner, inference_backends.calibration_batches(validation_dir, count=32), device
+            )
+            row = {'mode': mode, 'build_seconds': round(build_seconds, 2), **check, 'batches': {}}
+
+            for batch_size in options['batch_sizes']:
+                batch = torch.randn(batch_size, 3, 224, 224).to(device)
+                timings = []
+                with torch.no_grad():
+                    for _ in range(3):
+                        runner(batch)
+                    for _ in range(options['iterations']):
+                        tick = time.perf_counter()
+                        runner(batch)
+                        timings.append(time.perf_counter() - tick)
+                summary = latency_summary(timings)
+                summary['images_per_sec'] = round(batch_size * len(timings) / sum(timings), 2)
+                row['batches'][batch_size] = summary
+                self.stdout.write(
+                    f"{mode:>14} batch {batch_size:>3}: {summary['images_per_sec']:8.1f} img/s, "
+                    f"p50 {summary['p50_ms']:8.1f} ms, p99 {summary['p99_ms']:8.1f} ms"
+                )
+            self.stdout.write(
+                f"{mode:>14}: agreement {check['agreement']:.2%}, "
+                f"max prob diff {check['max_probability_diff']:.4f}, built in {build_seconds:.1f}s"
+            )
+            results.append(row)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json_path']}"))
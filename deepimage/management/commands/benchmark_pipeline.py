@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from deepimage.utils import pipeline_benchmark
+
+def _resolution(value):
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise CommandError(f"Resolution '{value}' must look like 1920x1080")
+    return width, height
+
+class Command(BaseCommand):
+    help = ("Time preprocessing, prediction, analysis saves, artifact writes and PDF exports on synthetic "
+            "images with a randomly initialised model, optionally comparing against an earlier JSON result")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resolutions', nargs='+', default=[f"{w}x{h}" for w, h in pipeline_benchmark.RESOLUTIONS],
+                            help="Image sizes as WIDTHxHEIGHT")
+        parser.add_argument('--formats', nargs='+', default=pipeline_benchmark.FORMATS, help="Image formats to generate")
+        parser.add_argument('--benchmarks', nargs='+', default=pipeline_benchmark.BENCHMARKS,
+                            choices=pipeline_benchmark.BENCHMARKS, help="Benchmarks to run")
+        parser.add_argument('--repeats', type=int, default=5, help="Timed runs per measurement")
+        parser.add_argument('--artifacts', type=int, default=4, help="Artifacts per analysis result write")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the model weights and images")
+        parser.add_argument('--json', dest='json_path', help="Write the results to this JSON file")
+        parser.add_argument('--compare', help="Earlier JSON result to check for regressions")
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help="Median latency ratio to the baseline counted as a regression")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        result = pipeline_benchmark.run_suite(
+            resolutions=[_resolution(value) for value in options['resolutions']],
+            formats=[fmt.upper() for fmt in options['formats']],
+            benchmarks=options['benchmarks'],
+            repeats=max(1, options['repeats']),
+            artifacts=options['artifacts'],
+            seed=options['seed'],
+            log=lambda row: self.stdout.write(self._format_row(row)),
+        )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json_path']}"))
+
+        if baseline is not None:
+            regressions = pipeline_benchmark.compare(baseline, result, options['threshold'])
+            for row in regressions:
+                self.stderr.write(f"Regression: {self._format_row(row)} vs p50 {row['baseline_p50_ms']:.1f} ms "
+                                  f"({row['ratio']:.2f}x)")
+            if regressions:
+                raise CommandError(f"{len(regressions)} measurements regressed against {options['compare']}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}"))
+
+    def _format_row(self, row):
+        image = f"{row['format']} {row['resolution']}" if row['format'] else ''
+        return (f"{row['benchmark']:>17} {image:>15}: mean {row['mean_ms']:8.1f} ms, "
+                f"p50 {row['p50_ms']:8.1f} ms, p99 {row['p99_ms']:8.1f} ms")
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from deepimage.utils.benchmarking import measure_isolated, synthetic_image
+
+RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+FORMATS = ['JPEG', 'PNG']
+
+class Command(BaseCommand):
+    help = "Compare peak memory and latency of the legacy and reduced-size preprocessing pipelines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeats', type=int, default=5, help="Timed runs per pipeline and image")
+        parser.add_argument('--formats', nargs='+', default=FORMATS, help="Image formats to generate")
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = []
+        for fmt in options['formats']:
+            for width, height in RESOLUTIONS:
+                data = synthetic_image(width, height, fmt=fmt)
+                row = {'format': fmt, 'resolution': f"{width}x{height}", 'bytes': len(data)}
+                for pipeline in ('legacy_preprocess', 'reduced_preprocess'):
+                    summary, peak = measure_isolated(pipeline, data, options['repeats'])
+                    row[pipeline] = {**summary, 'peak_rss_mb': None if peak is None else round(peak / 2 ** 20, 1)}
+                results.append(row)
+                self.stdout.write(self._format_row(row))
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['json_path']}"))
+
+    def _format_row(self, row):
+        legacy, reduced = row['legacy_preprocess'], row['reduced_preprocess']
+        speedup = legacy['mean_ms'] / reduced['mean_ms'] if reduced['mean_ms'] else float('inf')
+        return (
+            f"{row['format']:>4} {row['resolution']:>10}: "
+            f"legacy {legacy['mean_ms']:8.1f} ms / {legacy['peak_rss_mb']} MB peak, "
+            f"reduced {reduced['mean_ms']:8.1f} ms / {reduced['peak_rss_mb']} MB peak "
+            f"({speedup:.1f}x faster)"
+        )
@@ -0,0 +1,141 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from deepimage.models import ForensicAnalysis, ArtifactDetection
+from deepimage.utils import analysis_search
+
+BENCHMARK_ANALYST = 'benchmark-search'
+CLASSIFICATIONS = ['likely_genuine', 'suspected_fake', 'confirmed_fake']
+MEDIA_SOURCES = ['File Upload', 'evidence', 'social-media', 'partner-feed', 'field']
+
+class Command(BaseCommand):
+    help = ("Fill a synthetic analysis table and time keyset-paginated searches against naive "
+            "full-row, per-row-artifact and OFFSET queries")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help="Synthetic analyses to create")
+        parser.add_argument('--artifact-every', type=int, default=4, help="Give every Nth analysis two artifacts")
+        parser.add_argument('--page-size', type=int, default=50, help="Analyses per page")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement; the median is reported")
+        parser.add_argument('--keep', action='store_true', help="Keep the synthetic rows for another run")
+
+    def handle(self, *args, **options):
+        self.options = options
+        existing = ForensicAnalysis.objects.filter(analyst_id=BENCHMARK_ANALYST).count()
+        if existing < options['rows']:
+            self._fill(existing, options['rows'], options['artifact_every'])
+        try:
+            self._run()
+        finally:
+            if not options['keep']:
+                self.stdout.write("Removing synthetic rows")
+                # Raw deletes: the ORM would first collect a million related objects
+                ArtifactDetection.objects.filter(analysis__analyst_id=BENCHMARK_ANALYST)._raw_delete(connection.alias)
+                ForensicAnalysis.objects.filter(analyst_id=BENCHMARK_ANALYST)._raw_delete(connection.alias)
+
+    def _fill(self, start, rows, artifact_every):
+        self.stdout.write(f"Creating {rows - start} synthetic analyses")
+        rng = random.Random(start)
+        now = timezone.now()
+        # Realistically sized JSON, which the search must not load
+        exif = {f'EXIF Tag{index}': 'x' * 40 for index in range(30)}
+        prediction = {'label': 'real', 'confidence': 91.2, 'is_deepfake': False, 'raw_output': [[0.912, 0.088]]}
+        date_field = ForensicAnalysis._meta.get_field('analysis_date')
+        date_field.auto_now_add = False
+        started = time.perf_counter()
+        try:
+            for chunk_start in range(start, rows, 10000):
+                analyses = [
+                    ForensicAnalysis(
+                        report_id=f"BENCH-S-{index:08d}",
+                        analysis_date=now - timedelta(seconds=rng.randrange(2 * 365 * 86400)),
+                        analyst_id=BENCHMARK_ANALYST,
+                        media_source=rng.choice(MEDIA_SOURCES),
+                        original_file=f"benchmark/{index}.jpg",
+                        file_name=f"{index}.jpg",
+                        file_hash_sha256=f"{rng.getrandbits(256):064x}",
+                        authenticity_score=rng.uniform(0, 100),
+                        classification=rng.choice(CLASSIFICATIONS),
+                        confidence_level=rng.choice(['low', 'medium', 'high']),
+                        exif_data=exif,
+                        raw_prediction_data=prediction,
+                        summary='Synthetic analysis ' * 10,
+                    )
+                    for index in range(chunk_start, min(chunk_start + 10000, rows))
+                ]
+                with transaction.atomic():
+                    created = ForensicAnalysis.objects.bulk_create(analyses)
+                    ArtifactDetection.objects.bulk_create([
+                        ArtifactDetection(analysis_id=analysis.pk, artifact_type=artifact_type, confidence=0.7,
+                                          location='Various', description='Synthetic artifact ' * 10)
+                        for analysis in created[::artifact_every]
+                        for artifact_type in ('error_level', 'jpeg_grid')
+                    ])
+        finally:
+            date_field.auto_now_add = True
+        self.stdout.write(f"Created in {time.perf_counter() - started:.1f}s")
+
+    def _time(self, run):
+        timings = []
+        for _ in range(self.options['repeat']):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def _compare(self, label, keyset, naive):
+        keyset_ms, naive_ms = self._time(keyset), self._time(naive)
+        self.stdout.write(f"{label:>34}: keyset {keyset_ms:8.2f} ms   naive {naive_ms:9.2f} ms   "
+                          f"({naive_ms / keyset_ms if keyset_ms else 0:.1f}x)")
+
+    def _run(self):
+        size = self.options['page_size']
+        base = ForensicAnalysis.objects.filter(analyst_id=BENCHMARK_ANALYST)
+        sample = base.order_by('-id').only('file_hash_sha256', 'analysis_date').first()
+
+        def keyset(**filters):
+            def run():
+                analyses, _ = analysis_search.search_page(analysis_search.filter_analyses(**filters), limit=size)
+                [analysis_search.result_row(analysis) for analysis in analyses]
+            return run
+
+        def naive(**filters):
+            # Full rows and one artifact query per analysis
+            def run():
+                queryset = analysis_search.filter_analyses(**filters).order_by('-analysis_date', '-id')[:size]
+                for analysis in queryset:
+                    list(analysis.artifactdetection_set.all())
+            return run
+
+        since = (sample.analysis_date - timedelta(days=30)).date()
+        self._compare("first page", keyset(), naive())
+        self._compare("classification", keyset(classifications=['confirmed_fake']),
+                      naive(classifications=['confirmed_fake']))
+        self._compare("media source, last 30 days",
+                      keyset(media_sources=['evidence'], date_from=since),
+                      naive(media_sources=['evidence'], date_from=since))
+        self._compare("sha256", keyset(sha256s=[sample.file_hash_sha256]), naive(sha256s=[sample.file_hash_sha256]))
+
+        # Deep pages: continue from a cursor, or skip rows with OFFSET
+        depth = ForensicAnalysis.objects.count() // 2
+        middle = ForensicAnalysis.objects.order_by('-analysis_date', '-id').only('analysis_date')[depth]
+        cursor = analysis_search.encode_cursor(middle)
+
+        def deep_keyset():
+            analysis_search.search_page(ForensicAnalysis.objects.all(), cursor=cursor, limit=size)
+
+        def deep_offset():
+            list(ForensicAnalysis.objects.order_by('-analysis_date', '-id').only(*analysis_search.LIST_FIELDS)
+                 .prefetch_related('artifactdetection_set')[depth + 1:depth + 1 + size])
+
+        self._compare(f"page at row {depth:,} (vs OFFSET)", deep_keyset, deep_offset)
+
+        plan = analysis_search.filter_analyses(classifications=['confirmed_fake']).order_by('-analysis_date', '-id')
+        self.stdout.write("Query plan of a classification page:")
+        self.stdout.write(plan[:size].explain())
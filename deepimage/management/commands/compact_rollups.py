@@ -0,0 +1,47 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from deepimage.models import ForensicAnalysis
+from deepimage.utils import rollups
+from deepimage.utils.analysis_search import FilterError, parse_day
+
+class Command(BaseCommand):
+    help = ("Recompute the daily rollup rows behind /api/stats/ from the analyses, correcting drift from "
+            "edited or deleted analyses; run it from cron, or with --all to backfill")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="Recompute the last N days, including today")
+        parser.add_argument('--since', help="Recompute from this date (YYYY-MM-DD) instead")
+        parser.add_argument('--all', action='store_true', help="Recompute every day since the first analysis")
+        parser.add_argument('--chunk-days', type=int, default=31, help="Days recomputed per transaction")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        if options['all']:
+            first = ForensicAnalysis.objects.aggregate(first=Min('analysis_date'))['first']
+            if first is None:
+                self.stdout.write("No analyses to roll up")
+                return
+            date_from = timezone.localdate(first)
+        elif options['since']:
+            try:
+                date_from = parse_day(options['since'], 'since')
+            except FilterError as e:
+                raise CommandError(str(e))
+        else:
+            date_from = today - timedelta(days=max(1, options['days']) - 1)
+
+        started = time.perf_counter()
+        rows = 0
+        chunk = timedelta(days=max(1, options['chunk_days']))
+        while date_from <= today:
+            date_to = min(date_from + chunk - timedelta(days=1), today)
+            count = rollups.rebuild(date_from, date_to)
+            rows += count
+            self.stdout.write(f"{date_from} to {date_to}: {count} rows")
+            date_from = date_to + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} rollup rows in {time.perf_counter() - started:.1f}s"))
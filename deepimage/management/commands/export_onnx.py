@@ -0,0 +1,76 @@
+import os
+import time
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from deepimage.utils import inference_backends
+from deepimage.utils.model_loader import checkpoint_version, dummy_model, load_checkpoint
+from deepimage.utils.onnx_engine import create_session, get_onnx_path
+from deepimage.utils.registry import get_model_path
+
+class Command(BaseCommand):
+    help = "Export the detector checkpoint to ONNX and check onnxruntime against torch on a validation folder"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=get_onnx_path(), help="Path of the ONNX file to write")
+        parser.add_argument('--opset', type=int, default=17, help="ONNX opset version")
+        parser.add_argument('--validation-dir', default=getattr(settings, 'DEEPIMAGE_CALIBRATION_DIR', None),
+                            help="Images compared between torch and onnxruntime (synthetic images when unset)")
+        parser.add_argument('--validation-images', type=int, default=32, help="Number of images to compare")
+        parser.add_argument('--tolerance', type=float, default=1e-4,
+                            help="Largest allowed probability difference between torch and onnxruntime")
+
+    def handle(self, *args, **options):
+        # Always export the fp32 checkpoint under its own version, whatever
+        # backend the server applies on top of it
+        model_path = get_model_path()
+        if os.path.exists(model_path):
+            model, model_version = load_checkpoint(model_path), checkpoint_version(model_path)
+        else:
+            self.stderr.write(self.style.WARNING(
+                "Checkpoint not found, exporting a randomly initialised dummy model"
+            ))
+            model = dummy_model()
+            model_version = f"dummy-{os.getpid()}-{id(model):x}"
+        output = options['output']
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+        started = time.perf_counter()
+        with torch.no_grad():
+            torch.onnx.export(
+                model, (torch.randn(1, 3, 224, 224),), output,
+                input_names=['image'], output_names=['probabilities'],
+                dynamic_axes={'image': {0: 'batch'}, 'probabilities': {0: 'batch'}},
+                opset_version=options['opset'], do_constant_folding=True, dynamo=False,
+            )
+        self._set_metadata(output, {'model_version': model_version})
+        self.stdout.write(
+            f"Exported {model_version} to {output} "
+            f"({os.path.getsize(output) / 2 ** 20:.1f} MB) in {time.perf_counter() - started:.1f}s"
+        )
+
+        session = create_session(output)
+        input_name = session.get_inputs()[0].name
+        check = inference_backends.check_agreement(
+            model, lambda batch: torch.from_numpy(session.run(None, {input_name: batch.numpy()})[0]),
+            inference_backends.calibration_batches(options['validation_dir'], count=options['validation_images']),
+        )
+        if not check['images']:
+            raise CommandError("No validation images could be read; the export was not checked")
+        self.stdout.write(
+            f"onnxruntime vs torch on {check['images']} images: agreement {check['agreement']:.2%}, "
+            f"max prob diff {check['max_probability_diff']:.2e}"
+        )
+        if check['agreement'] < 1 or check['max_probability_diff'] > options['tolerance']:
+            raise CommandError("onnxruntime outputs do not match torch; do not deploy this export")
+        self.stdout.write(self.style.SUCCESS("onnxruntime outputs match torch"))
+
+    def _set_metadata(self, path, values):
+        import onnx
+        exported = onnx.load(path)
+        for key, value in values.items():
+            entry = exported.metadata_props.add()
+            entry.key, entry.value = key, value
+        onnx.save(exported, path)
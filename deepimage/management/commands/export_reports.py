@@ -0,0 +1,54 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from deepimage.utils.analysis_search import FilterError
+from deepimage.utils.bulk_export import filter_analyses, stream_export
+
+class Command(BaseCommand):
+    help = ("Write a ZIP of the PDF reports of completed analyses matching the filters, with a JSON and CSV "
+            "manifest, rendering missing reports on a process pool")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', required=True, help="ZIP file to write")
+        parser.add_argument('--date-from', help="First analysis date (YYYY-MM-DD)")
+        parser.add_argument('--date-to', help="Last analysis date (YYYY-MM-DD)")
+        parser.add_argument('--classification', nargs='+', help="Only these classifications")
+        parser.add_argument('--media-source', nargs='+', help="Only these media sources")
+        parser.add_argument('--ids', nargs='+', help="Only these analysis IDs")
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'DEEPIMAGE_EXPORT_WORKERS', 2),
+                            help="Report rendering processes; 0 renders in this process")
+
+    def handle(self, *args, **options):
+        filters = {
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+            'classifications': options['classification'],
+            'media_sources': options['media_source'],
+            'ids': options['ids'],
+        }
+        try:
+            analyses = filter_analyses(**filters)
+        except FilterError as e:
+            raise CommandError(str(e))
+        count = analyses.count()
+        if not count:
+            raise CommandError("No reports match the filters")
+        self.stdout.write(f"Exporting {count} reports to {options['output']}")
+
+        started = time.perf_counter()
+        summary = {}
+        partial_path = f"{options['output']}.part"
+        with open(partial_path, 'wb') as f:
+            for data in stream_export(analyses, filters, summary, workers=max(0, options['workers'])):
+                f.write(data)
+        os.replace(partial_path, options['output'])
+
+        elapsed = time.perf_counter() - started
+        line = (f"{summary['reports']} reports ({summary['bytes'] / 1e6:.1f} MB) in {elapsed:.1f}s "
+                f"({summary['reports'] / elapsed if elapsed else 0:.1f} reports/s)")
+        if summary['failed']:
+            self.stderr.write(f"{summary['failed']} reports failed, see the manifest")
+        self.stdout.write(self.style.SUCCESS(line))
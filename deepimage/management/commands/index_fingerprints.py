@@ -0,0 +1,68 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from deepimage.models import ForensicAnalysis, ImageFingerprint
+from deepimage.utils import near_duplicates
+from deepimage.utils.preprocessing import preprocessor
+from deepimage.utils.registry import detector
+
+class Command(BaseCommand):
+    help = ("Fingerprint completed analyses that have no near-duplicate fingerprint yet, such as those made "
+            "before the index existed or by 'manage.py scan'")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=32, help="Images per forward pass and bulk insert")
+        parser.add_argument('--no-embeddings', action='store_true',
+                            help="Store perceptual hashes only, without running the model")
+        parser.add_argument('--limit', type=int, help="Stop after this many analyses")
+
+    def handle(self, *args, **options):
+        embeddings = not options['no_embeddings']
+        if embeddings and not detector.has_features:
+            raise CommandError(f"The {detector.engine} engine has no embeddings; use --no-embeddings")
+
+        analyses = (ForensicAnalysis.objects.filter(status='done', fingerprint__isnull=True)
+                    .exclude(original_file='').order_by('id').only('id', 'original_file', 'file_hash_sha256'))
+        if options['limit']:
+            analyses = analyses[:options['limit']]
+
+        started = time.perf_counter()
+        counts = {'indexed': 0, 'failed': 0}
+        batch = []
+        for analysis in analyses.iterator(chunk_size=500):
+            try:
+                batch.append((analysis, preprocessor.load(os.path.join(settings.MEDIA_ROOT, analysis.original_file.name))))
+            except Exception as e:
+                counts['failed'] += 1
+                self.stderr.write(f"{analysis.id}: {e}")
+            if len(batch) >= options['batch_size']:
+                counts['indexed'] += self._index(batch, embeddings)
+                batch = []
+        counts['indexed'] += self._index(batch, embeddings)
+        near_duplicates.index.invalidate()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {counts['indexed']} analyses in {elapsed:.1f}s "
+            f"({counts['indexed'] / elapsed if elapsed else 0:.1f}/s), {counts['failed']} unreadable"
+        ))
+
+    def _index(self, batch, embeddings):
+        if not batch:
+            return 0
+        features = None
+        if embeddings:
+            _, features = detector.forward_with_features([array for _, array in batch])
+        rows = []
+        for row, (analysis, array) in enumerate(batch):
+            fingerprint = near_duplicates.Fingerprint(*near_duplicates.image_hashes(array))
+            if features is not None:
+                fingerprint.embedding = near_duplicates.normalize_embedding(features[row])
+            rows.append(ImageFingerprint(
+                analysis_id=analysis.id, **near_duplicates.fingerprint_fields(analysis, fingerprint)
+            ))
+        ImageFingerprint.objects.bulk_create(rows, ignore_conflicts=True)
+        return len(rows)
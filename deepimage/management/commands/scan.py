@@ -0,0 +1,158 @@
+import time
+from functools import partial
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from deepimage.models import ForensicAnalysis, PredictionCache
+from deepimage.utils import bulk_scan
+from deepimage.utils.batch_predict import MAX_FILE_SIZE
+from deepimage.utils.prefetch import PrefetchPipeline
+from deepimage.utils.registry import detector
+from deepimage.views import determine_classification, determine_recommended_action, generate_summary
+
+class Command(BaseCommand):
+    help = ("Analyse every image in directories and zip/tar archives with a parallel decode pool and "
+            "the batched model, writing ForensicAnalysis rows or a CSV/Parquet file")
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='+', help="Directories, zip/tar archives or image files")
+        parser.add_argument('--format', choices=['db', 'csv', 'parquet'], default='db',
+                            help="Write ForensicAnalysis rows (default) or a CSV/Parquet file")
+        parser.add_argument('--output', help="Output file for the csv and parquet formats")
+        parser.add_argument('--checkpoint', help="Resume file recording scanned entries; reused on the next run")
+        parser.add_argument('--batch-size', type=int, default=32, help="Images per forward pass and bulk write")
+        parser.add_argument('--workers', type=int, default=4, help="Read, hash and decode threads")
+        parser.add_argument('--prefetch-batches', type=int, default=2,
+                            help="Batches decoded ahead of the one the model is running")
+        parser.add_argument('--rescan', action='store_true',
+                            help="Also analyse content whose hash already has a forensic analysis")
+        parser.add_argument('--max-file-size', type=int, default=MAX_FILE_SIZE, help="Largest image in bytes")
+        parser.add_argument('--limit', type=int, help="Stop after this many entries")
+        parser.add_argument('--analyst-id', default='Bulk Scan', help="analyst_id of the created analyses")
+        parser.add_argument('--media-source', default='evidence', help="media_source of the created analyses")
+        parser.add_argument('--progress-interval', type=float, default=10.0, help="Seconds between progress lines")
+
+    def handle(self, *args, **options):
+        writer = self._writer(options)
+        checkpoint = bulk_scan.Checkpoint(options['checkpoint'])
+        if checkpoint.keys:
+            self.stdout.write(f"Resuming: {len(checkpoint.keys)} entries already scanned")
+
+        model = detector.get()
+        if model.model is None:
+            raise CommandError("Model not loaded")
+        model_version = model.model_version or 'unknown'
+
+        seen = set(checkpoint.hashes)
+        if options['format'] == 'db' and not options['rescan']:
+            seen.update(ForensicAnalysis.objects.exclude(file_hash_sha256='')
+                        .values_list('file_hash_sha256', flat=True).iterator())
+        self.options = options
+        self.counts = {'done': 0, 'duplicate': 0, 'failed': 0, 'cached': 0}
+        self.new_predictions = []
+        self.write_seconds = 0.0
+        self.started = self.last_progress = time.perf_counter()
+
+        pipeline = PrefetchPipeline(
+            model, batch_size=options['batch_size'], workers=options['workers'],
+            prefetch_batches=options['prefetch_batches'], name='scan',
+        )
+        entries = islice(bulk_scan.iter_sources(options['sources'], skip_keys=checkpoint.keys), options['limit'])
+        load = partial(bulk_scan.prepare, seen=bulk_scan.SeenHashes(seen), max_file_size=options['max_file_size'],
+                       model_version=model_version)
+        batch = []
+        try:
+            for item, output, error in pipeline.imap((bulk_scan.ScanItem(entry) for entry in entries), load):
+                if error is not None:
+                    item.status, item.error = 'failed', str(error)
+                elif output is not None:
+                    item.result = model.format_output(output)
+                    self.new_predictions.append(PredictionCache(
+                        content_hash=item.sha256, model_version=model_version, result=item.result
+                    ))
+                elif item.result is not None:
+                    self.counts['cached'] += 1
+                if item.result is not None and item.status == 'pending':
+                    self._apply(item)
+                batch.append(item)
+                if len(batch) >= pipeline.batch_size:
+                    self._flush(batch, writer, checkpoint, model_version)
+                    batch = []
+            self._flush(batch, writer, checkpoint, model_version)
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            writer.close()
+            checkpoint.close()
+
+        self._progress(final=True, pipeline=pipeline)
+
+    def _writer(self, options):
+        if options['format'] == 'db':
+            return bulk_scan.DatabaseWriter()
+        if not options['output']:
+            raise CommandError(f"--output is required for --format {options['format']}")
+        if options['format'] == 'csv':
+            return bulk_scan.CsvWriter(options['output'])
+        try:
+            return bulk_scan.ParquetWriter(options['output'])
+        except ImportError:
+            raise CommandError("Parquet output needs pyarrow (pip install pyarrow)")
+
+    def _flush(self, batch, writer, checkpoint, model_version):
+        """Store a batch's results, then record it in the checkpoint"""
+        if not batch:
+            return
+        tick = time.perf_counter()
+        if self.new_predictions and not model_version.startswith('dummy-'):
+            PredictionCache.objects.bulk_create(self.new_predictions, ignore_conflicts=True)
+        self.new_predictions = []
+        writer.write(batch, model_version)
+        checkpoint.record(batch)
+        self.write_seconds += time.perf_counter() - tick
+        for item in batch:
+            self.counts[item.status] += 1
+            if item.status == 'failed':
+                self.stderr.write(f"{item.key}: {item.error}")
+        self._progress()
+
+    def _apply(self, item):
+        """Set the verdict fields of the item's analysis the way a forensic upload does"""
+        result = item.result
+        analysis = item.analysis
+        authenticity_score = result['confidence']
+        if result['is_deepfake']:
+            authenticity_score = 100 - result['confidence']
+        classification, confidence_level = determine_classification(
+            authenticity_score, result['confidence'], result['is_deepfake']
+        )
+        analysis.analyst_id = self.options['analyst_id']
+        analysis.media_source = self.options['media_source']
+        analysis.authenticity_score = authenticity_score
+        analysis.classification = classification
+        analysis.confidence_level = confidence_level
+        analysis.summary = generate_summary(classification, authenticity_score, [])
+        analysis.recommended_action = determine_recommended_action(classification, confidence_level)
+        analysis.raw_prediction_data = result
+        analysis.status = 'done'
+        item.status = 'done'
+
+    def _progress(self, final=False, pipeline=None):
+        now = time.perf_counter()
+        if not final and now - self.last_progress < self.options['progress_interval']:
+            return
+        self.last_progress = now
+        elapsed = now - self.started
+        scanned = sum(self.counts[name] for name in ('done', 'duplicate', 'failed'))
+        line = (f"{scanned} scanned in {elapsed:.1f}s ({scanned / elapsed if elapsed else 0:.1f} images/s): "
+                f"{self.counts['done']} analysed ({self.counts['cached']} cached), "
+                f"{self.counts['duplicate']} duplicates, {self.counts['failed']} failed")
+        if final:
+            stats = pipeline.stats()
+            line += (f"; model busy {stats['model_utilization']:.0%} ({stats['model_seconds']:.1f}s), "
+                     f"decode workers busy {stats['decode_utilization']:.0%} ({stats['decode_seconds']:.1f}s), "
+                     f"model waiting on decode {stats['wait_seconds']:.1f}s, writes {self.write_seconds:.1f}s")
+            self.stdout.write(self.style.SUCCESS(line))
+        else:
+            self.stdout.write(line)
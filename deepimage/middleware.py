@@ -0,0 +1,47 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .utils import metrics
+
+class RequestMetricsMiddleware:
+    """Record how long each view takes, labelled with its URL name, and count server errors.
+
+    It runs natively in both sync and async stacks, so async views stay on
+    the event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        if not metrics.enabled():
+            return self.get_response(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, started)
+        return response
+
+    async def _acall(self, request):
+        if not metrics.enabled():
+            return await self.get_response(request)
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, started)
+        return response
+
+    def _record(self, request, response, started):
+        # Streamed responses are timed until their first byte is ready
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match is not None else 'unresolved'
+        metrics.request_seconds.observe(view, time.perf_counter() - started)
+        if response.status_code >= 500:
+            metrics.error('request')
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepimage', '0003_predictioncache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forensicanalysis',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='done', max_length=20),
+        ),
+    ]
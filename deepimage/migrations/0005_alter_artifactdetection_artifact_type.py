@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepimage', '0004_forensicanalysis_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='artifactdetection',
+            name='artifact_type',
+            field=models.CharField(choices=[('facial_asymmetry', 'Facial Asymmetry'), ('lighting_inconsistency', 'Lighting/Shadow Inconsistencies'), ('skin_texture', 'Skin Texture Anomalies'), ('eye_reflection', 'Eye Reflection Anomalies'), ('background_mismatch', 'Background Mismatch'), ('blink_pattern', 'Blink Pattern Anomalies'), ('color_inconsistency', 'Color Inconsistency'), ('error_level', 'Error Level Anomalies'), ('jpeg_grid', 'JPEG Grid Artifacts')], max_length=50),
+        ),
+    ]
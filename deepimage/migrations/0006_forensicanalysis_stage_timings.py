@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepimage', '0005_alter_artifactdetection_artifact_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forensicanalysis',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepimage', '0006_forensicanalysis_stage_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(db_index=True, max_length=64)),
+                ('model_version', models.CharField(blank=True, max_length=64)),
+                ('phash', models.BigIntegerField()),
+                ('dhash', models.BigIntegerField()),
+                ('embedding_code', models.BigIntegerField(blank=True, null=True)),
+                ('embedding', models.BinaryField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('analysis', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='deepimage.forensicanalysis')),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepimage', '0007_imagefingerprint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='forensicanalysis',
+            index=models.Index(fields=['-analysis_date', '-id'], name='analysis_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='forensicanalysis',
+            index=models.Index(fields=['classification', '-analysis_date', '-id'], name='analysis_class_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='forensicanalysis',
+            index=models.Index(fields=['media_source', '-analysis_date', '-id'], name='analysis_source_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='forensicanalysis',
+            index=models.Index(fields=['status', '-analysis_date', '-id'], name='analysis_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='forensicanalysis',
+            index=models.Index(fields=['file_hash_sha256'], name='analysis_sha256_idx'),
+        ),
+    ]
@@ -1,10 +1,10 @@
 from django.db import models
 import hashlib
 import os
-from PIL import Image as PILImage
 from django.core.files.storage import default_storage
-import exifread
 from datetime import datetime
+from .utils import metrics
+from .utils.ingest import ingest_file
 
 # Create your models here.
 class UploadedImage(models.Model):
@@ -57,6 +57,7 @@ class ForensicAnalysis(models.Model):
     detected_artifacts = models.JSONField(default=list, blank=True)
     heatmap_path = models.CharField(max_length=255, blank=True)
     model_ensemble_results = models.JSONField(default=dict, blank=True)
+    stage_timings = models.JSONField(default=dict, blank=True)
     
     # Adversarial Analysis
     adversarial_detection = models.JSONField(default=dict, blank=True)
@@ -74,47 +75,105 @@ class ForensicAnalysis(models.Model):
     
     # Internal fields
     raw_prediction_data = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=[
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed')
+    ], default='done')
+    
+    class Meta:
+        # Newest-first listings, alone or by the common filters
+        indexes = [
+            models.Index(fields=['-analysis_date', '-id'], name='analysis_date_idx'),
+            models.Index(fields=['classification', '-analysis_date', '-id'], name='analysis_class_date_idx'),
+            models.Index(fields=['media_source', '-analysis_date', '-id'], name='analysis_source_date_idx'),
+            models.Index(fields=['status', '-analysis_date', '-id'], name='analysis_status_date_idx'),
+            models.Index(fields=['file_hash_sha256'], name='analysis_sha256_idx'),
+        ]
+    
+    # Fields derived from original_file by refresh_file_details()
+    FILE_DETAIL_FIELDS = [
+        'file_name', 'file_size', 'file_hash_sha256', 'file_hash_md5',
+        'resolution', 'file_format', 'exif_data', 'metadata_inconsistencies',
+    ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'original_file' in field_names:
+            instance._loaded_file_name = values[field_names.index('original_file')]
+        return instance
     
     def save(self, *args, **kwargs):
         if not self.report_id:
             self.report_id = f"DFR-{datetime.now().strftime('%Y%m%d')}-{hashlib.md5(str(datetime.now()).encode()).hexdigest()[:6].upper()}"
         
-        if self.original_file:
-            self.file_name = self.original_file.name
-            self.file_size = self.original_file.size
-            self._calculate_hashes()
-            self._extract_metadata()
+        if self.file_changed():
+            self.refresh_file_details()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(self.FILE_DETAIL_FIELDS)
             
-        super().save(*args, **kwargs)
+        with metrics.timed('db_write'):
+            super().save(*args, **kwargs)
+        self._loaded_file_name = self.original_file.name if self.original_file else None
+    
+    def file_changed(self):
+        """Whether original_file differs from the stored file, so integrity data must be recomputed"""
+        if 'original_file' in self.get_deferred_fields():
+            return False
+        if not self.original_file:
+            return False
+        if not getattr(self.original_file, '_committed', True):
+            # A freshly assigned upload that has not been written to storage yet
+            return True
+        if not hasattr(self, '_loaded_file_name'):
+            # Deferred field or an instance that was never saved
+            return not self.file_hash_sha256
+        return self.original_file.name != self._loaded_file_name or not self.file_hash_sha256
     
+    def refresh_file_details(self):
+        """Recompute size, hashes and metadata from original_file in one pass"""
+        self.file_name = self.original_file.name
+        self.file_size = self.original_file.size
+        self._ingest = None
+        self._calculate_hashes()
+        self._extract_metadata()
+    
+    def _get_ingest(self):
+        """Stream the file once for hashes and header bytes, reusing the result within a save"""
+        if getattr(self, '_ingest', None) is None:
+            # Read through the field file so a fresh, not yet committed upload
+            # is ingested too
+            self._ingest = ingest_file(self.original_file)
+        return self._ingest
+
     def _calculate_hashes(self):
         """Calculate file hashes for integrity verification"""
         try:
-            file_path = self.original_file.path
-            with open(file_path, 'rb') as f:
-                content = f.read()
-                self.file_hash_sha256 = hashlib.sha256(content).hexdigest()
-                self.file_hash_md5 = hashlib.md5(content).hexdigest()
+            ingest = self._get_ingest()
+            self.file_hash_sha256 = ingest.sha256
+            self.file_hash_md5 = ingest.md5
         except:
             pass
     
     def _extract_metadata(self):
         """Extract EXIF and image metadata"""
         try:
-            file_path = self.original_file.path
-            self.file_format = os.path.splitext(file_path)[1].lower().replace('.', '')
+            ingest = self._get_ingest()
+            self.file_format = os.path.splitext(self.original_file.name)[1].lower().replace('.', '')
             
-            # Get image resolution
-            with PILImage.open(file_path) as img:
-                self.resolution = f"{img.width}x{img.height}"
+            # Get image resolution from the header, without decoding pixels
+            _, width, height = ingest.image_info()
+            self.resolution = f"{width}x{height}"
             
             # Extract EXIF data
-            with open(file_path, 'rb') as f:
-                tags = exifread.process_file(f)
-                self.exif_data = {
-                    str(tag): str(tags[tag]) for tag in tags
-                    if tag not in ('JPEGThumbnail', 'TIFFThumbnail', 'Filename')
-                }
+            tags = ingest.exif_tags()
+            self.exif_data = {
+                str(tag): str(tags[tag]) for tag in tags
+                if tag not in ('JPEGThumbnail', 'TIFFThumbnail', 'Filename')
+            }
                 
             # Check for metadata inconsistencies
             self._check_metadata_inconsistencies()
@@ -152,6 +211,8 @@ class ArtifactDetection(models.Model):
         ('background_mismatch', 'Background Mismatch'),
         ('blink_pattern', 'Blink Pattern Anomalies'),
         ('color_inconsistency', 'Color Inconsistency'),
+        ('error_level', 'Error Level Anomalies'),
+        ('jpeg_grid', 'JPEG Grid Artifacts'),
     ]
     
     analysis = models.ForeignKey(ForensicAnalysis, on_delete=models.CASCADE)
@@ -161,4 +222,58 @@ class ArtifactDetection(models.Model):
     description = models.TextField(blank=True)
     
     def __str__(self):
-        return f"{self.artifact_type} - {self.confidence:.2f}"
\ No newline at end of file
+        return f"{self.artifact_type} - {self.confidence:.2f}"
+
+class PredictionCache(models.Model):
+    """Persisted model predictions keyed on file content and model version"""
+    content_hash = models.CharField(max_length=64)
+    model_version = models.CharField(max_length=64)
+    result = models.JSONField(default=dict)
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('content_hash', 'model_version')
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} @ {self.model_version}"
+
+class ImageFingerprint(models.Model):
+    """Perceptual hashes and model embedding of an analysed image, for near-duplicate search.
+
+    The 64-bit codes are stored as signed integers. ``embedding`` holds the
+    L2-normalized penultimate features as float16 bytes and
+    ``embedding_code`` their 64-bit random-hyperplane hash.
+    """
+    analysis = models.OneToOneField(ForensicAnalysis, on_delete=models.CASCADE, related_name='fingerprint')
+    content_hash = models.CharField(max_length=64, db_index=True)
+    model_version = models.CharField(max_length=64, blank=True)
+    phash = models.BigIntegerField()
+    dhash = models.BigIntegerField()
+    embedding_code = models.BigIntegerField(null=True, blank=True)
+    embedding = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Watermark for NearDuplicateIndex refreshes, which also reload rewritten rows
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.analysis_id})"
+
+class DailyRollup(models.Model):
+    """Count of completed analyses per day for one value of a dimension.
+
+    Dimensions are 'analyses' (with an empty value), 'classification',
+    'confidence_level', 'toolkit' and 'artifact_type'. Rows are incremented
+    as analysis results are written and rebuilt by 'manage.py compact_rollups'.
+    """
+    day = models.DateField()
+    dimension = models.CharField(max_length=30)
+    value = models.CharField(max_length=100, blank=True)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'dimension', 'value')
+
+    def __str__(self):
+        return f"{self.day} {self.dimension}={self.value}: {self.count}"
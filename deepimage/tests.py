@@ -1,3 +1,1320 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import zipfile
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import ExifTags, Image
+from PIL.PngImagePlugin import PngInfo
+
+from . import views
+from .apps import is_fast_start
+from .models import (
+    ForensicAnalysis, ArtifactDetection, DailyRollup, ImageFingerprint, PredictionCache as CachedPrediction,
+    UploadedImage,
+)
+from .utils import (
+    artifact_detection, async_inference, bulk_export, bulk_scan, export_utils, heatmaps, inference_backends,
+    job_queue, metrics, near_duplicates, pipeline_benchmark, rollups,
+)
+from .utils.analysis_pipeline import AnalysisPipeline
+from .utils.analysis_search import FilterError, day_start, filter_analyses, search_page
+from .utils.batching import MicroBatcher
+from .utils.benchmarking import synthetic_image
+from .utils.ensemble import ensemble
+from .utils.ingest import ingest_file
+from .utils.job_queue import JobQueue, QueueFull, analysis_queue
+from .utils.persistence import ResultWriter, _result_write, save_analysis_results
+from .utils.prediction_cache import PredictionCache, file_sha256, prediction_cache
+from .utils.prefetch import PrefetchPipeline
+from .utils.preprocessing import preprocessor
+from .utils.registry import LazyDetector, detector
+
+class OfflineMixin:
+    """Offline model settings and a temporary MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        overrides = override_settings(MEDIA_ROOT=media.name, **pipeline_benchmark.OFFLINE_SETTINGS)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def write_image(self, name='image.jpg', width=96, height=64, fmt='JPEG', seed=0):
+        path = os.path.join(self.media_root, name)
+        with open(path, 'wb') as f:
+            f.write(synthetic_image(width, height, fmt=fmt, seed=seed))
+        return path
+
+class OfflineTestCase(OfflineMixin, TestCase):
+    pass
+
+def _result(**p50s):
+    return {'results': [
+        {'benchmark': name, 'format': None, 'resolution': None, 'p50_ms': p50} for name, p50 in p50s.items()
+    ]}
+
+class SyntheticImageTests(SimpleTestCase):
+    def test_formats_and_sizes(self):
+        for fmt in pipeline_benchmark.FORMATS:
+            with Image.open(io.BytesIO(synthetic_image(160, 90, fmt=fmt))) as img:
+                self.assertEqual((img.format, img.size), (fmt, (160, 90)))
+
+    def test_deterministic(self):
+        self.assertEqual(synthetic_image(64, 48, seed=3), synthetic_image(64, 48, seed=3))
+        self.assertNotEqual(synthetic_image(64, 48, seed=3), synthetic_image(64, 48, seed=4))
+
+class CompareTests(SimpleTestCase):
+    def test_flags_slower_measurements(self):
+        regressions = pipeline_benchmark.compare(
+            _result(predict=100.0, save=2.0), _result(predict=130.0, save=2.1, export_pdf=50.0), threshold=1.2,
+        )
+        self.assertEqual([row['benchmark'] for row in regressions], ['predict'])
+        self.assertEqual(regressions[0]['ratio'], 1.3)
+
+class PipelineBenchmarkTests(TestCase):
+    """Run the suite at a tiny size: it must work offline and leave nothing behind"""
+
+    def test_run_suite(self):
+        logged = []
+        result = pipeline_benchmark.run_suite(
+            resolutions=[(96, 64), (200, 150)], formats=['JPEG', 'PNG'], repeats=1, log=logged.append,
+        )
+        rows = result['results']
+        self.assertEqual(rows, logged)
+        for benchmark in ('preprocess', 'predict', 'save'):
+            self.assertEqual(
+                {(row['format'], row['resolution']) for row in rows if row['benchmark'] == benchmark},
+                {('JPEG', '96x64'), ('JPEG', '200x150'), ('PNG', '96x64'), ('PNG', '200x150')},
+            )
+        for benchmark in ('artifacts', 'export_pdf', 'export_pdf_stored'):
+            self.assertEqual(len([row for row in rows if row['benchmark'] == benchmark]), 1)
+        for row in rows:
+            self.assertEqual(row['runs'], 1)
+            self.assertGreater(row['p50_ms'], 0)
+        self.assertEqual(result['environment']['model'], 'resnet50-random-seed0')
+        json.dumps(result)
+
+        self.assertFalse(ForensicAnalysis.objects.exists())
+        self.assertFalse(ArtifactDetection.objects.exists())
+
+    def test_rejects_unknown_benchmark(self):
+        with self.assertRaises(ValueError):
+            pipeline_benchmark.run_suite(benchmarks=['train'])
+
+    def test_command_writes_json_and_compares(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'result.json')
+            options = ['--resolutions', '64x48', '--formats', 'jpeg', '--benchmarks', 'preprocess', 'save',
+                       '--repeats', '1']
+            call_command('benchmark_pipeline', *options, '--json', path, stdout=io.StringIO())
+            with open(path) as f:
+                result = json.load(f)
+            self.assertEqual([row['benchmark'] for row in result['results']], ['preprocess', 'save'])
+
+            # A baseline a thousand times faster makes every measurement a regression
+            for row in result['results']:
+                row['p50_ms'] /= 1000
+            with open(path, 'w') as f:
+                json.dump(result, f)
+            with self.assertRaises(CommandError):
+                call_command('benchmark_pipeline', *options, '--compare', path, stdout=io.StringIO(),
+                             stderr=io.StringIO())
+
+class PredictionCacheTests(OfflineTestCase):
+    def test_memory_tier_is_lru_backed_by_database(self):
+        cache = PredictionCache(max_entries=2)
+        for content_hash in ('a', 'b', 'c'):
+            cache.set(content_hash, 'v1', {'label': content_hash})
+        self.assertEqual(cache.get('c', 'v1'), {'label': 'c'})
+        # 'a' was evicted from memory but is still in the table
+        self.assertEqual(cache.get('a', 'v1'), {'label': 'a'})
+        self.assertIsNone(cache.get('a', 'v2'))
+        stats = cache.stats()
+        self.assertEqual((stats['memory_hits'], stats['db_hits'], stats['misses']), (1, 1, 1))
+        self.assertEqual(CachedPrediction.objects.get(content_hash='a').hit_count, 1)
+
+        cache.clear()
+        self.assertEqual(cache.get('b', 'v1'), {'label': 'b'})
+        self.assertEqual(cache.stats()['db_hits'], 2)
+
+    def test_dummy_model_results_stay_in_memory(self):
+        cache = PredictionCache()
+        cache.set('a', 'dummy-123', {'label': 'real'})
+        self.assertFalse(CachedPrediction.objects.exists())
+        cache.clear()
+        self.assertIsNone(cache.get('a', 'dummy-123'))
+
+    def test_predict_runs_the_model_once_per_content(self):
+        path = self.write_image()
+        copy = self.write_image('copy.jpg')
+        fake = mock.Mock(model_version='v1')
+        fake.predict.return_value = {'label': 'deepfake', 'confidence': 90.0}
+        cache = PredictionCache()
+        with mock.patch('deepimage.utils.prediction_cache.detector', fake):
+            first = cache.predict(path)
+            second = cache.predict(copy)
+        self.assertEqual(fake.predict.call_count, 1)
+        self.assertNotIn('cached', first)
+        self.assertTrue(second['cached'])
+        self.assertTrue(CachedPrediction.objects.filter(content_hash=file_sha256(path), model_version='v1').exists())
+
+class PreprocessingTests(OfflineTestCase):
+    def test_load_resizes_in_uint8(self):
+        for fmt, name in (('JPEG', 'a.jpg'), ('PNG', 'a.png')):
+            array = preprocessor.load(self.write_image(name, 640, 480, fmt=fmt))
+            self.assertEqual((array.shape, array.dtype), ((224, 224, 3), np.uint8))
+
+    def test_load_closes_the_files_it_opens(self):
+        # A truncated upload fails while decoding, before PIL would close the file itself
+        path = os.path.join(self.media_root, 'truncated.jpg')
+        with open(path, 'wb') as f:
+            f.write(synthetic_image(320, 240)[:2000])
+        files = []
+        open_image = preprocessor.open
+
+        def spy(source):
+            img = open_image(source)
+            files.append(img.fp)
+            return img
+
+        with mock.patch.object(preprocessor, 'open', side_effect=spy), self.assertRaises(OSError):
+            preprocessor.load(path)
+        self.assertTrue(files[0].closed)
+        # File objects belong to the caller and stay open
+        with open(self.write_image('a.jpg'), 'rb') as f:
+            preprocessor.load(f)
+            self.assertFalse(f.closed)
+
+    def test_draft_decoding_stays_close_to_full_decoding(self):
+        path = self.write_image('large.jpg', 1600, 1200)
+        with Image.open(path) as img:
+            full = np.asarray(img.convert('RGB').resize((224, 224), Image.BILINEAR), dtype=np.float32)
+        self.assertLess(np.abs(preprocessor.load(path).astype(np.float32) - full).mean(), 4.0)
+
+    def test_normalize_matches_float_reference(self):
+        arrays = [preprocessor.load(self.write_image(f"{seed}.jpg", seed=seed)) for seed in range(2)]
+        batch = preprocessor.normalize(arrays)
+        mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+        std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+        expected = ((np.stack(arrays).astype(np.float32) / 255 - mean) / std).transpose(0, 3, 1, 2)
+        self.assertEqual(batch.shape, (2, 3, 224, 224))
+        np.testing.assert_allclose(batch, expected, atol=1e-5)
+        # Single images get an array of their own rather than the shared buffer
+        single = preprocessor(self.write_image('single.jpg'))
+        self.assertFalse(np.shares_memory(single, preprocessor.buffer(1)))
+
+class JobQueueTests(SimpleTestCase):
+    def test_rejects_jobs_beyond_capacity(self):
+        jobs = JobQueue('test', workers=1, max_pending=1)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        jobs.submit(block)
+        self.assertTrue(started.wait(5))
+        jobs.submit(lambda: None)
+        with self.assertRaises(QueueFull):
+            jobs.submit(lambda: None)
+        release.set()
+        jobs._queue.join()
+        stats = jobs.stats()
+        self.assertEqual((stats['submitted'], stats['rejected'], stats['completed']), (2, 1, 2))
+
+class AnalysisJobTests(OfflineTestCase):
+    def submit(self, name='upload.jpg'):
+        upload = SimpleUploadedFile(name, synthetic_image(160, 120), content_type='image/jpeg')
+        with mock.patch.object(analysis_queue, 'submit') as submit:
+            response = self.client.post(reverse('submit_analysis'), {
+                'media_source': 'file_upload', 'media_type': 'image', 'original_file': upload,
+            })
+        self.assertEqual(response.status_code, 202)
+        analysis = ForensicAnalysis.objects.get(report_id=response.json()['report_id'])
+        submit.assert_called_once_with(views.run_analysis_job, analysis.id)
+        return analysis
+
+    def test_queued_analysis_is_done_once_results_are_written(self):
+        analysis = self.submit()
+        self.assertEqual(analysis.status, 'queued')
+        status_url = reverse('analysis_status', args=[analysis.report_id])
+        self.assertNotIn('result', self.client.get(status_url).json())
+        self.assertTemplateUsed(self.client.get(reverse('analysis_report', args=[analysis.report_id])),
+                                'analysis_pending.html')
+
+        views.run_analysis_job(analysis.id)
+        analysis.refresh_from_db()
+        self.assertEqual(analysis.status, 'done')
+        self.assertIn('label', analysis.raw_prediction_data)
+        self.assertEqual(ArtifactDetection.objects.filter(analysis=analysis).count(), len(analysis.detected_artifacts))
+        result = self.client.get(status_url).json()['result']
+        self.assertEqual(result['classification'], analysis.classification)
+        self.assertTemplateUsed(self.client.get(reverse('analysis_report', args=[analysis.report_id])),
+                                'forensic_result.html')
+
+    def test_failed_prediction_marks_analysis_failed(self):
+        analysis = self.submit()
+        with mock.patch.object(views.near_duplicates, 'predict', return_value=({'error': 'broken'}, None)):
+            with self.assertRaises(RuntimeError):
+                views.run_analysis_job(analysis.id)
+        analysis.refresh_from_db()
+        self.assertEqual((analysis.status, analysis.raw_prediction_data), ('failed', {'error': 'broken'}))
+
+    def test_full_queue_discards_the_upload(self):
+        upload = SimpleUploadedFile('upload.jpg', synthetic_image(64, 48), content_type='image/jpeg')
+        with mock.patch.object(analysis_queue, 'submit', side_effect=QueueFull('full')):
+            response = self.client.post(reverse('submit_analysis'), {
+                'media_source': 'file_upload', 'media_type': 'image', 'original_file': upload,
+            })
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(ForensicAnalysis.objects.exists())
+
+    def test_interrupted_analyses_fail_after_restart(self):
+        ForensicAnalysis.objects.bulk_create([
+            ForensicAnalysis(report_id=report_id, original_file='x.jpg', status=status)
+            for report_id, status in (('OLD-Q', 'queued'), ('OLD-R', 'running'), ('OLD-D', 'done'), ('NEW-Q', 'queued'))
+        ])
+        ForensicAnalysis.objects.exclude(report_id='NEW-Q').update(
+            analysis_date=job_queue.PROCESS_STARTED - timedelta(minutes=1)
+        )
+        with mock.patch.object(job_queue, '_recovered', False):
+            job_queue.fail_interrupted_analyses()
+        self.assertEqual(dict(ForensicAnalysis.objects.values_list('report_id', 'status')), {
+            'OLD-Q': 'failed', 'OLD-R': 'failed', 'OLD-D': 'done', 'NEW-Q': 'queued',
+        })
+
+class BatchPredictTests(OfflineTestCase):
+    def post(self, **files):
+        response = self.client.post(reverse('api_predict_batch'), files)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        return response, lines
+
+    def images(self, *seeds):
+        return [SimpleUploadedFile(f"{seed}.jpg", synthetic_image(64, 48, seed=seed), content_type='image/jpeg')
+                for seed in seeds]
+
+    def test_streams_results_in_input_order(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            z.writestr('inner/2.png', synthetic_image(64, 48, fmt='PNG', seed=2))
+            z.writestr('notes.txt', b'not an image')
+        archive = SimpleUploadedFile('batch.zip', archive.getvalue(), content_type='application/zip')
+        unsupported = SimpleUploadedFile('notes.txt', b'text', content_type='text/plain')
+
+        response, lines = self.post(images=self.images(0, 1) + [unsupported], archive=archive)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([(line['index'], line['name'], line['success']) for line in lines], [
+            (0, '0.jpg', True), (1, '1.jpg', True), (2, 'notes.txt', False), (3, 'inner/2.png', True),
+        ])
+        self.assertIn(lines[0]['prediction'], ('real', 'deepfake'))
+
+        _, again = self.post(images=self.images(1))
+        self.assertTrue(again[0]['cached'])
+        self.assertEqual(again[0]['confidence'], lines[1]['confidence'])
+
+    def test_rejects_empty_and_oversized_requests(self):
+        self.assertEqual(self.client.post(reverse('api_predict_batch')).status_code, 400)
+        with override_settings(DEEPIMAGE_BATCH_PREDICT_MAX_IMAGES=1):
+            response = self.client.post(reverse('api_predict_batch'), {'images': self.images(0, 1)})
+        self.assertEqual(response.status_code, 400)
+
+class AsyncInferenceTests(OfflineTestCase):
+    """The async views under ASGI, through the async test client"""
+
+    def upload(self, seed=0):
+        return SimpleUploadedFile(f"{seed}.jpg", synthetic_image(64, 48, seed=seed), content_type='image/jpeg')
+
+    async def read(self, response):
+        self.assertTrue(response.is_async)
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    async def test_executor_rejects_calls_beyond_max_pending(self):
+        executor = async_inference.InferenceExecutor(workers=1, max_pending=1)
+        release = threading.Event()
+        running = asyncio.ensure_future(executor.run(release.wait, 5))
+        await asyncio.sleep(0)
+        with self.assertRaises(QueueFull):
+            await executor.run(int)
+        release.set()
+        self.assertTrue(await running)
+        stats = executor.stats()
+        self.assertEqual((stats['in_flight'], stats['completed'], stats['rejected']), (0, 1, 1))
+
+    async def test_api_predict_runs_on_the_executor(self):
+        completed = async_inference.inference_executor.stats()['completed']
+        response = await self.async_client.post(reverse('api_predict'), {'image': self.upload()})
+        self.assertTrue(response.json()['success'])
+        self.assertIn(response.json()['prediction'], ('real', 'deepfake'))
+        # Hashing and the forward pass
+        self.assertEqual(async_inference.inference_executor.stats()['completed'], completed + 2)
+
+    async def test_api_predict_sheds_load_when_the_executor_is_full(self):
+        with mock.patch.object(async_inference.inference_executor, 'max_pending', 0):
+            response = await self.async_client.post(reverse('api_predict'), {'image': self.upload()})
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '5'))
+        self.assertFalse(await UploadedImage.objects.aexists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+
+    async def test_export_pdf_streams_the_stored_file(self):
+        self.write_image()
+        analysis = await ForensicAnalysis.objects.acreate(
+            report_id='PDF-A', original_file='image.jpg', status='done', classification='likely_genuine',
+            authenticity_score=91.5, raw_prediction_data={'label': 'real', 'confidence': 91.5, 'is_deepfake': False},
+        )
+        url = reverse('export_pdf', args=[analysis.id])
+        with mock.patch.object(async_inference.inference_executor, 'max_pending', 0):
+            response = await self.async_client.get(url)
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '5'))
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue((await self.read(response)).startswith(b'%PDF'))
+
+    async def test_batch_predictions_stream_asynchronously(self):
+        response = await self.async_client.post(reverse('api_predict_batch'), {
+            'images': [self.upload(0), self.upload(1)],
+        })
+        lines = [json.loads(line) for line in (await self.read(response)).decode().splitlines()]
+        self.assertEqual([(line['index'], line['success']) for line in lines], [(0, True), (1, True)])
+
+def _jpeg_with_exif(width=320, height=240, **tags):
+    img = Image.fromarray(np.asarray(Image.open(io.BytesIO(synthetic_image(width, height)))))
+    exif = img.getexif()
+    for name, value in tags.items():
+        exif[getattr(ExifTags.Base, name)] = value
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+class IngestTests(OfflineTestCase):
+    def test_single_pass_hashes_and_header(self):
+        data = _jpeg_with_exif(Make='TestCam')
+        result = ingest_file(SimpleUploadedFile('a.jpg', data), header_bytes=1024, chunk_size=4096)
+        self.assertEqual((result.sha256, result.md5, result.size), (
+            hashlib.sha256(data).hexdigest(), hashlib.md5(data).hexdigest(), len(data),
+        ))
+        self.assertEqual(result.header, data[:1024])
+        self.assertFalse(result.complete)
+        self.assertEqual(result.image_info(), ('JPEG', 320, 240))
+        self.assertEqual(str(result.exif_tags()['Image Make']), 'TestCam')
+
+    def test_saving_an_analysis_records_file_details(self):
+        data = _jpeg_with_exif(Make='TestCam')
+        analysis = ForensicAnalysis(original_file=SimpleUploadedFile('a.jpg', data))
+        analysis.save()
+        self.assertEqual((analysis.file_hash_sha256, analysis.file_size, analysis.resolution, analysis.file_format),
+                         (hashlib.sha256(data).hexdigest(), len(data), '320x240', 'jpg'))
+        self.assertEqual(analysis.exif_data['Image Make'], 'TestCam')
+        self.assertIn('Missing expected EXIF tag: Image Model', analysis.metadata_inconsistencies)
+
+    def test_decoded_image_is_shared_by_every_stage(self):
+        info = PngInfo()
+        info.add_text('parameters', 'a cat, steps 20')
+        path = os.path.join(self.media_root, 'generated.png')
+        Image.open(io.BytesIO(synthetic_image(320, 240))).save(path, pnginfo=info)
+
+        image = preprocessor.decode(path)
+        self.assertEqual((image.format, image.size, image.native, image.path), ('PNG', (320, 240), True, path))
+        np.testing.assert_array_equal(preprocessor.load(image), preprocessor.load(path))
+        self.assertIs(preprocessor.load(image), preprocessor.load(image))
+        self.assertEqual(artifact_detection.detect_toolkit(image), 'Stable Diffusion')
+        self.assertEqual(file_sha256(image), file_sha256(path))
+
+    def test_large_jpegs_are_decoded_at_reduced_scale(self):
+        path = self.write_image('large.jpg', 1600, 1200)
+        image = preprocessor.decode(path, max_pixels=500_000)
+        self.assertFalse(image.native)
+        self.assertEqual(image.size, (1600, 1200))
+        self.assertEqual(image.rgb.shape, (600, 800, 3))
+        self.assertFalse(artifact_detection.ImagePyramid(image).native)
+
+class FileChangeTests(OfflineTestCase):
+    def test_integrity_data_is_only_recomputed_when_the_file_changes(self):
+        with mock.patch('deepimage.models.ingest_file', wraps=ingest_file) as ingest:
+            analysis = ForensicAnalysis(original_file=SimpleUploadedFile('a.jpg', synthetic_image(64, 48)))
+            analysis.save()
+            self.assertEqual(ingest.call_count, 1)
+
+            analysis.summary = 'Reviewed'
+            analysis.save()
+            ForensicAnalysis.objects.get(id=analysis.id).save()
+            ForensicAnalysis.objects.only('id', 'summary').get(id=analysis.id).save(update_fields=['summary'])
+            self.assertEqual(ingest.call_count, 1)
+
+            first_hash = analysis.file_hash_sha256
+            analysis.original_file = SimpleUploadedFile('b.jpg', synthetic_image(64, 48, seed=1))
+            analysis.save(update_fields=['original_file'])
+            self.assertEqual(ingest.call_count, 2)
+        analysis.refresh_from_db()
+        self.assertNotEqual(analysis.file_hash_sha256, first_hash)
+        self.assertEqual(analysis.file_hash_sha256, file_sha256(analysis.original_file.path))
+
+class VerifyHashesTests(OfflineMixin, TransactionTestCase):
+    def call(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('verify_hashes', '--workers', '2', '--chunk-size', '2', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_detects_fixes_and_backfills_hashes(self):
+        analyses = [ForensicAnalysis.objects.create(original_file=SimpleUploadedFile(f"{seed}.jpg", synthetic_image(
+            64, 48, seed=seed))) for seed in range(5)]
+        ForensicAnalysis.objects.filter(id=analyses[1].id).update(file_hash_md5='0' * 32)
+        ForensicAnalysis.objects.filter(id=analyses[2].id).update(file_hash_sha256='', resolution='')
+
+        with self.assertRaises(CommandError):
+            self.call()
+        out, _ = self.call('--backfill')
+        self.assertIn('Processed 1 analyses', out)
+        self.assertEqual(ForensicAnalysis.objects.get(id=analyses[2].id).resolution, '64x48')
+
+        out, err = self.call('--fix')
+        self.assertIn('4 ok, 1 updated, 0 mismatch', out)
+        self.assertEqual(ForensicAnalysis.objects.get(id=analyses[1].id).file_hash_md5,
+                         hashlib.md5(synthetic_image(64, 48, seed=1)).hexdigest())
+
+        os.remove(analyses[4].original_file.path)
+        out, err = self.call('--ids', str(analyses[3].id), str(analyses[4].id))
+        self.assertIn('1 ok, 0 updated, 0 mismatch, 1 missing', out)
+        self.assertIn(f"{analyses[4].report_id} (id {analyses[4].id}): missing", err)
+
+class MicroBatcherTests(SimpleTestCase):
+    def test_coalesces_concurrent_items_into_one_call(self):
+        calls = []
+
+        def run_batch(items):
+            calls.append(list(items))
+            return [item * 10 for item in items]
+
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=500, name='test')
+        futures = [batcher.submit(item) for item in range(6)]
+        self.assertEqual([future.result(5) for future in futures], [0, 10, 20, 30, 40, 50])
+        self.assertEqual(calls[0], [0, 1, 2, 3])
+        self.assertEqual(sum(calls, []), list(range(6)))
+        stats = batcher.stats()
+        self.assertEqual((stats['total_items'], stats['total_batches']), (6, len(calls)))
+
+    def test_batch_errors_reach_every_caller(self):
+        batcher = MicroBatcher(lambda items: 1 / 0, max_batch_size=2, max_wait_ms=200, name='test')
+        futures = [batcher.submit(item) for item in range(2)]
+        for future in futures:
+            with self.assertRaises(ZeroDivisionError):
+                future.result(5)
+        self.assertEqual(batcher.stats()['total_errors'], 1)
+
+    def test_concurrent_callers_share_batches(self):
+        calls = []
+        batcher = MicroBatcher(lambda items: calls.append(len(items)) or [-item for item in items],
+                               max_batch_size=8, max_wait_ms=200, name='test')
+        start, results = threading.Barrier(8), {}
+
+        def call(item):
+            start.wait()
+            results[item] = batcher.submit(item).result(5)
+
+        threads = [threading.Thread(target=call, args=(item,)) for item in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {item: -item for item in range(8)})
+        self.assertEqual(sum(calls), 8)
+        self.assertLess(len(calls), 8)
+
+    def test_malformed_batch_output_fails_callers_and_keeps_the_worker(self):
+        outputs = [['only one'], ['a', 'b']]
+        batcher = MicroBatcher(lambda items: outputs.pop(0), max_batch_size=2, max_wait_ms=200, name='test')
+        futures = [batcher.submit(item) for item in range(2)]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(5)
+        worker = batcher._worker
+        # A caller that gave up does not stop the others from being served
+        futures = [batcher.submit(item) for item in range(2)]
+        futures[0].cancel()
+        self.assertEqual(futures[1].result(5), 'b')
+        self.assertIs(batcher._worker, worker)
+        self.assertTrue(worker.is_alive())
+        self.assertEqual(batcher.stats()['total_errors'], 1)
+
+class PersistenceTests(OfflineTestCase):
+    def finished(self, seed=0, artifacts=2):
+        analysis = ForensicAnalysis.objects.create(
+            original_file=SimpleUploadedFile(f"{seed}.jpg", synthetic_image(64, 48, seed=seed))
+        )
+        analysis.summary = f"Result {seed}"
+        analysis.classification = 'suspected_fake'
+        analysis.detected_artifacts = [
+            {'type': 'error_level', 'confidence': 0.8, 'location': 'centre', 'description': f"Artifact {index}"}
+            for index in range(artifacts)
+        ]
+        return analysis
+
+    def test_results_and_artifacts_are_written_together(self):
+        analysis = self.finished()
+        save_analysis_results(analysis, analysis.detected_artifacts)
+        stored = ForensicAnalysis.objects.get(id=analysis.id)
+        self.assertEqual((stored.summary, stored.classification), ('Result 0', 'suspected_fake'))
+        self.assertEqual(ArtifactDetection.objects.filter(analysis=analysis).count(), 2)
+
+        failing = self.finished(seed=1)
+        with mock.patch.object(ArtifactDetection.objects, 'bulk_create', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                save_analysis_results(failing, failing.detected_artifacts)
+        self.assertEqual(ForensicAnalysis.objects.get(id=failing.id).summary, '')
+
+    def test_writer_retries_a_failed_batch_one_write_at_a_time(self):
+        writer = ResultWriter(max_batch_size=4)
+        good, bad = self.finished(seed=0), self.finished(seed=1)
+        writes = [_result_write(good, good.detected_artifacts), _result_write(bad, bad.detected_artifacts)]
+        writes[1][1]['no_such_field'] = 1
+        outcomes = writer._write_batch(writes)
+        self.assertIsNone(outcomes[0])
+        self.assertIsInstance(outcomes[1], Exception)
+        self.assertEqual(ForensicAnalysis.objects.get(id=good.id).summary, 'Result 0')
+        self.assertFalse(ArtifactDetection.objects.filter(analysis=bad).exists())
+
+class LazyDetectorTests(SimpleTestCase):
+    def test_builds_the_detector_once_on_first_use(self):
+        instance = mock.Mock(model_version='v1')
+        factory = mock.Mock(return_value=instance)
+        lazy = LazyDetector(factory)
+        self.assertFalse(lazy.stats()['startup']['loaded'])
+        factory.assert_not_called()
+
+        self.assertEqual(lazy.model_version, 'v1')
+        lazy.predict('image.jpg')
+        factory.assert_called_once_with()
+        instance.predict.assert_called_once_with('image.jpg')
+
+        lazy.warm_up()
+        lazy.warm_up()
+        self.assertEqual(instance.forward_arrays.call_count, 1)
+
+    def test_only_server_processes_warm_up(self):
+        cases = [
+            (['manage.py', 'test'], {}, True),
+            (['manage.py', 'runserver'], {}, True),
+            (['manage.py', 'runserver'], {'RUN_MAIN': 'true'}, False),
+            (['manage.py', 'runserver', '--noreload'], {}, False),
+            (['/venv/bin/gunicorn', 'backend.wsgi'], {}, False),
+            (['/venv/lib/python3/site-packages/uvicorn/__main__.py', 'backend.asgi:application'], {}, False),
+            (['/venv/bin/pytest'], {}, True),
+            (['/venv/lib/python3/site-packages/pytest/__main__.py'], {}, True),
+            (['-c'], {}, True),
+            (['script.py'], {}, True),
+            (['script.py'], {'DEEPIMAGE_FAST_START': '0'}, False),
+            (['/venv/bin/gunicorn'], {'DEEPIMAGE_FAST_START': '1'}, True),
+        ]
+        for argv, environ, expected in cases:
+            environ = {'DEEPIMAGE_FAST_START': '', 'RUN_MAIN': '', **environ}
+            with self.subTest(argv=argv, environ=environ), mock.patch.object(sys, 'argv', argv), \
+                    mock.patch.dict(os.environ, environ):
+                self.assertEqual(is_fast_start(), expected)
+
+class InferenceBackendTests(OfflineTestCase):
+    def detector(self, **overrides):
+        self.write_image('calibration/a.jpg', 320, 240, seed=0)
+        self.write_image('calibration/b.png', 320, 240, fmt='PNG', seed=1)
+        with override_settings(DEEPIMAGE_CALIBRATION_DIR=os.path.join(self.media_root, 'calibration'), **overrides):
+            return pipeline_benchmark.random_detector()
+
+    def write_image(self, name, *args, **kwargs):
+        os.makedirs(os.path.join(self.media_root, os.path.dirname(name)), exist_ok=True)
+        return super().write_image(name, *args, **kwargs)
+
+    def test_verified_backend_serves_predictions(self):
+        eager = self.detector()
+        fast = self.detector(DEEPIMAGE_INFERENCE_BACKEND='channels_last')
+        self.assertEqual(fast.backend, 'channels_last')
+        self.assertEqual(fast.backend_check['agreement'], 1.0)
+        self.assertTrue(fast.model_version.endswith('+channels_last'))
+        path = self.write_image('image.jpg', 160, 120)
+        self.assertEqual(fast.predict(path)['label'], eager.predict(path)['label'])
+
+    def test_disagreeing_or_unknown_backend_falls_back_to_eager(self):
+        detector = self.detector(DEEPIMAGE_INFERENCE_BACKEND='dynamic_int8', DEEPIMAGE_BACKEND_MIN_AGREEMENT=1.01)
+        self.assertEqual(detector.backend, 'eager')
+        self.assertIsNotNone(detector.backend_check)
+        self.assertEqual(self.detector(DEEPIMAGE_INFERENCE_BACKEND='fp4').backend, 'eager')
+        with self.assertRaises(ValueError):
+            inference_backends.build_backend('fp4', None)
+
+@skipUnless(importlib.util.find_spec('onnxruntime') and importlib.util.find_spec('onnx'), "onnxruntime is not installed")
+class OnnxEngineTests(OfflineTestCase):
+    def export(self):
+        import torch
+        path = os.path.join(self.media_root, 'detector.onnx')
+        torch.manual_seed(0)
+        call_command('export_onnx', output=path, validation_dir=None, validation_images=4, stdout=io.StringIO(),
+                     stderr=io.StringIO())
+        return path
+
+    def test_exported_model_matches_torch(self):
+        from .utils.onnx_engine import OnnxDetector
+        with override_settings(DEEPIMAGE_ONNX_PATH=self.export()):
+            onnx_detector = OnnxDetector()
+        eager = pipeline_benchmark.random_detector(0)
+        # The version comes from the export's metadata rather than the file name
+        self.assertTrue(onnx_detector.model_version.startswith('dummy-'))
+        path = self.write_image()
+        expected, actual = eager.predict(path), onnx_detector.predict(path)
+        self.assertEqual(actual['label'], expected['label'])
+        self.assertAlmostEqual(actual['confidence'], expected['confidence'], delta=0.05)
+
+    def test_exports_the_fp32_checkpoint_under_its_own_version(self):
+        import torch
+        from .utils.model_loader import checkpoint_version, dummy_model
+        from .utils.onnx_engine import OnnxDetector
+        checkpoint = os.path.join(self.media_root, 'detector.pth')
+        torch.save({'model_state_dict': dummy_model().model.state_dict()}, checkpoint)
+        # The serving backend's suffix never reaches the export's metadata
+        with override_settings(DEEPIMAGE_MODEL_PATH=checkpoint, DEEPIMAGE_INFERENCE_BACKEND='dynamic_int8'):
+            path = self.export()
+        with override_settings(DEEPIMAGE_ONNX_PATH=path):
+            version = OnnxDetector().model_version
+        self.assertEqual(version, checkpoint_version(checkpoint))
+
+    def test_missing_export_reports_model_not_loaded(self):
+        from .utils.onnx_engine import OnnxDetector
+        with override_settings(DEEPIMAGE_ONNX_PATH=os.path.join(self.media_root, 'missing.onnx')):
+            detector = OnnxDetector()
+        self.assertIsNone(detector.model)
+        self.assertIn('error', detector.predict(self.write_image()))
+
+class HeatmapTests(OfflineTestCase):
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(DEEPIMAGE_HEATMAP_MODE='lazy')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.write_image('image.jpg', 160, 120)
+        self.analysis = ForensicAnalysis.objects.create(report_id='HEAT-1', original_file='image.jpg', status='done')
+
+    def test_saliency_map_shares_the_forward_pass(self):
+        path = self.write_image('other.jpg', 160, 120, seed=3)
+        result, cam = heatmaps.detector.predict_with_saliency(path)
+        self.assertEqual(result, heatmaps.detector.predict(path))
+        self.assertEqual(cam.ndim, 2)
+        self.assertTrue(np.isfinite(cam).all())
+
+    def test_heatmap_is_generated_once_per_content_hash(self):
+        self.assertTrue(self.analysis.file_hash_sha256)
+        self.assertTrue(heatmaps.heatmap_pending(self.analysis))
+        self.assertIsNone(heatmaps.existing_heatmap(self.analysis))
+
+        name = heatmaps.ensure_heatmap(self.analysis)
+        self.assertIn(self.analysis.file_hash_sha256, name)
+        with Image.open(heatmaps.heatmap_file(name)) as overlay:
+            self.assertEqual(overlay.format, 'PNG')
+        self.assertFalse(heatmaps.heatmap_pending(self.analysis))
+
+        # A second analysis of the same content reuses the stored overlay
+        copy = ForensicAnalysis.objects.create(report_id='HEAT-2', original_file='image.jpg', status='done')
+        with mock.patch.object(heatmaps.detector.get(), 'predict_with_saliency') as predict:
+            self.assertEqual(heatmaps.ensure_heatmap(copy), name)
+        predict.assert_not_called()
+
+    def test_heatmaps_can_be_switched_off(self):
+        with override_settings(DEEPIMAGE_HEATMAP_MODE='off'):
+            self.assertIsNone(heatmaps.ensure_heatmap(self.analysis))
+            self.assertFalse(heatmaps.heatmap_pending(self.analysis))
+            self.assertEqual(heatmaps.deferred_heatmap_path(self.analysis), '')
+        self.assertEqual(heatmaps.deferred_heatmap_path(self.analysis),
+                         reverse('analysis_heatmap', args=[self.analysis.id]))
+
+class ArtifactDetectionTests(OfflineTestCase):
+    def test_toolkit_is_read_from_exif_and_png_text(self):
+        path = os.path.join(self.media_root, 'exif.jpg')
+        with open(path, 'wb') as f:
+            f.write(_jpeg_with_exif(Software='DeepFaceLab 2.0'))
+        self.assertEqual(artifact_detection.detect_toolkit(path), 'DeepFaceLab')
+        self.assertEqual(artifact_detection.detect_toolkit(preprocessor.decode(path)), 'DeepFaceLab')
+
+        info = PngInfo()
+        info.add_text('parameters', 'a portrait, Steps: 20')
+        png = os.path.join(self.media_root, 'generated.png')
+        Image.new('RGB', (64, 64)).save(png, pnginfo=info)
+        self.assertEqual(artifact_detection.detect_toolkit(preprocessor.decode(png)), 'Stable Diffusion')
+        self.assertEqual(artifact_detection.detect_toolkit(self.write_image()), '')
+
+    def test_pyramid_levels(self):
+        path = self.write_image('large.jpg', 1024, 768)
+        pyramid = artifact_detection.ImagePyramid(path)
+        self.assertTrue(pyramid.native)
+        self.assertEqual([pyramid.level(size).shape[:2] for size in artifact_detection.PYRAMID_SIZES],
+                         [(384, 512), (192, 256), (96, 128)])
+        self.assertEqual(pyramid.crop.shape[:2], (768, 768))
+        # Above the pixel limit the block-grid detectors no longer apply
+        reduced = artifact_detection.ImagePyramid(path, max_pixels=100_000)
+        self.assertFalse(reduced.native)
+        self.assertEqual(reduced.size, (1024, 768))
+
+    def test_every_detector_reports_within_budget(self):
+        path = self.write_image('image.jpg', 640, 480)
+        artifacts, report = artifact_detection.analyze(path, budget_ms=10_000, min_confidence=0)
+        types = [artifact['type'] for artifact in artifacts]
+        self.assertCountEqual(types + report['not_applicable'], [name for name, _ in artifact_detection.DETECTORS])
+        self.assertEqual(report['skipped'], [])
+        confidences = [artifact['confidence'] for artifact in artifacts]
+        self.assertEqual(confidences, sorted(confidences, reverse=True))
+        self.assertTrue(all(0 <= confidence <= 1 for confidence in confidences))
+
+        artifacts, report = artifact_detection.analyze(path, budget_ms=0)
+        self.assertEqual(artifacts, [])
+        self.assertCountEqual(report['skipped'], [name for name, _ in artifact_detection.DETECTORS])
+
+class AnalysisPipelineTests(SimpleTestCase):
+    def test_stage_outcomes(self):
+        pipeline = AnalysisPipeline(workers=3)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        pipeline.stage('double', timeout_ms=5000)(lambda image: image * 2)
+        pipeline.stage('slow', timeout_ms=50, default='late')(lambda image: release.wait(5))
+
+        @pipeline.stage('broken', timeout_ms=5000, default=[])
+        def broken(image):
+            raise ValueError('bad image')
+
+        run = pipeline.run(21)
+        self.assertEqual(run.results, {'double': 42, 'slow': 'late', 'broken': []})
+        report = run.report()
+        self.assertEqual({name: timing['status'] for name, timing in report['stages'].items()},
+                         {'double': 'done', 'slow': 'skipped', 'broken': 'failed'})
+        with override_settings(DEEPIMAGE_ANALYSIS_STAGE_TIMEOUTS_MS={'slow': 250}):
+            self.assertEqual(pipeline.stages[1].timeout(), 0.25)
+
+    def test_unstarted_stages_are_cancelled_and_runs_are_isolated(self):
+        pipeline = AnalysisPipeline(workers=1)
+        release, calls = threading.Event(), []
+        self.addCleanup(release.set)
+        pipeline.stage('slow', timeout_ms=50)(lambda image: release.wait(5))
+        pipeline.stage('queued', timeout_ms=50)(calls.append)
+
+        first = pipeline.run('first')
+        self.assertEqual(first.timings['queued']['status'], 'skipped')
+        # The first run's stuck stage holds only its own pool
+        second = pipeline.start('second')
+        release.set()
+        with override_settings(DEEPIMAGE_ANALYSIS_STAGE_TIMEOUTS_MS={'slow': 5000, 'queued': 5000}):
+            second.collect()
+        self.assertEqual(second.timings['queued']['status'], 'done')
+        self.assertEqual(calls, ['second'])
+
+class EnsembleTests(OfflineTestCase):
+    MEMBERS = [
+        {'name': 'primary', 'view': 'identity', 'weight': 2.0},
+        {'name': 'flipped', 'view': 'hflip', 'weight': 1.0},
+        {'name': 'cropped', 'view': 'crop', 'weight': 1.0},
+    ]
+
+    def setUp(self):
+        super().setUp()
+        prediction_cache.clear()
+        self.addCleanup(prediction_cache.clear)
+        self.path = self.write_image()
+        self.result = detector.predict(self.path)
+
+    def refine(self, early_exit_confidence):
+        with override_settings(DEEPIMAGE_ENSEMBLE_MEMBERS=self.MEMBERS,
+                               DEEPIMAGE_ENSEMBLE_EARLY_EXIT_CONFIDENCE=early_exit_confidence):
+            return ensemble.refine(self.path, dict(self.result), file_sha256(self.path))
+
+    def test_without_members_the_prediction_is_unchanged(self):
+        self.assertEqual(ensemble.refine(self.path, dict(self.result), None), (self.result, {}))
+
+    def test_confident_gate_skips_the_other_members(self):
+        fused, details = self.refine(0)
+        self.assertEqual(fused, self.result)
+        self.assertTrue(details['early_exit'])
+        self.assertEqual(details['forward_passes'], 0)
+        self.assertEqual([member['status'] for member in details['members']], ['done', 'skipped', 'skipped'])
+
+    def test_members_are_fused_in_one_pass_and_cached(self):
+        fused, details = self.refine(101)
+        self.assertFalse(details['early_exit'] or details['cached'])
+        # Both augmented views of the serving model share one forward pass
+        self.assertEqual(details['forward_passes'], 1)
+        scores = {member['name']: member['deepfake_probability'] for member in details['members']}
+        expected = (2 * scores['primary'] + scores['flipped'] + scores['cropped']) / 4
+        self.assertAlmostEqual(details['deepfake_probability'], expected, places=5)
+        self.assertEqual(fused['is_deepfake'], details['deepfake_probability'] > 0.5)
+
+        again, details = self.refine(101)
+        self.assertTrue(details['cached'])
+        self.assertEqual(details['forward_passes'], 0)
+        self.assertEqual(again['label'], fused['label'])
+
+class ScanCommandTests(OfflineTestCase):
+    def setUp(self):
+        super().setUp()
+        prediction_cache.clear()
+        self.addCleanup(prediction_cache.clear)
+        sources = tempfile.TemporaryDirectory()
+        self.addCleanup(sources.cleanup)
+        self.sources = sources.name
+        os.makedirs(os.path.join(self.sources, 'photos', 'nested'))
+        for name, seed in (('a.jpg', 0), ('nested/b.png', 1), ('copy.jpg', 0)):
+            fmt = 'PNG' if name.endswith('.png') else 'JPEG'
+            with open(os.path.join(self.sources, 'photos', name), 'wb') as f:
+                f.write(synthetic_image(96, 64, fmt=fmt, seed=seed))
+        with open(os.path.join(self.sources, 'photos', 'notes.txt'), 'w') as f:
+            f.write('not an image')
+        self.archive = os.path.join(self.sources, 'archive.zip')
+        with zipfile.ZipFile(self.archive, 'w') as archive:
+            archive.writestr('c.jpg', synthetic_image(96, 64, seed=2))
+            archive.writestr('broken.jpg', b'not a jpeg')
+
+    def scan(self, *args, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('scan', os.path.join(self.sources, 'photos'), self.archive, *args, stdout=out, stderr=err,
+                     batch_size=2, workers=2, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_scans_directories_and_archives_into_analyses(self):
+        checkpoint = os.path.join(self.sources, 'scan.checkpoint')
+        out, err = self.scan(checkpoint=checkpoint)
+        self.assertIn('3 analysed', out)
+        self.assertIn('1 duplicates, 1 failed', out)
+        self.assertIn('broken.jpg', err)
+        analyses = ForensicAnalysis.objects.all()
+        self.assertEqual(analyses.count(), 3)
+        self.assertEqual(set(analyses.values_list('status', flat=True)), {'done'})
+        self.assertEqual(analyses.values('file_hash_sha256').distinct().count(), 3)
+        self.assertTrue(all(analysis.report_id.startswith('DFS-') for analysis in analyses))
+        # Only analysed images are copied to media storage, not duplicates or failures
+        self.assertCountEqual(os.listdir(os.path.join(self.media_root, 'forensic_uploads')),
+                              [os.path.basename(analysis.original_file.name) for analysis in analyses])
+        self.assertTrue(all(os.path.exists(analysis.original_file.path) for analysis in analyses))
+
+        # Resuming skips every entry already recorded in the checkpoint
+        out, _ = self.scan(checkpoint=checkpoint)
+        self.assertIn('Resuming: 5 entries already scanned', out)
+        self.assertEqual(ForensicAnalysis.objects.count(), 3)
+
+    def test_failed_writes_leave_no_stored_images(self):
+        with mock.patch.object(bulk_scan.rollups, 'increment', side_effect=RuntimeError('disk full')), \
+                self.assertRaises(RuntimeError):
+            self.scan()
+        self.assertFalse(ForensicAnalysis.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'forensic_uploads')), [])
+
+    def test_writes_csv_without_touching_the_database(self):
+        output = os.path.join(self.sources, 'scan.csv')
+        self.scan(format='csv', output=output)
+        self.assertFalse(ForensicAnalysis.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'forensic_uploads')))
+        with open(output, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(sorted(row['status'] for row in rows), ['done', 'done', 'done', 'duplicate', 'failed'])
+        with self.assertRaises(CommandError):
+            self.scan(format='csv')
+
+class _RecordingModel:
+    """Stand-in detector whose output row is the normalized red value of each image"""
+
+    def __init__(self):
+        self.buffers = []
+        self.batches = []
+
+    def allocate_batch(self, batch_size):
+        self.buffers.append(np.zeros((batch_size, 3, 2, 2), dtype=np.float32))
+        return self.buffers[-1]
+
+    def forward_normalized(self, batch):
+        buffer = next((index for index, buffer in enumerate(self.buffers) if batch.base is buffer), None)
+        self.batches.append(buffer)
+        return np.stack([batch[:, 0, 0, 0], -batch[:, 0, 0, 0]], axis=1)
+
+class PrefetchPipelineTests(SimpleTestCase):
+    @staticmethod
+    def load(item):
+        if item == 'cached':
+            return None
+        if item == 'broken':
+            raise ValueError('cannot decode')
+        return np.full((2, 2, 3), item, dtype=np.uint8)
+
+    @staticmethod
+    def red(value):
+        return (value / 255 - 0.485) / 0.229
+
+    def test_results_keep_input_order_and_rotate_buffers(self):
+        model = _RecordingModel()
+        pipeline = PrefetchPipeline(model, batch_size=2, workers=3, prefetch_batches=1)
+        items = list(range(10))
+        results = list(pipeline.imap(items, self.load))
+        self.assertEqual([item for item, _, _ in results], items)
+        for item, output, error in results:
+            self.assertIsNone(error)
+            self.assertAlmostEqual(float(output[0]), self.red(item), places=5)
+        # One buffer in the model and prefetch_batches being filled, reused in turn
+        self.assertEqual(len(model.buffers), 2)
+        self.assertEqual(model.batches, [0, 1, 0, 1, 0])
+        stats = pipeline.stats()
+        self.assertEqual((stats['images'], stats['batches'], stats['errors']), (10, 5, 0))
+
+    def test_skipped_and_failed_items_stay_out_of_the_batch(self):
+        model = _RecordingModel()
+        pipeline = PrefetchPipeline(model, batch_size=4, workers=2, prefetch_batches=1)
+        results = list(pipeline.imap([7, 'cached', 'broken', 9], self.load))
+        self.assertEqual([item for item, _, _ in results], [7, 'cached', 'broken', 9])
+        self.assertAlmostEqual(float(results[0][1][0]), self.red(7), places=5)
+        self.assertEqual(results[1][1:], (None, None))
+        self.assertIsNone(results[2][1])
+        self.assertIsInstance(results[2][2], ValueError)
+        self.assertAlmostEqual(float(results[3][1][0]), self.red(9), places=5)
+
+        model.forward_normalized = mock.Mock(side_effect=RuntimeError('out of memory'))
+        results = list(pipeline.imap([1, 'cached'], self.load))
+        self.assertIsInstance(results[0][2], RuntimeError)
+        self.assertEqual(results[1][1:], (None, None))
+        self.assertEqual(pipeline.stats()['errors'], 2)
+
+class PdfExportTests(OfflineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_image()
+        self.analysis = ForensicAnalysis.objects.create(
+            report_id='PDF-1', original_file='image.jpg', status='done', classification='likely_genuine',
+            authenticity_score=91.5, raw_prediction_data={'label': 'real', 'confidence': 91.5, 'is_deepfake': False},
+        )
+
+    def test_pdf_is_rendered_once_and_revalidated_by_etag(self):
+        url = reverse('export_pdf', args=[self.analysis.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        etag = response['ETag']
+        self.assertTrue(export_utils.pdf_stored(self.analysis))
+
+        with mock.patch.object(export_utils, 'render_pdf') as render:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(url).status_code, 200)
+        render.assert_not_called()
+
+        # Editing the report changes its state; the stale PDF goes when the new one is stored
+        old = os.path.join(self.media_root, export_utils.pdf_name(self.analysis))
+        self.analysis.summary = 'Reviewed'
+        self.analysis.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertFalse(os.path.exists(old))
+
+    @override_settings(DEEPIMAGE_PDF_PRERENDER=True)
+    def test_saves_queue_a_render_only_when_the_report_changes(self):
+        export_utils.ensure_pdf(self.analysis)
+        with mock.patch.object(export_utils, 'schedule_pdf') as schedule:
+            self.analysis.save()
+            schedule.assert_not_called()
+            self.analysis.summary = 'Reviewed'
+            self.analysis.save()
+            schedule.assert_called_once_with(self.analysis.id)
+
+    @override_settings(DEEPIMAGE_HEATMAP_MODE='lazy')
+    def test_report_queue_never_runs_the_model(self):
+        self.assertTrue(heatmaps.heatmap_pending(self.analysis))
+        with mock.patch.object(export_utils, 'schedule_pdf') as schedule:
+            self.analysis.summary = 'Reviewed'
+            self.analysis.save()
+        schedule.assert_not_called()
+        with mock.patch.object(detector.get(), 'predict_with_saliency') as predict:
+            export_utils.prerender_pdf(self.analysis.id)
+        predict.assert_not_called()
+        self.assertFalse(export_utils.pdf_stored(self.analysis))
+
+        heatmaps.ensure_heatmap(self.analysis)
+        export_utils.prerender_pdf(self.analysis.id)
+        self.assertTrue(export_utils.pdf_stored(self.analysis))
+
+@override_settings(DEEPIMAGE_EXPORT_WORKERS=0)
+class ZipExportTests(OfflineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_image()
+        for report_id, classification in (('ZIP-1', 'likely_genuine'), ('ZIP-2', 'suspected_fake')):
+            ForensicAnalysis.objects.create(
+                report_id=report_id, original_file='image.jpg', status='done', classification=classification,
+                raw_prediction_data={'label': 'real', 'confidence': 80.0, 'is_deepfake': False},
+            )
+        ForensicAnalysis.objects.create(report_id='ZIP-Q', original_file='image.jpg', status='queued')
+
+    def test_streams_reports_with_a_manifest(self):
+        response = self.client.get(reverse('export_reports'))
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()),
+                         ['manifest.csv', 'manifest.json', 'reports/ZIP-1.pdf', 'reports/ZIP-2.pdf'])
+        self.assertTrue(archive.read('reports/ZIP-1.pdf').startswith(b'%PDF'))
+        manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual([(row['report_id'], row['status']) for row in manifest['reports']],
+                         [('ZIP-1', 'ok'), ('ZIP-2', 'ok')])
+        rows = list(csv.DictReader(io.StringIO(archive.read('manifest.csv').decode())))
+        self.assertEqual([row['file'] for row in rows], ['reports/ZIP-1.pdf', 'reports/ZIP-2.pdf'])
+
+    def test_failed_reports_are_listed_in_the_manifest(self):
+        summary = {}
+        with mock.patch.object(export_utils, 'render_pdf', return_value=None):
+            data = b''.join(bulk_export.stream_export(bulk_export.filter_analyses(), summary=summary, workers=0))
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertEqual(sorted(archive.namelist()), ['manifest.csv', 'manifest.json'])
+        self.assertEqual({row['status'] for row in json.loads(archive.read('manifest.json'))['reports']}, {'failed'})
+        self.assertEqual((summary['reports'], summary['failed'], summary['bytes']), (0, 2, len(data)))
+
+    def test_filters_are_validated_and_limited(self):
+        response = self.client.get(reverse('export_reports'), {'classification': 'suspected_fake'})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIn('reports/ZIP-2.pdf', archive.namelist())
+        self.assertNotIn('reports/ZIP-1.pdf', archive.namelist())
+        self.assertEqual(self.client.get(reverse('export_reports'), {'classification': 'fake'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_reports'), {'media_source': 'nowhere'}).status_code, 404)
+        with override_settings(DEEPIMAGE_EXPORT_MAX_REPORTS=1):
+            self.assertEqual(self.client.get(reverse('export_reports')).status_code, 400)
+
+class NearDuplicateTests(OfflineTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(near_duplicates, 'index', near_duplicates.NearDuplicateIndex(refresh_seconds=0))
+        self.index = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.original = self.analysis('original.jpg', 'NEAR-1', confidence_level='high', raw_prediction_data={
+            'label': 'deepfake', 'confidence': 97.0, 'is_deepfake': True,
+        })
+
+    def analysis(self, name, report_id, data=None, **fields):
+        path = os.path.join(self.media_root, name)
+        with open(path, 'wb') as f:
+            f.write(data or synthetic_image(256, 192, seed=0))
+        analysis = ForensicAnalysis.objects.create(report_id=report_id, original_file=name, status='done', **fields)
+        near_duplicates.record(analysis, near_duplicates.fingerprint(path))
+        return analysis
+
+    def matches(self, name, data):
+        path = os.path.join(self.media_root, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        analysis = ForensicAnalysis.objects.create(report_id=f"Q-{name}", original_file=name, status='running')
+        return near_duplicates.find_matches(analysis, near_duplicates.fingerprint(path, analysis.file_hash_sha256))
+
+    def recompressed(self):
+        buffer = io.BytesIO()
+        Image.open(io.BytesIO(synthetic_image(256, 192, seed=0))).resize((240, 180)).save(buffer, 'JPEG', quality=60)
+        return buffer.getvalue()
+
+    def test_finds_exact_and_near_copies(self):
+        [exact] = self.matches('copy.jpg', synthetic_image(256, 192, seed=0))
+        self.assertEqual((exact['report_id'], exact['match']), ('NEAR-1', 'exact'))
+        [near] = self.matches('recompressed.jpg', self.recompressed())
+        self.assertEqual(near['match'], 'near')
+        self.assertLessEqual(max(near['phash_distance'], near['dhash_distance']), 10)
+        self.assertEqual(self.matches('other.jpg', synthetic_image(256, 192, seed=5)), [])
+
+    def test_reuses_only_confident_verdicts_of_the_serving_model(self):
+        matches = self.matches('recompressed.jpg', self.recompressed())
+        reused = near_duplicates.reused_verdict(matches)
+        self.assertEqual((reused['label'], reused['near_duplicate_of']), ('deepfake', 'NEAR-1'))
+        with override_settings(DEEPIMAGE_NEAR_DUPLICATE_REUSE_DISTANCE=-1):
+            self.assertIsNone(near_duplicates.reused_verdict(matches))
+        self.assertIsNone(near_duplicates.reused_verdict([{**matches[0], 'confidence_level': 'medium'}]))
+        self.assertIsNone(near_duplicates.reused_verdict([{**matches[0], 'model_version': 'older'}]))
+
+    def test_new_content_is_matched_by_the_embedding_of_its_forward_pass(self):
+        rng = np.random.default_rng(0)
+        embedding = near_duplicates.normalize_embedding(rng.random(2048))
+        fingerprint = near_duplicates.fingerprint(self.original.original_file.path)
+        fingerprint.embedding = embedding
+        near_duplicates.record(self.original, fingerprint)
+
+        # A different-looking image whose features match the original's
+        path = os.path.join(self.media_root, 'cropped.jpg')
+        with open(path, 'wb') as f:
+            f.write(synthetic_image(256, 192, seed=5))
+        analysis = ForensicAnalysis.objects.create(report_id='NEAR-3', original_file='cropped.jpg', status='running')
+        result = {'label': 'real', 'confidence': 60.0, 'is_deepfake': False, 'raw_output': [[0.6, 0.4]]}
+        similar = near_duplicates.normalize_embedding(embedding + rng.normal(0, 0.005, 2048))
+        with mock.patch.object(near_duplicates, 'predict', return_value=(result, similar)), \
+                mock.patch.object(near_duplicates, 'embedding_code', wraps=near_duplicates.embedding_code) as code:
+            _, stages = views.analyze_image(analysis, preprocessor.decode(path))
+            stages.collect()
+        [match] = analysis.cross_correlation
+        self.assertEqual((match['report_id'], match['match']), ('NEAR-1', 'near'))
+        self.assertGreater(match['phash_distance'], 10)
+        self.assertGreaterEqual(match['embedding_similarity'], 0.95)
+        # The hyperplane code is computed once, when the embedding is set
+        self.assertEqual(code.call_count, 1)
+        self.assertEqual(ImageFingerprint.objects.get(analysis=analysis).embedding_code,
+                         near_duplicates.to_signed(near_duplicates.embedding_code(similar)))
+
+    def test_rewritten_fingerprints_replace_their_indexed_codes(self):
+        self.assertEqual(len(self.matches('copy.jpg', synthetic_image(256, 192, seed=0))), 1)
+        # Another process re-records the original with the hashes of a different image
+        other = near_duplicates.fingerprint(self.analysis('other.jpg', 'NEAR-2', synthetic_image(256, 192, seed=5))
+                                            .original_file.path)
+        ImageFingerprint.objects.filter(analysis=self.original).update(
+            phash=near_duplicates.to_signed(other.phash), dhash=near_duplicates.to_signed(other.dhash),
+            updated_at=timezone.now(),
+        )
+        near = self.matches('recompressed.jpg', self.recompressed())
+        self.assertNotIn('NEAR-1', [match['report_id'] for match in near])
+        # The rewritten row was updated in place rather than added again
+        self.assertEqual(self.index.stats()['fingerprints'], 2)
+
+class AnalysisSearchTests(TestCase):
+    def setUp(self):
+        # Two analyses per day, so pages split rows that share an analysis_date
+        ForensicAnalysis.objects.bulk_create([
+            ForensicAnalysis(report_id=f"S-{index}", original_file='x.jpg', status='done',
+                             classification='suspected_fake' if index % 3 == 0 else 'likely_genuine')
+            for index in range(7)
+        ])
+        start = day_start(timezone.now().date()) - timedelta(days=3)
+        for analysis in ForensicAnalysis.objects.order_by('id'):
+            index = int(analysis.report_id[2:])
+            ForensicAnalysis.objects.filter(id=analysis.id).update(analysis_date=start + timedelta(days=index // 2))
+        self.expected = list(ForensicAnalysis.objects.order_by('-analysis_date', '-id').values_list('id', flat=True))
+
+    def pages(self, queryset, limit):
+        ids, cursor, pages = [], None, 0
+        while True:
+            rows, cursor = search_page(queryset, cursor, limit)
+            ids.extend(row.id for row in rows)
+            pages += 1
+            if cursor is None:
+                return ids, pages
+
+    def test_pages_cover_every_row_once_across_equal_dates(self):
+        for limit in (1, 2, 3, 7, 50):
+            with self.subTest(limit=limit):
+                ids, pages = self.pages(ForensicAnalysis.objects.all(), limit)
+                self.assertEqual(ids, self.expected)
+                # No empty trailing page when the rows fill the last one exactly
+                self.assertEqual(pages, -(-7 // limit))
+
+    def test_pages_are_stable_when_newer_rows_arrive(self):
+        rows, cursor = search_page(ForensicAnalysis.objects.all(), limit=3)
+        ForensicAnalysis.objects.bulk_create([ForensicAnalysis(report_id='S-new', original_file='x.jpg', status='done')])
+        rows, cursor = search_page(ForensicAnalysis.objects.all(), cursor, limit=3)
+        self.assertEqual([row.id for row in rows], self.expected[3:6])
+
+    def test_filters_limits_and_invalid_cursors(self):
+        ids, _ = self.pages(filter_analyses(classifications=['suspected_fake']), 1)
+        fakes = set(ForensicAnalysis.objects.filter(classification='suspected_fake').values_list('id', flat=True))
+        self.assertEqual(ids, [analysis_id for analysis_id in self.expected if analysis_id in fakes])
+        self.assertEqual(len(search_page(ForensicAnalysis.objects.all(), limit=0)[0]), 1)
+        with self.assertRaises(FilterError):
+            search_page(ForensicAnalysis.objects.all(), cursor='not-a-cursor')
+
+        url = reverse('search_analyses')
+        response = self.client.get(url, {'limit': 4}).json()
+        self.assertEqual([row['id'] for row in response['results']], self.expected[:4])
+        response = self.client.get(url, {'limit': 4, 'cursor': response['next_cursor']}).json()
+        self.assertEqual(([row['id'] for row in response['results']], response['next_cursor']),
+                         (self.expected[4:], None))
+        self.assertEqual(self.client.get(url, {'cursor': 'bad'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 'many'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'date_from': '2020-13-01'}).status_code, 400)
+
+class RollupTests(TestCase):
+    def setUp(self):
+        analyses = ForensicAnalysis.objects.bulk_create([
+            ForensicAnalysis(report_id=f"R-{index}", original_file='x.jpg', status='running') for index in range(4)
+        ])
+        outcomes = [
+            ('suspected_fake', 'high', 'DeepFaceLab', ['jpeg_grid', 'error_level']),
+            ('suspected_fake', 'medium', '', ['jpeg_grid']),
+            ('likely_genuine', 'high', '', []),
+        ]
+        for analysis, (classification, confidence_level, toolkit, artifact_types) in zip(analyses, outcomes):
+            analysis.status, analysis.classification = 'done', classification
+            analysis.confidence_level, analysis.detected_toolkit = confidence_level, toolkit
+            analysis.detected_artifacts = [
+                {'type': artifact_type, 'confidence': 0.9, 'location': 'center', 'description': artifact_type}
+                for artifact_type in artifact_types
+            ]
+            save_analysis_results(analysis, analysis.detected_artifacts)
+        # The fourth analysis never finishes and is not counted
+        self.today = timezone.localdate()
+
+    def rollup_rows(self):
+        return set(DailyRollup.objects.values_list('day', 'dimension', 'value', 'count'))
+
+    def test_increments_match_a_rebuild(self):
+        summary = rollups.summarize(self.today, self.today)
+        self.assertEqual(summary['totals'], {
+            'analyses': 3,
+            'classification': {'suspected_fake': 2, 'likely_genuine': 1},
+            'confidence_level': {'high': 2, 'medium': 1},
+            'toolkit': {'DeepFaceLab': 1},
+            'artifact_type': {'error_level': 1, 'jpeg_grid': 2},
+        })
+        incremented = self.rollup_rows()
+        call_command('compact_rollups', days=1, stdout=io.StringIO())
+        self.assertEqual(self.rollup_rows(), incremented)
+
+        response = self.client.get(reverse('analysis_stats'), {'date_from': self.today.isoformat()}).json()
+        self.assertEqual(response['totals']['analyses'], 3)
+        self.assertEqual(response['days'][0]['date'], self.today.isoformat())
+
+    def test_rebuild_corrects_drift_from_deleted_analyses(self):
+        ForensicAnalysis.objects.filter(report_id='R-0').delete()
+        self.assertEqual(rollups.summarize(self.today, self.today)['totals']['analyses'], 3)
+        call_command('compact_rollups', days=1, stdout=io.StringIO())
+        totals = rollups.summarize(self.today, self.today)['totals']
+        self.assertEqual(totals['analyses'], 2)
+        self.assertEqual(totals['toolkit'], {})
+        self.assertEqual(totals['artifact_type'], {'jpeg_grid': 1})
+        with self.assertRaises(CommandError):
+            call_command('compact_rollups', since='yesterday', stdout=io.StringIO())
+
+class MetricsTests(TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', "Test", 'step', buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe('decode', seconds)
+        with mock.patch.object(metrics.time, 'perf_counter', side_effect=[10.0, 10.2]):
+            with histogram.time('forward'):
+                pass
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{step="decode",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{step="decode",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{step="decode",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{step="decode"} 4', lines)
+        self.assertIn('test_seconds_bucket{step="forward",le="0.1"} 0', lines)
+        self.assertIn('test_seconds_count{step="forward"} 1', lines)
+
+    def test_endpoint_exposes_steps_requests_and_queues(self):
+        with metrics.timed('decode'):
+            pass
+        metrics.error('pdf_render')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('deepimage_step_duration_seconds_count{step="decode"}', body)
+        self.assertIn('deepimage_errors_total{step="pdf_render"}', body)
+        self.assertIn('deepimage_queue_depth{queue="analysis"}', body)
+        # The scrape itself was timed by the request middleware
+        self.assertIn('deepimage_request_duration_seconds_count{view="metrics"}', self.client.get(reverse('metrics'))
+                      .content.decode())
+
+        with override_settings(DEEPIMAGE_METRICS=False):
+            self.assertIs(metrics.timed('decode'), metrics._null_timer)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
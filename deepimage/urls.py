@@ -2,15 +2,25 @@ from django.urls import path
 from . import views
 from django.conf import settings
 from django.conf.urls.static import static
-from .utils.export_utils import export_pdf, export_print_view
+from .utils.export_utils import export_pdf, export_print_view, export_zip
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('forensic-analysis/', views.forensic_analysis, name='forensic_analysis'),
     path('upload/', views.upload_image, name='upload_image'),  # Add this line
     path('api/predict/', views.api_predict, name='api_predict'),
+    path('api/predict/batch/', views.api_predict_batch, name='api_predict_batch'),
+    path('api/analyses/', views.search_analyses, name='search_analyses'),
+    path('api/stats/', views.analysis_stats, name='analysis_stats'),
+    path('api/analysis/submit/', views.submit_analysis, name='submit_analysis'),
+    path('api/analysis/<str:report_id>/status/', views.analysis_status, name='analysis_status'),
+    path('api/inference/stats/', views.inference_stats, name='inference_stats'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
+    path('analysis/<str:report_id>/', views.analysis_report, name='analysis_report'),
     path('report/pdf/<int:analysis_id>/', export_pdf, name='export_pdf'),
+    path('report/export/', export_zip, name='export_reports'),
     path('report/print/<int:analysis_id>/', export_print_view, name='print_report'),
+    path('report/heatmap/<int:analysis_id>/', views.analysis_heatmap, name='analysis_heatmap'),
 ]
 
 # Serve media files during development
@@ -0,0 +1,138 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+class Stage:
+    """An independent analysis step run on an image while the model predicts"""
+
+    def __init__(self, name, func, timeout_ms, default):
+        self.name = name
+        self.func = func
+        self.timeout_ms = timeout_ms
+        self.default = default
+
+    def timeout(self):
+        """Timeout in seconds, overridable per stage by DEEPIMAGE_ANALYSIS_STAGE_TIMEOUTS_MS"""
+        overrides = getattr(settings, 'DEEPIMAGE_ANALYSIS_STAGE_TIMEOUTS_MS', None) or {}
+        return float(overrides.get(self.name, self.timeout_ms)) / 1000
+
+class StageRun:
+    """Stages submitted for one image; ``collect`` waits for them under their timeouts"""
+
+    def __init__(self, stages, futures, executor=None):
+        self.stages = stages
+        self.futures = futures
+        self.executor = executor
+        self.started = time.perf_counter()
+        self.results = {}
+        self.timings = {}
+        self.collected = False
+
+    def collect(self):
+        """Wait for every stage and return its results by name.
+
+        A stage still running at its deadline (counted from submission) is
+        marked 'skipped' and yields its default; it finishes on its own
+        thread but no longer holds up the report. A stage that raises is
+        marked 'failed'.
+        """
+        if self.collected:
+            return self.results
+        for stage in self.stages:
+            future, durations = self.futures[stage.name]
+            remaining = stage.timeout() - (time.perf_counter() - self.started)
+            try:
+                self.results[stage.name] = future.result(timeout=max(remaining, 0))
+                status = 'done'
+            except TimeoutError:
+                logger.warning(f"Analysis stage '{stage.name}' exceeded {stage.timeout() * 1000:.0f} ms, skipping it")
+                # Stages still waiting for a worker need not run at all
+                future.cancel()
+                self.results[stage.name] = stage.default
+                status = 'skipped'
+            except Exception as e:
+                logger.error(f"Analysis stage '{stage.name}' failed: {str(e)}")
+                self.results[stage.name] = stage.default
+                status = 'failed'
+            self.timings[stage.name] = {
+                'status': status,
+                'queued_ms': round(durations.get('queued', 0) * 1000, 1),
+                'ms': round(durations['run'] * 1000, 1) if 'run' in durations else None,
+            }
+        self.collected = True
+        self.cancel()
+        return self.results
+
+    def cancel(self):
+        """Drop stages that have not started and release the run's threads once running stages return"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def record(self, name, seconds):
+        """Record the timing of work done on the calling thread, such as the forward pass"""
+        self.timings[name] = {'status': 'done', 'queued_ms': 0.0, 'ms': round(seconds * 1000, 1)}
+
+    def report(self):
+        """Per-stage status and timings for storing with the analysis"""
+        self.collect()
+        return {
+            'stages': self.timings,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 1),
+        }
+
+class AnalysisPipeline:
+    """Registry of analysis stages run in parallel for each image.
+
+    Stages are registered with the ``stage`` decorator and receive the
+    image. ``start`` submits all of them to a pool of their own, of up to
+    ``workers`` threads, so that they overlap with the model's forward pass
+    on the calling thread. A stage that overruns its timeout therefore only
+    delays its own run, never another image's stages.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = max(1, int(workers))
+        self._stages = {}
+
+    def stage(self, name, timeout_ms=1000, default=None):
+        """Decorator registering ``func(image)`` as a stage, where ``image`` is a DecodedImage or a path"""
+        def register(func):
+            self._stages[name] = Stage(name, func, timeout_ms, default)
+            return func
+        return register
+
+    @property
+    def stages(self):
+        return list(self._stages.values())
+
+    def start(self, image):
+        """Submit every registered stage for an image and return its StageRun"""
+        stages = self.stages
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, min(self.workers, len(stages))), thread_name_prefix='deepimage-stage'
+        )
+        futures = {}
+        for stage in stages:
+            durations = {}
+            futures[stage.name] = (executor.submit(self._run, stage, image, durations, time.perf_counter()), durations)
+        return StageRun(stages, futures, executor)
+
+    def run(self, image):
+        """Run every stage for an image and wait for them"""
+        run = self.start(image)
+        run.collect()
+        return run
+
+    def _run(self, stage, image, durations, submitted):
+        started = time.perf_counter()
+        durations['queued'] = started - submitted
+        try:
+            return stage.func(image)
+        finally:
+            durations['run'] = time.perf_counter() - started
+
+analysis_pipeline = AnalysisPipeline(workers=getattr(settings, 'DEEPIMAGE_ANALYSIS_STAGE_WORKERS', 4))
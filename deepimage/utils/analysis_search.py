@@ -0,0 +1,147 @@
+import base64
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+# Columns a search result needs; the large JSON and text fields stay unloaded
+LIST_FIELDS = [
+    'id', 'report_id', 'analysis_date', 'analyst_id', 'media_source', 'media_type', 'file_name',
+    'file_hash_sha256', 'authenticity_score', 'classification', 'confidence_level', 'recommended_action',
+    'status',
+]
+ARTIFACT_FIELDS = ['id', 'analysis_id', 'artifact_type', 'confidence', 'location']
+MAX_PAGE_SIZE = 200
+
+class FilterError(ValueError):
+    """Raised for an analysis filter or cursor that cannot be applied"""
+
+def _split(values):
+    """Accept repeated values as well as comma separated lists"""
+    return [part.strip() for value in values or [] for part in str(value).split(',') if part.strip()]
+
+def parse_day(value, name):
+    """A date filter value as a date, None when empty"""
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value) if isinstance(value, str) else value
+    except ValueError:
+        # Well formed but not a real date, such as 2024-02-30
+        parsed = None
+    if parsed is None:
+        raise FilterError(f"{name} must be a date (YYYY-MM-DD)")
+    return parsed
+
+def day_start(day):
+    """Start of a day as an aware datetime when time zones are on"""
+    start = datetime.combine(day, datetime.min.time())
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+def filter_analyses(date_from=None, date_to=None, classifications=None, media_sources=None, ids=None,
+                    sha256s=None, statuses=None):
+    """Analyses matching the given filters, unordered"""
+    from ..models import ForensicAnalysis
+    queryset = ForensicAnalysis.objects.all()
+
+    # Compare against the bounds of the days so the analysis_date indexes apply
+    date_from, date_to = parse_day(date_from, 'date_from'), parse_day(date_to, 'date_to')
+    if date_from:
+        queryset = queryset.filter(analysis_date__gte=day_start(date_from))
+    if date_to:
+        queryset = queryset.filter(analysis_date__lt=day_start(date_to + timedelta(days=1)))
+
+    for field, values in (('classification', classifications), ('status', statuses)):
+        values = _split(values)
+        if values:
+            valid = {value for value, _ in ForensicAnalysis._meta.get_field(field).choices}
+            unknown = set(values) - valid
+            if unknown:
+                raise FilterError(f"Unknown {field}: {', '.join(sorted(unknown))}")
+            queryset = queryset.filter(**{f'{field}__in': values})
+
+    media_sources = _split(media_sources)
+    if media_sources:
+        queryset = queryset.filter(media_source__in=media_sources)
+
+    sha256s = [value.lower() for value in _split(sha256s)]
+    if sha256s:
+        queryset = queryset.filter(file_hash_sha256__in=sha256s)
+
+    ids = _split(ids)
+    if ids:
+        try:
+            queryset = queryset.filter(id__in=[int(value) for value in ids])
+        except ValueError:
+            raise FilterError("ids must be integers")
+    return queryset
+
+def filters_from_query(query):
+    """Analysis filters from request query parameters"""
+    return {
+        'date_from': query.get('date_from'),
+        'date_to': query.get('date_to'),
+        'classifications': query.getlist('classification'),
+        'media_sources': query.getlist('media_source'),
+        'ids': query.getlist('ids'),
+        'sha256s': query.getlist('sha256'),
+        'statuses': query.getlist('status'),
+    }
+
+def encode_cursor(analysis):
+    """Opaque position after an analysis in newest-first order"""
+    return base64.urlsafe_b64encode(f"{analysis.analysis_date.isoformat()}|{analysis.id}".encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        date, analysis_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        parsed = parse_datetime(date)
+        if parsed is None:
+            raise ValueError
+        return parsed, int(analysis_id)
+    except ValueError:
+        raise FilterError("Invalid cursor")
+
+def search_page(queryset, cursor=None, limit=50):
+    """One newest-first page of analyses and the cursor of the next page (None on the last).
+
+    Pages continue from the (analysis_date, id) of the previous page's last
+    row rather than an OFFSET, so every page is an index range scan however
+    deep it is. Artifacts come from one extra query per page.
+    """
+    from ..models import ArtifactDetection
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    if cursor:
+        date, analysis_id = decode_cursor(cursor)
+        # The leading bound on analysis_date keeps this an index range scan
+        queryset = queryset.filter(Q(analysis_date__lte=date), Q(analysis_date__lt=date) | Q(id__lt=analysis_id))
+    rows = list(
+        queryset.order_by('-analysis_date', '-id').only(*LIST_FIELDS).prefetch_related(Prefetch(
+            'artifactdetection_set', queryset=ArtifactDetection.objects.only(*ARTIFACT_FIELDS).order_by('id'),
+        ))[:limit + 1]
+    )
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def result_row(analysis):
+    return {
+        'id': analysis.id,
+        'report_id': analysis.report_id,
+        'analysis_date': analysis.analysis_date.isoformat(),
+        'analyst_id': analysis.analyst_id,
+        'media_source': analysis.media_source,
+        'media_type': analysis.media_type,
+        'file_name': analysis.file_name,
+        'file_hash_sha256': analysis.file_hash_sha256,
+        'authenticity_score': analysis.authenticity_score,
+        'classification': analysis.classification,
+        'confidence_level': analysis.confidence_level,
+        'recommended_action': analysis.recommended_action,
+        'status': analysis.status,
+        'artifacts': [
+            {'type': artifact.artifact_type, 'confidence': artifact.confidence, 'location': artifact.location}
+            for artifact in analysis.artifactdetection_set.all()
+        ],
+    }
@@ -0,0 +1,424 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .preprocessing import DecodedImage, preprocessor
+
+logger = logging.getLogger(__name__)
+
+# Longest side of the downscaled levels shared by the statistical detectors
+PYRAMID_SIZES = (512, 256, 128)
+# Images are compared region by region on a GRID x GRID layout
+GRID = 4
+# The block-grid detectors work on a centred full-resolution crop of this side
+NATIVE_CROP_SIDE = 768
+ELA_QUALITY = 90
+
+# Skin tones in YCrCb (Chai & Ngan)
+SKIN_CR = (133, 173)
+SKIN_CB = (77, 127)
+
+# (substring in metadata, toolkit) pairs, checked in order
+TOOLKIT_SIGNATURES = [
+    ('deepfacelab', 'DeepFaceLab'),
+    ('faceswap', 'FaceSwap'),
+    ('dfaker', 'DFaker'),
+    ('stylegan', 'StyleGAN'),
+    ('stable diffusion', 'Stable Diffusion'),
+    ('stable-diffusion', 'Stable Diffusion'),
+    ('comfyui', 'ComfyUI'),
+    ('midjourney', 'Midjourney'),
+    ('dall-e', 'DALL-E'),
+    ('dall·e', 'DALL-E'),
+    ('novelai', 'NovelAI'),
+    ('firefly', 'Adobe Firefly'),
+]
+# PNG text chunks written by image generation front ends
+GENERATOR_TEXT_KEYS = {'parameters': 'Stable Diffusion', 'prompt': 'ComfyUI', 'workflow': 'ComfyUI'}
+
+class ImagePyramid:
+    """An image downscaled into the levels shared by all detectors.
+
+    Takes a DecodedImage, or a path that is decoded here. ``native`` is False
+    when the image was decoded below full resolution, in which case detectors
+    that rely on the 8x8 JPEG block grid are skipped.
+    """
+
+    def __init__(self, image, max_pixels=4_000_000):
+        if not isinstance(image, DecodedImage):
+            image = preprocessor.decode(image, max_pixels)
+        self.format = image.format
+        self.size = image.size
+        self.native = image.native
+        self.rgb = image.rgb
+        self.levels = {}
+        self._gray = {}
+        self._crop = None
+        self._crop_gray = None
+
+        current = self.rgb
+        for size in PYRAMID_SIZES:
+            height, width = current.shape[:2]
+            scale = size / max(height, width)
+            if scale < 1:
+                current = cv2.resize(
+                    current, (max(1, round(width * scale)), max(1, round(height * scale))),
+                    interpolation=cv2.INTER_AREA,
+                )
+            self.levels[size] = current
+
+    def level(self, size=None):
+        """RGB uint8 array at a pyramid level, or at full size when ``size`` is None"""
+        return self.rgb if size is None else self.levels[size]
+
+    def gray(self, size=None):
+        """float32 luminance at a pyramid level, computed once per level"""
+        if size not in self._gray:
+            self._gray[size] = cv2.cvtColor(self.level(size), cv2.COLOR_RGB2GRAY).astype(np.float32)
+        return self._gray[size]
+
+    @property
+    def crop(self):
+        """Centred full-resolution crop aligned to the 8x8 block grid, as RGB uint8"""
+        if self._crop is None:
+            height, width = self.rgb.shape[:2]
+            top = max(0, (height - NATIVE_CROP_SIDE) // 2) // 8 * 8
+            left = max(0, (width - NATIVE_CROP_SIDE) // 2) // 8 * 8
+            self._crop = np.ascontiguousarray(self.rgb[top:top + NATIVE_CROP_SIDE, left:left + NATIVE_CROP_SIDE])
+        return self._crop
+
+    @property
+    def crop_gray(self):
+        if self._crop_gray is None:
+            self._crop_gray = cv2.cvtColor(self.crop, cv2.COLOR_RGB2GRAY).astype(np.float32)
+        return self._crop_gray
+
+def block_view(array, grid=GRID, multiple=1):
+    """View an (H, W, ...) array as (grid, grid, h, w, ...) regions, cropping the remainder.
+
+    Region sizes are rounded down to a multiple of ``multiple`` so that every
+    region starts at the same phase of an 8x8 block grid.
+    """
+    height = array.shape[0] // (grid * multiple) * multiple
+    width = array.shape[1] // (grid * multiple) * multiple
+    array = array[:grid * height, :grid * width]
+    return array.reshape((grid, height, grid, width) + array.shape[2:]).swapaxes(1, 2)
+
+def region_name(row, col, grid=GRID):
+    """Human-readable location of a region on the grid"""
+    vertical = ('upper', 'middle', 'lower')[min(2, row * 3 // grid)]
+    horizontal = ('left', 'centre', 'right')[min(2, col * 3 // grid)]
+    return 'centre' if (vertical, horizontal) == ('middle', 'centre') else f"{vertical} {horizontal}"
+
+def robust_z(values):
+    """Distance of each value from the median in units of the scaled median absolute deviation"""
+    median = np.median(values)
+    spread = 1.4826 * np.median(np.abs(values - median))
+    return (values - median) / max(spread, 1e-3 * max(abs(median), 1.0))
+
+def ramp(value, low, high):
+    """Map value linearly from [low, high] to [0, 1]"""
+    return float(np.clip((value - low) / (high - low), 0.0, 1.0))
+
+def detect_color_inconsistency(pyramid):
+    """Regions lit by a different illuminant, or with different chroma noise, than the rest.
+
+    The illuminant of each region is estimated with the gray-edge hypothesis
+    (the average edge colour under one light source is neutral).
+    """
+    rgb = pyramid.level(256).astype(np.float32)
+    edges = np.abs(cv2.Sobel(rgb, cv2.CV_32F, 1, 0, ksize=3)) + np.abs(cv2.Sobel(rgb, cv2.CV_32F, 0, 1, ksize=3))
+    # Only weakly saturated surfaces reflect the colour of the light
+    saturation = cv2.cvtColor(pyramid.level(256), cv2.COLOR_RGB2HSV)[..., 1]
+    neutral = ((saturation < 64) & (rgb.max(axis=-1) > 30)).astype(np.float32)
+    coverage = block_view(neutral).mean(axis=(2, 3))
+    illuminant = block_view(edges * neutral[..., None]).mean(axis=(2, 3)) / np.maximum(coverage[..., None], 1e-6)
+    chromaticity = illuminant[..., :2] / np.maximum(illuminant.sum(axis=-1, keepdims=True), 1e-6)
+    usable = coverage >= 0.1
+    distance = np.zeros(usable.shape, dtype=np.float32)
+    illuminant_z = np.zeros(usable.shape, dtype=np.float32)
+    if usable.sum() >= 6:
+        offset = chromaticity - np.median(chromaticity[usable], axis=0)
+        distance = np.where(usable, np.linalg.norm(offset, axis=-1), 0)
+        illuminant_z = np.where(usable, robust_z(distance), 0)
+
+    ycc = cv2.cvtColor(pyramid.level(256), cv2.COLOR_RGB2YCrCb).astype(np.float32)
+    noise = block_view(ycc - cv2.blur(ycc, (3, 3))).std(axis=(2, 3))
+    noise_z = np.abs(robust_z(np.log((noise[..., 1:].mean(axis=-1) + 0.5) / (noise[..., 0] + 0.5))))
+
+    # Both statistics also need an absolute effect size to count
+    illuminant_score = ramp(illuminant_z.max(), 4.0, 8.0) * ramp(distance.max(), 0.01, 0.03)
+    noise_score = ramp(noise_z.max(), 5.0, 10.0)
+    if illuminant_score >= noise_score:
+        row, col = np.unravel_index(illuminant_z.argmax(), illuminant_z.shape)
+        return illuminant_score, region_name(row, col), (
+            f"The {region_name(row, col)} region is lit by a differently coloured light source "
+            f"(illuminant chromaticity off by {distance[row, col]:.3f})"
+        )
+    row, col = np.unravel_index(noise_z.argmax(), noise_z.shape)
+    return noise_score, region_name(row, col), (
+        f"Chroma noise in the {region_name(row, col)} region deviates {noise_z[row, col]:.1f} "
+        f"robust standard deviations from the rest of the image"
+    )
+
+def detect_lighting_inconsistency(pyramid):
+    """Regions whose low-frequency shading gradient opposes the dominant light direction"""
+    shading = cv2.GaussianBlur(pyramid.gray(128), (0, 0), 4)
+    gx = cv2.Sobel(shading, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(shading, cv2.CV_32F, 0, 1, ksize=3)
+    vectors = np.stack([block_view(gx).mean(axis=(2, 3)), block_view(gy).mean(axis=(2, 3))], axis=-1)
+    magnitude = np.linalg.norm(vectors, axis=-1)
+    strong = magnitude > 0.25 * magnitude.max()
+    if magnitude.max() < 0.5 or strong.sum() < 4:
+        return None
+
+    dominant = vectors[strong].sum(axis=0)
+    if np.linalg.norm(dominant) < 1e-6:
+        return None
+    cosine = (vectors @ dominant) / (magnitude * np.linalg.norm(dominant) + 1e-6)
+    opposed = strong & (cosine < -0.5)
+    fraction = float(magnitude[opposed].sum() / magnitude[strong].sum())
+    if not opposed.any():
+        return 0.0, '', ''
+    row, col = np.unravel_index(np.where(opposed, magnitude, 0).argmax(), magnitude.shape)
+    return ramp(fraction, 0.2, 0.5), region_name(row, col), (
+        f"{opposed.sum()} of {strong.sum()} strongly shaded regions are lit from the opposite "
+        f"direction to the rest of the image"
+    )
+
+def tile_view(array, tile):
+    """Split a 2-D array into (N, tile, tile) non-overlapping tiles, cropping the remainder"""
+    rows, cols = array.shape[0] // tile, array.shape[1] // tile
+    array = array[:rows * tile, :cols * tile]
+    return array.reshape(rows, tile, cols, tile).swapaxes(1, 2).reshape(-1, tile, tile)
+
+def high_frequency_ratio(tiles):
+    """Share of each tile's spectral energy above half the Nyquist frequency"""
+    size = tiles.shape[-1]
+    window = np.outer(np.hanning(size), np.hanning(size)).astype(np.float32)
+    centred = (tiles - tiles.mean(axis=(1, 2), keepdims=True)) * window
+    power = np.abs(np.fft.rfft2(centred)) ** 2
+    radius = np.sqrt(np.fft.fftfreq(size)[:, None] ** 2 + np.fft.rfftfreq(size)[None, :] ** 2)
+    return power[:, radius > 0.25].sum(axis=1) / np.maximum(power[:, radius > 0.03].sum(axis=1), 1e-6)
+
+def detect_skin_texture(pyramid, tile=32):
+    """Skin tiles with too little high-frequency FFT energy for a photographed surface"""
+    ycc = cv2.cvtColor(pyramid.level(512), cv2.COLOR_RGB2YCrCb)
+    skin = (
+        (ycc[..., 1] >= SKIN_CR[0]) & (ycc[..., 1] <= SKIN_CR[1])
+        & (ycc[..., 2] >= SKIN_CB[0]) & (ycc[..., 2] <= SKIN_CB[1])
+    )
+    skin_tiles = tile_view(skin, tile).mean(axis=(1, 2)) >= 0.8
+    if skin_tiles.sum() < 4:
+        return None
+
+    tiles = tile_view(pyramid.gray(512), tile)
+    ratios = high_frequency_ratio(tiles[skin_tiles])
+    # Textureless skin in an otherwise noisy image is the signature of synthetic
+    # smoothing; the lower quartile catches a smoothed face next to untouched skin
+    smooth = float(np.percentile(ratios, 25))
+    textured = tiles[~skin_tiles].std(axis=(1, 2)) > 2
+    reference = float(np.median(high_frequency_ratio(tiles[~skin_tiles][textured]))) if textured.sum() >= 4 else None
+
+    positions = np.flatnonzero(skin_tiles)
+    cols = pyramid.level(512).shape[1] // tile
+    row, col = np.unravel_index(positions[ratios.argmin()], (len(skin_tiles) // cols, cols))
+    location = region_name(row * GRID // (len(skin_tiles) // cols), col * GRID // cols)
+    relative = smooth / reference if reference else 1.0
+    score = max(ramp(-np.log10(max(smooth, 1e-9)), 2.2, 2.8), ramp(-np.log10(max(relative, 1e-9)), 0.8, 1.3))
+    return score, location, (
+        f"A quarter of the skin regions keep under {smooth:.2%} of their spectral energy at high frequencies"
+        + (f" ({relative:.0%} of the surrounding texture)" if reference else "")
+    )
+
+def grid_profile(gray):
+    """Mean absolute horizontal and vertical pixel differences folded onto the 8-pixel block phase"""
+    horizontal = np.abs(np.diff(gray, axis=1))
+    vertical = np.abs(np.diff(gray, axis=0))
+    h = block_view(horizontal, multiple=8)
+    v = block_view(vertical, multiple=8)
+    h = h.reshape(h.shape[:3] + (h.shape[3] // 8, 8)).mean(axis=(2, 3))
+    v = v.reshape(v.shape[:2] + (v.shape[2] // 8, 8, v.shape[3])).mean(axis=(2, 4))
+    return h, v
+
+def grid_strength(profile):
+    """Peak phase of a folded difference profile and how far it stands above the other phases.
+
+    The peak is compared with the phase four pixels away as well, so that the
+    4-pixel periodicity left by resampling an earlier JPEG does not count as
+    an 8x8 grid.
+    """
+    peak = profile.argmax(axis=-1)
+    top = np.take_along_axis(profile, peak[..., None], axis=-1)[..., 0]
+    opposite = np.take_along_axis(profile, ((peak + 4) % 8)[..., None], axis=-1)[..., 0]
+    rest = (profile.sum(axis=-1) - top) / 7
+    return peak, top / np.maximum(np.maximum(rest, opposite), 1e-6)
+
+def detect_jpeg_grid(pyramid):
+    """8x8 JPEG block grids that are shifted, or that differ between regions.
+
+    A region with its own strong grid out of phase with the file's grid holds
+    content pasted from another JPEG. A shifted grid over the whole image
+    means it was cropped after compression, and a grid in a lossless file
+    means it was JPEG compressed before being re-saved.
+    """
+    if not pyramid.native:
+        return None
+    gray = pyramid.crop_gray
+    if min(gray.shape) < GRID * 32:
+        return None
+
+    h, v = grid_profile(gray)
+    (peak_x, strength_x), (peak_y, strength_y) = grid_strength(h.mean(axis=(0, 1))), grid_strength(v.mean(axis=(0, 1)))
+    gridded = min(strength_x, strength_y) > 1.15
+    # Regions are compared with the grid of the whole image, which is at
+    # (7, 7) unless the image was cropped after compression
+    expected = (int(peak_x), int(peak_y)) if gridded else (7, 7)
+    findings = [(0.0, '', '')]
+
+    # Per-region grids; regions under 96 pixels are too noisy to compare
+    if min(gray.shape) >= GRID * 96:
+        region_peak_x, region_x = grid_strength(h)
+        region_peak_y, region_y = grid_strength(v)
+        strength = np.minimum(region_x, region_y)
+        textured = block_view(gray).std(axis=(2, 3)) > 4
+        # Both axes must be out of phase; a single strong edge can fake one axis
+        shifted = textured & (strength > 1.25) & (region_peak_x != expected[0]) & (region_peak_y != expected[1])
+        if shifted.any():
+            row, col = np.unravel_index(np.where(shifted, strength, 0).argmax(), shifted.shape)
+            findings.append((ramp(strength[row, col], 1.25, 1.45), region_name(row, col), (
+                f"The {region_name(row, col)} region has its own JPEG block grid at offset "
+                f"({(int(region_peak_x[row, col]) + 1) % 8}, {(int(region_peak_y[row, col]) + 1) % 8}), "
+                f"out of phase with the rest of the image, suggesting pasted content"
+            )))
+
+    if gridded and pyramid.format != 'JPEG':
+        findings.append((0.5, 'Whole image', (
+            f"An 8x8 compression grid (strength {min(strength_x, strength_y):.2f}) shows the "
+            f"{pyramid.format or 'image'} was JPEG compressed before being re-saved"
+        )))
+    elif gridded and (int(peak_x), int(peak_y)) != (7, 7):
+        findings.append((0.55, 'Whole image', (
+            f"The JPEG block grid is shifted to offset ({(int(peak_x) + 1) % 8}, {(int(peak_y) + 1) % 8}), "
+            f"indicating the image was cropped and recompressed"
+        )))
+    return max(findings, key=lambda finding: finding[0])
+
+def detect_error_level(pyramid):
+    """Error level analysis: regions that recompress with a different error than the rest"""
+    if not pyramid.native or pyramid.format != 'JPEG':
+        return None
+    crop = pyramid.crop
+    if min(crop.shape[:2]) < GRID * 16:
+        return None
+
+    ok, encoded = cv2.imencode('.jpg', crop[..., ::-1], [cv2.IMWRITE_JPEG_QUALITY, ELA_QUALITY])
+    if not ok:
+        return None
+    recompressed = cv2.imdecode(encoded, cv2.IMREAD_COLOR)[..., ::-1]
+    error = np.abs(crop.astype(np.int16) - recompressed.astype(np.int16)).mean(axis=-1, dtype=np.float32)
+
+    # Normalise by local texture, which raises the error level on its own
+    gray = pyramid.crop_gray
+    texture = np.abs(gray - cv2.blur(gray, (3, 3)))
+    level = block_view(error).mean(axis=(2, 3)) / (block_view(texture).mean(axis=(2, 3)) + 1.0)
+    z = robust_z(level)
+    row, col = np.unravel_index(np.abs(z).argmax(), z.shape)
+    return ramp(abs(z[row, col]), 4.0, 10.0), region_name(row, col), (
+        f"The {region_name(row, col)} region recompresses with an error level "
+        f"{abs(z[row, col]):.1f} robust standard deviations from the rest of the image"
+    )
+
+# (artifact type, detector), cheapest first so that the time budget drops the costly ones
+DETECTORS = [
+    ('color_inconsistency', detect_color_inconsistency),
+    ('lighting_inconsistency', detect_lighting_inconsistency),
+    ('skin_texture', detect_skin_texture),
+    ('jpeg_grid', detect_jpeg_grid),
+    ('error_level', detect_error_level),
+]
+
+# Moving average of each detector's run time, used to keep analyses within budget
+_recent_cost_ms = {}
+
+def analyze(image, budget_ms=None, min_confidence=None):
+    """Run all artifact detectors over one shared pyramid within a time budget.
+
+    ``image`` is a DecodedImage or a path.
+
+    Returns ``(artifacts, report)``. Artifacts are dicts with ``type``,
+    ``confidence`` (0-1), ``location`` and ``description`` for detectors
+    scoring at least ``min_confidence``. The report holds per-detector
+    timings, detectors skipped because the budget ran out and detectors
+    that did not apply to the image.
+    """
+    if budget_ms is None:
+        budget_ms = getattr(settings, 'DEEPIMAGE_ARTIFACT_BUDGET_MS', 250)
+    if min_confidence is None:
+        min_confidence = getattr(settings, 'DEEPIMAGE_ARTIFACT_MIN_CONFIDENCE', 0.5)
+
+    started = time.perf_counter()
+    pyramid = ImagePyramid(image, getattr(settings, 'DEEPIMAGE_ARTIFACT_MAX_PIXELS', 4_000_000))
+    timings = {'pyramid': round((time.perf_counter() - started) * 1000, 2)}
+    artifacts, skipped, not_applicable = [], [], []
+
+    for artifact_type, detector in DETECTORS:
+        # Skip a detector whose recent cost would take the image over budget
+        if (time.perf_counter() - started) * 1000 + _recent_cost_ms.get(artifact_type, 0.0) > budget_ms:
+            skipped.append(artifact_type)
+            continue
+        tick = time.perf_counter()
+        try:
+            outcome = detector(pyramid)
+        except Exception as e:
+            logger.error(f"Artifact detector {artifact_type} failed: {str(e)}")
+            outcome = None
+        elapsed_ms = (time.perf_counter() - tick) * 1000
+        timings[artifact_type] = round(elapsed_ms, 2)
+        _recent_cost_ms[artifact_type] = 0.8 * _recent_cost_ms.get(artifact_type, elapsed_ms) + 0.2 * elapsed_ms
+
+        if outcome is None:
+            not_applicable.append(artifact_type)
+            continue
+        confidence, location, description = outcome
+        if confidence >= min_confidence:
+            artifacts.append({
+                'type': artifact_type,
+                'confidence': round(confidence, 2),
+                'location': location,
+                'description': description,
+            })
+
+    if skipped:
+        logger.warning(f"Artifact analysis exceeded {budget_ms} ms budget, skipped: {', '.join(skipped)}")
+    artifacts.sort(key=lambda artifact: artifact['confidence'], reverse=True)
+    return artifacts, {
+        'timings_ms': timings,
+        'total_ms': round((time.perf_counter() - started) * 1000, 2),
+        'skipped': skipped,
+        'not_applicable': not_applicable,
+    }
+
+def detect_toolkit(image):
+    """Name the generation toolkit recorded in an image's metadata, or '' if there is none"""
+    try:
+        with preprocessor.open(image) as img:
+            texts = {str(key).lower(): str(value) for key, value in img.info.items() if isinstance(value, str)}
+            exif = img.getexif()
+            # Software, Artist, ImageDescription and Make
+            texts.update({str(tag): str(exif.get(tag, '')) for tag in (0x0131, 0x013B, 0x010E, 0x010F)})
+    except Exception as e:
+        logger.error(f"Toolkit detection error: {str(e)}")
+        return ""
+
+    for key, toolkit in GENERATOR_TEXT_KEYS.items():
+        if key in texts:
+            return toolkit
+    combined = ' '.join(texts.values()).lower()
+    for signature, toolkit in TOOLKIT_SIGNATURES:
+        if signature in combined:
+            return toolkit
+    return ""
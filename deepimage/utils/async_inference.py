@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, connections
+
+from .job_queue import QueueFull
+
+class InferenceExecutor:
+    """Bounded thread pool that async views hand CPU-bound work to.
+
+    Hashing, inference and PDF rendering run on these threads, so the event
+    loop only waits on them and at most ``workers`` requests use the CPU at
+    once; database work stays on Django's thread-sensitive sync thread and
+    concurrent predictions still share forward passes through the
+    detector's micro-batcher. ``run`` raises QueueFull
+    once ``max_pending`` calls are waiting or running, so callers can shed
+    load instead of holding uploads in memory without bound.
+    """
+
+    def __init__(self, workers=4, max_pending=64):
+        self.workers = max(1, int(workers))
+        self.max_pending = max(self.workers, int(max_pending))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._busy_seconds = 0.0
+        self._counters = {'completed': 0, 'failed': 0, 'rejected': 0}
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='deepimage-inference')
+            return self._executor
+
+    def _call(self, func, args, kwargs):
+        # Worker threads keep their own database connections, like the job queue's
+        close_old_connections()
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._busy_seconds += time.perf_counter() - started
+
+    async def run(self, func, *args, **kwargs):
+        """Await ``func(*args, **kwargs)`` on a worker thread, raising QueueFull when saturated"""
+        with self._lock:
+            if self._in_flight >= self.max_pending:
+                self._counters['rejected'] += 1
+                raise QueueFull(f"Inference executor is full ({self.max_pending} calls in flight)")
+            self._in_flight += 1
+        outcome = 'failed'
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._call, func, args, kwargs
+            )
+            outcome = 'completed'
+            return result
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._counters[outcome] += 1
+
+    @property
+    def depth(self):
+        return self._in_flight
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'in_flight': self._in_flight,
+                'busy_seconds': round(self._busy_seconds, 3),
+                **self._counters,
+            }
+
+_done = object()
+
+def _close(iterator):
+    try:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+    finally:
+        connections.close_all()
+
+async def iterate(iterable):
+    """Consume a blocking iterator on a thread of its own and yield its items asynchronously.
+
+    Under ASGI, Django reads a synchronous streaming response into a list
+    before sending it; this keeps large streams incremental. Every step runs
+    on the same thread, so database cursors the iterator holds stay valid.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='deepimage-stream')
+    iterator = iter(iterable)
+    try:
+        while True:
+            item = await loop.run_in_executor(executor, next, iterator, _done)
+            if item is _done:
+                break
+            yield item
+    finally:
+        await loop.run_in_executor(executor, _close, iterator)
+        executor.shutdown(wait=False)
+
+def streaming_content(request, iterable):
+    """Stream content the way the serving handler can send without buffering it"""
+    if isinstance(request, ASGIRequest):
+        return iterate(iterable)
+    # WSGI servers iterate synchronously; an async iterator would be read into a list
+    return iterable
+
+inference_executor = InferenceExecutor(
+    workers=getattr(settings, 'DEEPIMAGE_ASYNC_INFERENCE_WORKERS', 4),
+    max_pending=getattr(settings, 'DEEPIMAGE_ASYNC_INFERENCE_QUEUE_SIZE', 64),
+)
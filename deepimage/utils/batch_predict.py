@@ -0,0 +1,125 @@
+import io
+import json
+import tarfile
+import zipfile
+
+from django.conf import settings
+
+from .registry import detector
+from .prediction_cache import prediction_cache, file_sha256
+from .prefetch import inference_pipeline
+
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp', 'bmp'}
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+MAX_FILE_SIZE = 10 * 1024 * 1024
+
+class BatchInputError(ValueError):
+    """Raised when a batch request carries no usable images or too many"""
+
+def _is_image_name(name):
+    return name.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS
+
+def iter_archive(upload):
+    """Yield (name, file) pairs for the images in an uploaded zip or tar archive"""
+    name = upload.name.lower()
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(upload) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _is_image_name(info.filename):
+                    continue
+                if info.file_size > MAX_FILE_SIZE:
+                    yield info.filename, None
+                    continue
+                yield info.filename, io.BytesIO(archive.read(info))
+    elif name.endswith(ARCHIVE_EXTENSIONS):
+        with tarfile.open(fileobj=upload, mode='r:*') as archive:
+            for member in archive:
+                if not member.isfile() or not _is_image_name(member.name):
+                    continue
+                if member.size > MAX_FILE_SIZE:
+                    yield member.name, None
+                    continue
+                yield member.name, io.BytesIO(archive.extractfile(member).read())
+    else:
+        raise BatchInputError("Archive must be a .zip or .tar file")
+
+def iter_request_images(request):
+    """Yield (name, file) pairs from multipart ``images`` fields and an optional ``archive``"""
+    for upload in request.FILES.getlist('images'):
+        if not _is_image_name(upload.name) or upload.size > MAX_FILE_SIZE:
+            yield upload.name, None
+        else:
+            yield upload.name, upload
+    archive = request.FILES.get('archive')
+    if archive is not None:
+        yield from iter_archive(archive)
+
+def validate_request(request):
+    """Reject requests without images or with more than the configured maximum"""
+    max_images = getattr(settings, 'DEEPIMAGE_BATCH_PREDICT_MAX_IMAGES', 1000)
+    if not request.FILES.getlist('images') and 'archive' not in request.FILES:
+        raise BatchInputError("Send images as 'images' files or an 'archive' zip/tar")
+    if len(request.FILES.getlist('images')) > max_images:
+        raise BatchInputError(f"At most {max_images} images per request")
+    archive = request.FILES.get('archive')
+    if archive is not None and not archive.name.lower().endswith(ARCHIVE_EXTENSIONS):
+        raise BatchInputError("Archive must be a .zip or .tar file")
+
+def _lookup(entries, max_images, model_version, state):
+    """Hash entries and serve cache hits on the calling thread, stopping after max_images"""
+    for index, (name, upload) in enumerate(entries):
+        if index >= max_images:
+            state['too_many'] = True
+            return
+        entry = {'index': index, 'name': name, 'upload': upload, 'hash': None, 'result': None}
+        if upload is None:
+            entry['result'] = {'error': 'Unsupported file type or file too large'}
+        elif detector.model is None:
+            entry['result'] = {'error': 'Model not loaded'}
+        else:
+            entry['hash'] = file_sha256(upload)
+            upload.seek(0)
+            cached = prediction_cache.get(entry['hash'], model_version)
+            if cached is not None:
+                cached['cached'] = True
+                entry['result'] = cached
+        yield entry
+
+def _load(entry):
+    return None if entry['result'] is not None else detector.preprocess(entry['upload'])
+
+def stream_predictions(entries, max_images=None):
+    """Run (name, file) entries through the prefetching pipeline and yield NDJSON lines in input order"""
+    max_images = max_images or getattr(settings, 'DEEPIMAGE_BATCH_PREDICT_MAX_IMAGES', 1000)
+    model_version = detector.model_version or 'unknown'
+    state = {'too_many': False}
+
+    try:
+        for entry, output, error in inference_pipeline.imap(_lookup(entries, max_images, model_version, state), _load):
+            result = entry['result']
+            if error is not None:
+                result = {'error': str(error)}
+            elif output is not None:
+                result = detector.format_output(output)
+                prediction_cache.set(entry['hash'], model_version, result)
+            yield json.dumps(_format_line(entry['index'], entry['name'], result)) + '\n'
+        if state['too_many']:
+            yield json.dumps({'success': False, 'error': f"At most {max_images} images per request"}) + '\n'
+    except BatchInputError as e:
+        yield json.dumps({'success': False, 'error': str(e)}) + '\n'
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        yield json.dumps({'success': False, 'error': f"Unreadable archive: {str(e)}"}) + '\n'
+
+def _format_line(index, name, result):
+    line = {'index': index, 'name': name}
+    if 'error' in result:
+        line.update({'success': False, 'error': result['error']})
+    else:
+        line.update({
+            'success': True,
+            'prediction': result['label'],
+            'confidence': result['confidence'],
+            'is_deepfake': result['is_deepfake'],
+            'cached': result.get('cached', False),
+        })
+    return line
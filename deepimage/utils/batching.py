@@ -0,0 +1,138 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """Coalesce concurrent single-item calls into batched calls.
+
+    Callers submit one item each and block on a future. A single worker
+    thread gathers up to ``max_batch_size`` items, waiting at most
+    ``max_wait_ms`` after the first one arrives, passes them to ``run_batch``
+    as one list and hands every caller its own entry of the returned
+    sequence. Used for batched forward passes and coalesced result writes.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10, history=500, name='batcher'):
+        self.run_batch = run_batch
+        self.name = name
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._batch_sizes = {}
+        self._latencies = deque(maxlen=history)
+        self._total_batches = 0
+        self._total_items = 0
+        self._total_errors = 0
+
+    def submit(self, item):
+        """Queue a single item and return a Future for its entry of the batch result"""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name=f'deepimage-{self.name}', daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is full or the wait expires"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._dispatch(batch)
+            except Exception as e:
+                # Whatever went wrong, no caller is left waiting and the worker keeps serving
+                logger.error(f"{self.name} batch error: {str(e)}")
+                with self._lock:
+                    self._total_errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _dispatch(self, batch):
+        """Run one batch and resolve its futures"""
+        items = [item[0] for item in batch]
+        started = time.perf_counter()
+        outputs = self.run_batch(items)
+        if len(outputs) != len(batch):
+            raise RuntimeError(f"{self.name} returned {len(outputs)} results for a batch of {len(batch)}")
+
+        finished = time.perf_counter()
+        for output, (_, future, _) in zip(outputs, batch):
+            if not future.done():
+                future.set_result(output)
+        self._record(len(batch), finished - started, [finished - item[2] for item in batch])
+
+    def _record(self, size, run_seconds, waits):
+        with self._lock:
+            self._total_batches += 1
+            self._total_items += size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._latencies.append((size, run_seconds, max(waits)))
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Return batch size and latency statistics for the recent batches"""
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+                'queue_depth': self._queue.qsize(),
+                'total_batches': self._total_batches,
+                'total_items': self._total_items,
+                'total_errors': self._total_errors,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+            }
+
+        if self._total_batches:
+            stats['mean_batch_size'] = round(self._total_items / self._total_batches, 3)
+        if latencies:
+            run_ms = np.array([entry[1] for entry in latencies]) * 1000
+            end_to_end_ms = np.array([entry[2] for entry in latencies]) * 1000
+            stats['recent_batches'] = len(latencies)
+            stats['recent_mean_batch_size'] = round(float(np.mean([entry[0] for entry in latencies])), 3)
+            stats['run_ms'] = _summarize_ms(run_ms)
+            stats['end_to_end_ms'] = _summarize_ms(end_to_end_ms)
+        return stats
+
+def _summarize_ms(values):
+    return {
+        'mean': round(float(values.mean()), 3),
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p95': round(float(np.percentile(values, 95)), 3),
+        'max': round(float(values.max()), 3),
+    }
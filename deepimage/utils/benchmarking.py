@@ -0,0 +1,133 @@
+import io
+import multiprocessing
+import os
+import threading
+import time
+from queue import Empty
+
+import numpy as np
+from PIL import Image
+
+def synthetic_image(width, height, fmt='JPEG', seed=0):
+    """Return encoded bytes of a deterministic, photo-like synthetic image"""
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    base = np.stack([
+        128 + 100 * np.sin(6 * x + 3 * y),
+        128 + 100 * np.cos(4 * y - 2 * x),
+        128 + 100 * np.sin(5 * (x + y)),
+    ], axis=-1)
+    noise = rng.normal(0, 12, size=(height, width, 1)).astype(np.float32)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    options = {'quality': 90} if fmt == 'JPEG' else {}
+    Image.fromarray(pixels).save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class RssSampler:
+    """Track the peak resident set size while a block of code runs"""
+
+    def __init__(self, interval=0.0005):
+        self.interval = interval
+        self.baseline = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.baseline = current_rss()
+        if self.baseline is not None:
+            self.peak = self.baseline
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        rss = current_rss()
+        if rss is not None and self.peak is not None:
+            self.peak = max(self.peak, rss)
+
+    @property
+    def peak_delta(self):
+        if self.baseline is None or self.peak is None:
+            return None
+        return self.peak - self.baseline
+
+def latency_summary(seconds):
+    """Summarize a list of durations in milliseconds"""
+    values = np.array(seconds, dtype=np.float64) * 1000
+    if not len(values):
+        return {}
+    return {
+        'runs': int(len(values)),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'min_ms': round(float(values.min()), 3),
+    }
+
+def _measure(pipeline, data, repeats, queue):
+    # Runs in a fresh interpreter so one pipeline's freed memory cannot hide
+    # the other's peak
+    func = globals()[pipeline]
+    func(io.BytesIO(data))  # warm up imports and allocator
+    timings = []
+    with RssSampler() as sampler:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            func(io.BytesIO(data))
+            timings.append(time.perf_counter() - started)
+    queue.put((latency_summary(timings), sampler.peak_delta))
+
+def measure_isolated(pipeline, data, repeats=5):
+    """Time a named preprocessing pipeline in a spawned process and report its peak RSS growth"""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(pipeline, data, repeats, queue))
+    process.start()
+    while True:
+        try:
+            summary, peak = queue.get(timeout=1)
+            break
+        except Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Benchmark process for {pipeline} exited with code {process.exitcode}")
+    process.join()
+    return summary, peak
+
+def legacy_preprocess(source):
+    """The original ToPILImage -> ToTensor -> Resize pipeline, kept for comparison"""
+    from torchvision import transforms
+    transform = transforms.Compose([
+        transforms.ToPILImage(),
+        transforms.ToTensor(),
+        transforms.Resize((224, 224)),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+    img = Image.open(source).convert("RGB")
+    return transform(np.array(img))
+
+def reduced_preprocess(source):
+    """The draft/reduce uint8 pipeline used by the detector"""
+    from .preprocessing import preprocessor
+    return preprocessor(source)
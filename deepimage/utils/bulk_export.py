@@ -0,0 +1,209 @@
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import analysis_search
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FIELDS = [
+    'report_id', 'analysis_id', 'file', 'status', 'error', 'analysis_date', 'classification',
+    'authenticity_score', 'confidence_level', 'media_source', 'file_name', 'file_hash_sha256',
+]
+COPY_CHUNK_SIZE = 256 * 1024
+
+def filter_analyses(**filters):
+    """Completed analyses matching the export filters, oldest first"""
+    return analysis_search.filter_analyses(**{**filters, 'statuses': ['done']}).order_by('id')
+
+def _init_worker():
+    # Spawned workers set Django up themselves and never warm up the model
+    os.environ['DEEPIMAGE_FAST_START'] = '1'
+    import django
+    django.setup()
+
+def render_report(analysis_id, heatmap_name):
+    """Process pool task: render and store an analysis' PDF and return its storage name"""
+    from ..models import ForensicAnalysis
+    from .export_utils import pdf_name, render_pdf, store_pdf
+    analysis = ForensicAnalysis.objects.get(id=analysis_id)
+    name = pdf_name(analysis)
+    if os.path.exists(os.path.join(settings.MEDIA_ROOT, name)):
+        return name
+    name = store_pdf(analysis, render_pdf(analysis, heatmap_name))
+    if name is None:
+        raise RuntimeError('PDF generation error')
+    return name
+
+def create_pool(workers):
+    """Report rendering processes, or None for ``workers`` 0.
+
+    Workers are spawned rather than forked, since the server process runs
+    threads and may hold the model.
+    """
+    if not workers:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker
+    )
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def render_pool():
+    """Process pool shared by the export endpoint, sized by DEEPIMAGE_EXPORT_WORKERS"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool(getattr(settings, 'DEEPIMAGE_EXPORT_WORKERS', 2))
+        return _pool
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _rendered(analyses, pool, max_in_flight):
+    """Yield (analysis, PDF storage name, error) as reports become available.
+
+    Stored PDFs are used as they are. The others are rendered on the pool,
+    with at most ``max_in_flight`` outstanding; heatmaps are produced here
+    first, so the workers never load the model.
+    """
+    from .export_utils import ensure_pdf, pdf_name
+    from .heatmaps import ensure_heatmap
+    in_flight = {}
+
+    def finished(futures):
+        for future in futures:
+            analysis = in_flight.pop(future)
+            try:
+                yield analysis, future.result(), ''
+            except BrokenProcessPool:
+                _reset_pool(pool)
+                raise
+            except Exception as e:
+                yield analysis, None, str(e)
+
+    for analysis in analyses.iterator(chunk_size=200):
+        if os.path.exists(os.path.join(settings.MEDIA_ROOT, pdf_name(analysis))):
+            yield analysis, pdf_name(analysis), ''
+            continue
+        if pool is None:
+            name = ensure_pdf(analysis)
+            yield analysis, name, '' if name else 'PDF generation error'
+            continue
+        in_flight[pool.submit(render_report, analysis.id, ensure_heatmap(analysis))] = analysis
+        if len(in_flight) >= max_in_flight:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            yield from finished(done)
+    while in_flight:
+        done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+        yield from finished(done)
+
+class _ZipStream:
+    """Write-only, unseekable file that hands the ZIP bytes written so far to the response"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _manifest_row(analysis, arcname, error):
+    return {
+        'report_id': analysis.report_id,
+        'analysis_id': analysis.id,
+        'file': arcname or '',
+        'status': 'ok' if arcname else 'failed',
+        'error': error,
+        'analysis_date': analysis.analysis_date.isoformat() if analysis.analysis_date else '',
+        'classification': analysis.classification,
+        'authenticity_score': round(analysis.authenticity_score, 2),
+        'confidence_level': analysis.confidence_level,
+        'media_source': analysis.media_source,
+        'file_name': analysis.file_name,
+        'file_hash_sha256': analysis.file_hash_sha256,
+    }
+
+def stream_export(analyses, filters=None, summary=None, workers=None):
+    """Yield a ZIP of the analyses' PDF reports plus manifest.json and manifest.csv.
+
+    Each report is copied into the archive from its stored file in chunks
+    as soon as it is available, so memory use does not grow with the
+    number of reports. Missing reports are rendered on the shared pool, or
+    on a pool of ``workers`` processes for this export alone. ``summary``,
+    if given, is filled with counts.
+    """
+    summary = summary if summary is not None else {}
+    summary.update({'reports': 0, 'failed': 0, 'bytes': 0})
+    if workers is None:
+        workers, pool = getattr(settings, 'DEEPIMAGE_EXPORT_WORKERS', 2), render_pool()
+    else:
+        pool = create_pool(workers)
+    stream = _ZipStream()
+    manifest = []
+
+    def drain():
+        data = stream.drain()
+        summary['bytes'] += len(data)
+        return data
+
+    try:
+        with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for analysis, name, error in _rendered(analyses, pool, max(1, 2 * workers)):
+                arcname = None
+                if name:
+                    arcname = f"reports/{analysis.report_id}.pdf"
+                    with open(os.path.join(settings.MEDIA_ROOT, name), 'rb') as source:
+                        with archive.open(arcname, 'w', force_zip64=True) as target:
+                            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                                target.write(chunk)
+                                yield drain()
+                    summary['reports'] += 1
+                else:
+                    logger.error(f"Export of {analysis.report_id} failed: {error}")
+                    summary['failed'] += 1
+                manifest.append(_manifest_row(analysis, arcname, error))
+                yield drain()
+
+            archive.writestr('manifest.json', json.dumps({
+                'generated_at': timezone.now().isoformat(),
+                'filters': filters or {},
+                'reports': manifest,
+            }, indent=2, default=str), compress_type=zipfile.ZIP_DEFLATED)
+            rows = io.StringIO()
+            writer = csv.DictWriter(rows, fieldnames=MANIFEST_FIELDS)
+            writer.writeheader()
+            writer.writerows(manifest)
+            archive.writestr('manifest.csv', rows.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+        yield drain()
+    finally:
+        if pool is not None and pool is not _pool:
+            pool.shutdown(cancel_futures=True)
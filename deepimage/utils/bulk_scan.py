@@ -0,0 +1,294 @@
+import csv
+import hashlib
+import io
+import logging
+import os
+import tarfile
+import threading
+import zipfile
+from collections import Counter
+from datetime import datetime
+from functools import partial
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from . import metrics, rollups
+from .batch_predict import ALLOWED_EXTENSIONS, ARCHIVE_EXTENSIONS
+from .prediction_cache import prediction_cache
+from .preprocessing import preprocessor
+
+logger = logging.getLogger(__name__)
+
+# Columns of CSV and Parquet scan output
+OUTPUT_COLUMNS = [
+    'source', 'name', 'status', 'error', 'sha256', 'md5', 'file_size', 'resolution', 'file_format',
+    'label', 'confidence', 'is_deepfake', 'authenticity_score', 'classification', 'confidence_level',
+    'model_version', 'cached', 'report_id',
+]
+
+NUMERIC_COLUMNS = {'file_size', 'confidence', 'authenticity_score', 'is_deepfake', 'cached'}
+
+def is_image_name(name):
+    return name.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+class ScanEntry:
+    """An image found in a scanned source; ``read`` returns its bytes"""
+
+    def __init__(self, key, name, size, read):
+        self.key = key
+        self.name = name
+        self.size = size
+        self.read = read
+
+def iter_sources(paths, skip_keys=()):
+    """Yield a ScanEntry for every image in the given directories, archives and files.
+
+    Directories are walked in sorted order so that a resumed scan sees the
+    same sequence. Entries whose key is in ``skip_keys`` are not read. Zip
+    members are read by the decode workers; tar members have to be read in
+    order here.
+    """
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file_name in sorted(files):
+                    full_path = os.path.join(root, file_name)
+                    if not is_image_name(file_name) or full_path in skip_keys:
+                        continue
+                    yield ScanEntry(full_path, os.path.relpath(full_path, path), os.path.getsize(full_path),
+                                    partial(_read_file, full_path))
+        elif path.lower().endswith('.zip'):
+            # Not closed here: workers may still be reading the last members,
+            # and the entries keep the archive open until they are released
+            archive = zipfile.ZipFile(path)
+            for info in archive.infolist():
+                key = f"{path}::{info.filename}"
+                if info.is_dir() or not is_image_name(info.filename) or key in skip_keys:
+                    continue
+                yield ScanEntry(key, info.filename, info.file_size, partial(archive.read, info))
+        elif path.lower().endswith(ARCHIVE_EXTENSIONS):
+            with tarfile.open(path, mode='r:*') as archive:
+                for member in archive:
+                    key = f"{path}::{member.name}"
+                    if not member.isfile() or not is_image_name(member.name) or key in skip_keys:
+                        continue
+                    data = archive.extractfile(member).read()
+                    yield ScanEntry(key, member.name, member.size, partial(bytes, data))
+        elif os.path.isfile(path) and is_image_name(path):
+            if path not in skip_keys:
+                yield ScanEntry(path, os.path.basename(path), os.path.getsize(path), partial(_read_file, path))
+        else:
+            raise ValueError(f"Not a directory, zip/tar archive or image file: {path}")
+
+class Checkpoint:
+    """Append-only record of scanned entries so an interrupted scan can resume.
+
+    Each line holds the entry key, its SHA-256 and its status, and is
+    written only after the entry's result has been stored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = set()
+        self.hashes = set()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    key, content_hash, _ = line.rstrip('\n').rsplit('\t', 2)
+                    self.keys.add(key)
+                    if content_hash:
+                        self.hashes.add(content_hash)
+        self._file = open(path, 'a', encoding='utf-8') if path else None
+
+    def record(self, items):
+        if self._file is None:
+            return
+        for item in items:
+            self._file.write(f"{item.key}\t{item.sha256 or ''}\t{item.status}\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+class ScanItem:
+    """A scanned entry on its way through the decode workers and the model"""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.key = entry.key
+        self.name = entry.name
+        self.status = 'pending'
+        self.error = ''
+        self.sha256 = None
+        self.analysis = None
+        self.result = None
+
+class SeenHashes:
+    """Content hashes already analysed, shared by the decode workers"""
+
+    def __init__(self, hashes=()):
+        self._hashes = set(hashes)
+        self._lock = threading.Lock()
+
+    def claim(self, content_hash):
+        """Return True the first time a hash is claimed"""
+        with self._lock:
+            if content_hash in self._hashes:
+                return False
+            self._hashes.add(content_hash)
+            return True
+
+def prepare(item, seen, max_file_size, model_version):
+    """Read, fingerprint and decode one entry on a worker thread and return its image.
+
+    Returns None for content seen before, which is marked 'duplicate', and
+    for content with a cached prediction. The image is kept in memory with
+    the unsaved analysis; writers that store reports copy it to media
+    storage only once the analysis is done.
+    """
+    from ..models import ForensicAnalysis
+    if item.entry.size > max_file_size:
+        raise ValueError('File too large')
+    data = item.entry.read()
+    analysis = ForensicAnalysis(original_file=ContentFile(data, name=os.path.basename(item.name)))
+    analysis.refresh_file_details()
+    analysis.file_name = item.name[-255:]
+    item.sha256 = analysis.file_hash_sha256 or hashlib.sha256(data).hexdigest()
+    if not seen.claim(item.sha256):
+        item.status = 'duplicate'
+        return None
+    item.analysis = analysis
+
+    cached = prediction_cache.get(item.sha256, model_version)
+    if cached is not None:
+        item.result = {**cached, 'cached': True}
+        return None
+    return preprocessor.load(io.BytesIO(data))
+
+class ReportIds:
+    """Sequential report IDs for scanned analyses: DFS-<date>-<7 digits>"""
+
+    def __init__(self):
+        self._next = {}
+
+    def __call__(self):
+        from ..models import ForensicAnalysis
+        prefix = f"DFS-{datetime.now().strftime('%Y%m%d')}-"
+        if prefix not in self._next:
+            last = (ForensicAnalysis.objects.filter(report_id__startswith=prefix)
+                    .order_by('-report_id').values_list('report_id', flat=True).first())
+            self._next[prefix] = int(last[len(prefix):]) + 1 if last else 1
+        number = self._next[prefix]
+        self._next[prefix] += 1
+        return f"{prefix}{number:07d}"
+
+def output_row(item, model_version=''):
+    row = {column: '' for column in OUTPUT_COLUMNS}
+    row.update({'source': item.key, 'name': item.name, 'status': item.status, 'error': item.error,
+                'sha256': item.sha256 or ''})
+    analysis = item.analysis
+    if analysis is not None:
+        row.update({
+            'md5': analysis.file_hash_md5, 'file_size': analysis.file_size, 'resolution': analysis.resolution,
+            'file_format': analysis.file_format, 'report_id': analysis.report_id or '',
+        })
+    if item.result is not None:
+        row.update({
+            'label': item.result['label'], 'confidence': item.result['confidence'],
+            'is_deepfake': item.result['is_deepfake'], 'model_version': model_version,
+            'cached': item.result.get('cached', False),
+        })
+        if analysis is not None:
+            row.update({
+                'authenticity_score': analysis.authenticity_score, 'classification': analysis.classification,
+                'confidence_level': analysis.confidence_level,
+            })
+    return row
+
+class DatabaseWriter:
+    """Insert the analyses of each batch with one bulk INSERT"""
+
+    def __init__(self):
+        self.report_id = ReportIds()
+
+    def write(self, items, model_version):
+        from ..models import ForensicAnalysis
+        analyses = [item.analysis for item in items if item.status == 'done']
+        stored = []
+        try:
+            # Only finished analyses get their image copied to media storage
+            for analysis in analyses:
+                analysis.report_id = self.report_id()
+                upload = analysis.original_file
+                upload.save(os.path.basename(analysis.file_name), upload.file, save=False)
+                stored.append(upload)
+            counts = Counter()
+            with metrics.timed('db_write'), transaction.atomic():
+                ForensicAnalysis.objects.bulk_create(analyses)
+                for analysis in analyses:
+                    counts.update(rollups.analysis_counts(analysis, []))
+                rollups.increment(counts)
+        except Exception:
+            for upload in stored:
+                upload.storage.delete(upload.name)
+            raise
+
+    def close(self):
+        pass
+
+class CsvWriter:
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=OUTPUT_COLUMNS)
+        if new:
+            self._writer.writeheader()
+
+    def write(self, items, model_version):
+        self._writer.writerows(output_row(item, model_version) for item in items)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+class ParquetWriter:
+    """Write each batch as a row group; a resumed scan writes a new part file"""
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        root, ext = os.path.splitext(path)
+        part = 1
+        while os.path.exists(path):
+            path = f"{root}.part{part}{ext}"
+            part += 1
+        self.path = path
+        types = {
+            'file_size': pa.int64(), 'confidence': pa.float64(), 'authenticity_score': pa.float64(),
+            'is_deepfake': pa.bool_(), 'cached': pa.bool_(),
+        }
+        self._pa = pa
+        self._schema = pa.schema([(column, types.get(column, pa.string())) for column in OUTPUT_COLUMNS])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, items, model_version):
+        rows = [output_row(item, model_version) for item in items]
+        # Blank values of typed columns become nulls
+        columns = {
+            column: [None if row[column] == '' and column in NUMERIC_COLUMNS else row[column] for row in rows]
+            for column in OUTPUT_COLUMNS
+        }
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
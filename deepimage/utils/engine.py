@@ -0,0 +1,160 @@
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+from .batching import MicroBatcher
+from .preprocessing import preprocessor
+
+logger = logging.getLogger(__name__)
+
+class BaseDetector:
+    """Prediction logic shared by the inference engines.
+
+    Subclasses load a model, set ``model``, ``model_version`` and ``device``
+    and implement ``forward_normalized``, which takes a normalized
+    (N, 3, 224, 224) float32 batch and returns an (N, 2) NumPy array of
+    softmax probabilities. This module does not import torch.
+    """
+
+    engine = None
+    backend = 'default'
+    index_label = {0: "real", 1: "deepfake"}
+    batcher = None
+
+    def configure_batching(self):
+        """Start micro-batching when the configured batch size allows it"""
+        max_batch_size = getattr(settings, 'DEEPIMAGE_INFERENCE_BATCH_SIZE', 8)
+        max_wait_ms = getattr(settings, 'DEEPIMAGE_INFERENCE_BATCH_WAIT_MS', 10)
+        if max_batch_size > 1:
+            self.batcher = MicroBatcher(
+                self.forward_arrays, max_batch_size, max_wait_ms, name='inference-batcher'
+            )
+        else:
+            self.batcher = None
+
+    def preprocess(self, image_path):
+        """Decode an image at reduced size and return it as a 224x224 uint8 array"""
+        return preprocessor.load(image_path)
+
+    def allocate_batch(self, batch_size):
+        """Return an (N, 3, H, W) float32 array that ``forward_normalized`` accepts"""
+        return np.empty((batch_size, 3) + preprocessor.size[::-1], dtype=np.float32)
+
+    def forward_normalized(self, batch):
+        """Run one forward pass over a normalized batch and return (N, 2) probabilities"""
+        raise NotImplementedError
+
+    def forward_arrays(self, arrays):
+        """Normalize uint8 images into the thread's input buffer and run one forward pass"""
+        return self.forward_normalized(preprocessor.normalize(arrays))
+
+    @property
+    def has_features(self):
+        """Whether ``forward_with_features`` returns penultimate features"""
+        return False
+
+    def forward_with_features(self, arrays):
+        """Return (N, 2) probabilities and (N, D) penultimate features, None if the engine has none"""
+        return self.forward_arrays(arrays), None
+
+    def format_output(self, output):
+        """Turn one row of softmax probabilities into a prediction result"""
+        output = np.asarray(output)[np.newaxis]
+
+        # Debug output
+        logger.info(f"Model output: {output}")
+
+        # Get results
+        pred_index = int(output.argmax(1)[0])
+        confidence = round(float(output[0][pred_index]) * 100, 2)
+        label = self.index_label[pred_index]
+
+        return {
+            'label': label,
+            'confidence': confidence,
+            'is_deepfake': pred_index == 1,
+            'raw_output': output.tolist()  # For debugging
+        }
+
+    def predict(self, image_path):
+        """Make prediction on a single image"""
+        if self.model is None:
+            return {'error': 'Model not loaded'}
+
+        try:
+            # Load and preprocess image
+            img = self.preprocess(image_path)
+
+            # Predict, sharing the forward pass with concurrent callers when batching
+            if self.batcher is not None:
+                output = self.batcher.submit(img).result()
+            else:
+                output = self.forward_arrays([img])[0]
+
+            return self.format_output(output)
+
+        except Exception as e:
+            logger.error(f"Prediction error: {str(e)}")
+            metrics.error('predict')
+            return {'error': str(e)}
+
+    def predict_with_features(self, image_path):
+        """Make a prediction on a single image and return it with the image's features"""
+        if self.model is None:
+            return {'error': 'Model not loaded'}, None
+
+        try:
+            probabilities, features = self.forward_with_features([self.preprocess(image_path)])
+            return self.format_output(probabilities[0]), None if features is None else features[0]
+        except Exception as e:
+            logger.error(f"Prediction error: {str(e)}")
+            metrics.error('predict')
+            return {'error': str(e)}, None
+
+    def predict_batch(self, image_paths):
+        """Make predictions on several images with a single forward pass.
+
+        Results are returned in input order; images that fail to load get an
+        ``{'error': ...}`` entry without affecting the rest of the batch.
+        """
+        if self.model is None:
+            return [{'error': 'Model not loaded'} for _ in image_paths]
+
+        results = [None] * len(image_paths)
+        arrays, indices = [], []
+        for index, image_path in enumerate(image_paths):
+            try:
+                arrays.append(self.preprocess(image_path))
+                indices.append(index)
+            except Exception as e:
+                logger.error(f"Prediction error: {str(e)}")
+                metrics.error('predict')
+                results[index] = {'error': str(e)}
+
+        if arrays:
+            try:
+                outputs = self.forward_arrays(arrays)
+                for row, index in enumerate(indices):
+                    results[index] = self.format_output(outputs[row])
+            except Exception as e:
+                logger.error(f"Prediction error: {str(e)}")
+                metrics.error('predict')
+                for index in indices:
+                    results[index] = {'error': str(e)}
+        return results
+
+    def stats(self):
+        """Return inference engine statistics"""
+        stats = {
+            'device': self.device,
+            'model_loaded': self.model is not None,
+            'model_version': self.model_version,
+            'engine': self.engine,
+            'backend': self.backend,
+            'batching_enabled': self.batcher is not None,
+        }
+        if self.batcher is not None:
+            stats['batching'] = self.batcher.stats()
+        return stats
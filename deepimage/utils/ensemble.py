@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .onnx_engine import create_session
+from .prediction_cache import prediction_cache, file_sha256
+from .preprocessing import preprocessor
+from .registry import detector
+
+logger = logging.getLogger(__name__)
+
+# Fraction of the input kept by the centre-crop views
+CROP_FRACTION = 0.875
+
+def center_crop(array):
+    """Crop the centre of a 224x224 image and resize it back to the model input size"""
+    height, width = array.shape[:2]
+    crop_h, crop_w = int(height * CROP_FRACTION), int(width * CROP_FRACTION)
+    top, left = (height - crop_h) // 2, (width - crop_w) // 2
+    return cv2.resize(array[top:top + crop_h, left:left + crop_w], (width, height), interpolation=cv2.INTER_LINEAR)
+
+# Test-time augmentations applied to the preprocessed uint8 image
+VIEWS = {
+    'identity': lambda array: array,
+    'hflip': lambda array: array[:, ::-1],
+    'crop': center_crop,
+    'crop_hflip': lambda array: center_crop(array)[:, ::-1],
+}
+
+class MemberModel:
+    """An extra ensemble checkpoint: a torch .pth file or an exported .onnx file"""
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith('.onnx'):
+            self.session = create_session(path)
+            self.model = None
+        else:
+            # Only torch checkpoints need torch, so ONNX-only workers never import it
+            from .model_loader import load_checkpoint
+            self.session = None
+            self.model = load_checkpoint(path)
+
+    def forward_arrays(self, arrays):
+        batch = preprocessor.normalize(arrays)
+        if self.session is not None:
+            return self.session.run(None, {self.session.get_inputs()[0].name: batch})[0]
+        import torch
+        with torch.no_grad():
+            return self.model(torch.from_numpy(batch)).numpy()
+
+class Ensemble:
+    """Score fusion over several checkpoints and test-time augmented views.
+
+    Members come from DEEPIMAGE_ENSEMBLE_MEMBERS, each a dict with a
+    ``name``, a ``view`` from VIEWS, a ``weight`` and an optional
+    ``checkpoint`` (the serving detector when omitted). All views of one
+    checkpoint go through a single batched forward pass. The first member
+    is the gate: when it is the serving detector's identity view its score
+    is the prediction that has already been made, and when its confidence
+    reaches DEEPIMAGE_ENSEMBLE_EARLY_EXIT_CONFIDENCE the other members are
+    skipped.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @property
+    def members(self):
+        members = getattr(settings, 'DEEPIMAGE_ENSEMBLE_MEMBERS', None) or []
+        return [
+            {
+                'name': member.get('name') or f"{member.get('checkpoint') or 'primary'}:{member.get('view', 'identity')}",
+                'checkpoint': member.get('checkpoint'),
+                'view': member.get('view', 'identity'),
+                'weight': float(member.get('weight', 1.0)),
+            }
+            for member in members
+        ]
+
+    @property
+    def fusion(self):
+        return getattr(settings, 'DEEPIMAGE_ENSEMBLE_FUSION', 'weighted')
+
+    @property
+    def early_exit_confidence(self):
+        return getattr(settings, 'DEEPIMAGE_ENSEMBLE_EARLY_EXIT_CONFIDENCE', 95.0)
+
+    def version(self, members):
+        """Cache key version for fused results of the current models and configuration"""
+        config = [self.fusion, members]
+        for checkpoint in sorted({member['checkpoint'] for member in members if member['checkpoint']}):
+            stat = os.stat(checkpoint)
+            config.append([checkpoint, stat.st_size, stat.st_mtime])
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+        return f"{detector.model_version or 'unknown'}+ensemble-{digest}"
+
+    def model(self, checkpoint):
+        """The serving detector, or an extra checkpoint loaded on first use"""
+        if not checkpoint:
+            return detector
+        with self._lock:
+            if checkpoint not in self._models:
+                logger.info(f"Loading ensemble checkpoint from: {checkpoint}")
+                self._models[checkpoint] = MemberModel(checkpoint)
+            return self._models[checkpoint]
+
+    def is_primary(self, member):
+        return not member['checkpoint'] and member['view'] == 'identity'
+
+    def score(self, members, image):
+        """Deepfake probability of each member, one forward pass per checkpoint"""
+        scores = {}
+        groups = {}
+        for member in members:
+            groups.setdefault(member['checkpoint'], []).append(member)
+        for checkpoint, group in groups.items():
+            views = [np.ascontiguousarray(VIEWS[member['view']](image)) for member in group]
+            outputs = self.model(checkpoint).forward_arrays(views)
+            for member, output in zip(group, outputs):
+                scores[member['name']] = float(output[1])
+        return scores, len(groups)
+
+    def fuse(self, members, scores):
+        """Fused deepfake probability of the members that ran"""
+        ran = [member for member in members if member['name'] in scores]
+        values = np.array([scores[member['name']] for member in ran])
+        if self.fusion == 'median':
+            return float(np.median(values))
+        weights = np.array([member['weight'] for member in ran])
+        return float((values * weights).sum() / weights.sum())
+
+    def refine(self, image_path, result, content_hash):
+        """Return the ensemble prediction for an image and the per-member results.
+
+        ``result`` is the serving detector's prediction for the image. It is
+        returned unchanged, with empty ensemble results, when no ensemble is
+        configured or the prediction failed.
+        """
+        members = self.members
+        if len(members) < 2 or 'error' in result:
+            return result, {}
+
+        started = time.perf_counter()
+        gate, rest = members[0], members[1:]
+        scores, passes = {}, 0
+        image = None
+        if self.is_primary(gate):
+            scores[gate['name']] = float(np.asarray(result['raw_output'])[0][1])
+        else:
+            image = detector.preprocess(image_path)
+            gate_scores, passes = self.score([gate], image)
+            scores.update(gate_scores)
+
+        gate_confidence = max(scores[gate['name']], 1 - scores[gate['name']]) * 100
+        early_exit = gate_confidence >= self.early_exit_confidence
+        cached = False
+        if not early_exit:
+            content_hash = content_hash or file_sha256(image_path)
+            version = self.version(members)
+            fused_result = prediction_cache.get(content_hash, version)
+            if fused_result is not None:
+                scores, cached = fused_result.pop('member_scores'), True
+            else:
+                try:
+                    if image is None:
+                        image = detector.preprocess(image_path)
+                    rest_scores, rest_passes = self.score(rest, image)
+                except Exception as e:
+                    logger.error(f"Ensemble error, using the first member only: {str(e)}")
+                    rest_scores, rest_passes = {}, 0
+                scores.update(rest_scores)
+                passes += rest_passes
+
+        probability = self.fuse(members, scores)
+        if early_exit and self.is_primary(gate):
+            fused = result
+        else:
+            fused = detector.format_output([1 - probability, probability])
+        if not early_exit and not cached and len(scores) == len(members):
+            prediction_cache.set(content_hash, version, {**fused, 'member_scores': scores})
+
+        details = {
+            'fusion': self.fusion,
+            'early_exit': early_exit,
+            'cached': cached,
+            'forward_passes': passes,
+            'deepfake_probability': round(probability, 6),
+            'members': [
+                {
+                    **member,
+                    'deepfake_probability': round(scores[member['name']], 6) if member['name'] in scores else None,
+                    'status': 'done' if member['name'] in scores else 'skipped',
+                }
+                for member in members
+            ],
+            'ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+        return fused, details
+
+ensemble = Ensemble()
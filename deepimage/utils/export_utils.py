@@ -1,44 +1,230 @@
+import glob
+import hashlib
+import json
+import logging
 import os
+import threading
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import HttpResponse
-from django.template.loader import render_to_string
+from django.db import transaction
+from django.http import HttpResponse, FileResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from xhtml2pdf import pisa
 from io import BytesIO
-import tempfile
 from django.shortcuts import render
+from . import metrics
+from .analysis_search import FilterError, filters_from_query
+from .async_inference import inference_executor, streaming_content
+from .bulk_export import filter_analyses, stream_export
+from .heatmaps import ensure_heatmap, existing_heatmap, heatmap_pending, heatmap_url
+from .job_queue import JobQueue, QueueFull
+from .media_files import write_atomic
 
-def export_pdf(request, analysis_id):
-    """Export analysis as PDF using xhtml2pdf (Windows compatible)"""
+logger = logging.getLogger(__name__)
+
+report_queue = JobQueue(
+    'reports',
+    workers=getattr(settings, 'DEEPIMAGE_PDF_WORKERS', 1),
+    max_pending=getattr(settings, 'DEEPIMAGE_PDF_QUEUE_SIZE', 256),
+)
+
+# Rendered PDFs live under MEDIA_ROOT/reports/<template version>/<report ID>-<state>.pdf
+PDF_DIR = 'reports'
+PDF_TEMPLATE = 'pdf_report.html'
+
+_template_version = None
+_resolved_links = {}
+
+def template_version():
+    """Digest of the PDF template source, so editing the template invalidates stored PDFs"""
+    global _template_version
+    if _template_version is None:
+        with open(get_template(PDF_TEMPLATE).origin.name, 'rb') as f:
+            _template_version = hashlib.sha256(f.read()).hexdigest()[:12]
+    return _template_version
+
+def report_state(analysis):
+    """Digest of every stored field of an analysis; it changes whenever the report would"""
+    values = {field.attname: getattr(analysis, field.attname) for field in analysis._meta.concrete_fields}
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def pdf_name(analysis):
+    """Storage path of an analysis' rendered PDF, relative to MEDIA_ROOT"""
+    return f"{PDF_DIR}/{template_version()}/{analysis.report_id}-{report_state(analysis)}.pdf"
+
+def pdf_etag(analysis):
+    """ETag of the PDF export, computed from the database row without rendering"""
+    return quote_etag(f"{template_version()}-{report_state(analysis)}")
+
+def render_pdf(analysis, heatmap_name=None):
+    """Render an analysis' PDF report and return its bytes, or None if xhtml2pdf fails"""
+    # xhtml2pdf reads images from disk, so the heatmap is referenced by its media URL
+    html_string = render_to_string(PDF_TEMPLATE, {
+        'analysis': analysis,
+        'result': analysis.raw_prediction_data,
+        'heatmap_url': heatmap_url(heatmap_name) if heatmap_name else '',
+    })
+    buffer = BytesIO()
+    with metrics.timed('pdf_render'):
+        pdf_status = pisa.CreatePDF(html_string, dest=buffer, link_callback=link_callback)
+    if pdf_status.err:
+        logger.error(f"PDF generation error for {analysis.report_id}")
+        metrics.error('pdf_render')
+        return None
+    return buffer.getvalue()
+
+def remove_stale_pdfs(analysis, keep=None):
+    """Delete stored PDFs of a report other than ``keep``, across template versions"""
+    pattern = os.path.join(settings.MEDIA_ROOT, PDF_DIR, '*', f"{glob.escape(analysis.report_id)}-*.pdf")
+    for path in glob.glob(pattern):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def pdf_stored(analysis):
+    """Whether the PDF for an analysis' current report state has been rendered"""
+    return os.path.exists(os.path.join(settings.MEDIA_ROOT, pdf_name(analysis)))
+
+def ensure_pdf(analysis, generate_heatmap=True):
+    """Return the storage name of an analysis' current PDF, rendering it if needed.
+
+    A heatmap that has not been generated yet is generated first, which
+    runs the model, unless ``generate_heatmap`` is False. Returns None when
+    rendering fails.
+    """
+    name = pdf_name(analysis)
+    if os.path.exists(os.path.join(settings.MEDIA_ROOT, name)):
+        return name
+    heatmap = ensure_heatmap(analysis) if generate_heatmap else existing_heatmap(analysis)
+    return store_pdf(analysis, render_pdf(analysis, heatmap))
+
+def store_pdf(analysis, pdf):
+    """Store a rendered PDF as the analysis' current one and return its storage name"""
+    if pdf is None:
+        return None
+    name = pdf_name(analysis)
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    write_atomic(path, pdf)
+    remove_stale_pdfs(analysis, keep=path)
+    return name
+
+def prerender_pdf(analysis_id):
+    """Background job rendering a finished analysis' PDF.
+
+    The report queue never runs the model: while the analysis' heatmap has
+    not been generated the PDF is left to render on download, or to be
+    queued again once the report page has generated the heatmap.
+    """
     from ..models import ForensicAnalysis
-    try:
-        analysis = ForensicAnalysis.objects.get(id=analysis_id)
-        
-        # Render HTML template
-        html_string = render_to_string('pdf_report.html', {
-            'analysis': analysis,
-            'result': analysis.raw_prediction_data,
-            'base_url': request.build_absolute_uri('/')
-        })
-        
-        # Create PDF
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="forensic_report_{analysis.report_id}.pdf"'
-        
-        # Generate PDF
-        pdf_status = pisa.CreatePDF(
-            html_string,
-            dest=response,
-            link_callback=link_callback
-        )
-        
-        if pdf_status.err:
-            return HttpResponse('PDF generation error', status=500)
-            
-        return response
-        
-    except ForensicAnalysis.DoesNotExist:
+    with _pending_lock:
+        _pending.discard(analysis_id)
+    analysis = ForensicAnalysis.objects.filter(id=analysis_id).first()
+    if analysis is None or analysis.status != 'done':
+        return
+    if heatmap_pending(analysis):
+        logger.debug(f"Heatmap of {analysis.report_id} not generated yet, not pre-rendering its PDF")
+        return
+    ensure_pdf(analysis, generate_heatmap=False)
+
+_pending = set()
+_pending_lock = threading.Lock()
+
+def schedule_pdf(analysis_id):
+    """Queue a PDF render for an analysis once the current transaction commits"""
+    if not getattr(settings, 'DEEPIMAGE_PDF_PRERENDER', True):
+        return
+
+    def submit():
+        with _pending_lock:
+            if analysis_id in _pending:
+                return
+            _pending.add(analysis_id)
+        try:
+            report_queue.submit(prerender_pdf, analysis_id)
+        except QueueFull:
+            with _pending_lock:
+                _pending.discard(analysis_id)
+            logger.warning(f"Report queue full, PDF for analysis {analysis_id} will render on download")
+
+    transaction.on_commit(submit)
+
+def analysis_saved(sender, instance, created, **kwargs):
+    """post_save handler re-rendering the stored PDF of an edited analysis.
+
+    Stored PDFs are named by report_state, so a PDF for the saved state
+    already exists unless the save changed the report. Nothing is queued
+    while the heatmap is pending, as prerender_pdf would skip the render.
+    """
+    if not created and instance.status == 'done' and not pdf_stored(instance) and not heatmap_pending(instance):
+        schedule_pdf(instance.id)
+
+async def export_pdf(request, analysis_id):
+    """Serve an analysis' PDF, rendering and storing it on first download.
+
+    A matching If-None-Match is answered from the database row alone;
+    rendering runs on the inference executor.
+    """
+    from ..models import ForensicAnalysis
+    analysis = await ForensicAnalysis.objects.filter(id=analysis_id).afirst()
+    if analysis is None:
         return HttpResponse("Report not found", status=404)
 
+    etag = pdf_etag(analysis)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            name = await inference_executor.run(ensure_pdf, analysis)
+        except QueueFull:
+            response = HttpResponse('Server busy, retry later', status=503)
+            response['Retry-After'] = '5'
+            return response
+        if name is None:
+            return HttpResponse('PDF generation error', status=500)
+
+        response = FileResponse(
+            open(os.path.join(settings.MEDIA_ROOT, name), 'rb'), content_type='application/pdf',
+            as_attachment=True, filename=f"forensic_report_{analysis.report_id}.pdf",
+        )
+        response.streaming_content = streaming_content(request, response.streaming_content)
+        # Let clients keep the file but revalidate it with the ETag
+        patch_cache_control(response, private=True, no_cache=True)
+    if request.method in ('GET', 'HEAD'):
+        response.headers.setdefault('ETag', etag)
+    return response
+
+async def export_zip(request):
+    """Stream a ZIP of the PDF reports matching the query filters, with a manifest"""
+    filters = filters_from_query(request.GET)
+    try:
+        analyses = filter_analyses(**filters)
+    except FilterError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    max_reports = getattr(settings, 'DEEPIMAGE_EXPORT_MAX_REPORTS', 10000)
+    count = await analyses.acount()
+    if not count:
+        return JsonResponse({'success': False, 'error': 'No reports match the filters'}, status=404)
+    if count > max_reports:
+        return JsonResponse({
+            'success': False, 'error': f"{count} reports match; narrow the filters to at most {max_reports}",
+        }, status=400)
+
+    # Rows are read and PDFs rendered on the stream's own thread
+    response = StreamingHttpResponse(
+        streaming_content(request, stream_export(analyses, filters)), content_type='application/zip'
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="forensic_reports_{timezone.now().strftime("%Y%m%d_%H%M%S")}.zip"'
+    )
+    # Don't let a proxy buffer the archive before passing it on
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 def link_callback(uri, rel):
     """
     Convert HTML URIs to absolute system paths so xhtml2pdf can access those resources
@@ -46,6 +232,10 @@ def link_callback(uri, rel):
     # Convert data URIs
     if uri.startswith("data:"):
         return uri
+    # Static assets that resolved once are not looked up on disk again
+    cached = _resolved_links.get(uri)
+    if cached is not None:
+        return cached
         
     # Use static files
     if uri.startswith(settings.STATIC_URL):
@@ -64,14 +254,16 @@ def link_callback(uri, rel):
     if not os.path.isfile(path):
         raise Exception(f'File not found: {path}')
         
+    if uri.startswith(settings.STATIC_URL):
+        _resolved_links[uri] = path
     return path
 
-def export_print_view(request, analysis_id):
+async def export_print_view(request, analysis_id):
     """View for print-friendly version"""
     from ..models import ForensicAnalysis
     try:
-        analysis = ForensicAnalysis.objects.get(id=analysis_id)
-        return render(request, 'print_report.html', {
+        analysis = await ForensicAnalysis.objects.aget(id=analysis_id)
+        return await sync_to_async(render)(request, 'print_report.html', {
             'analysis': analysis,
             'result': analysis.raw_prediction_data
         })
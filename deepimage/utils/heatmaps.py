@@ -0,0 +1,151 @@
+import io
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image
+
+from .media_files import write_atomic
+from .prediction_cache import prediction_cache, file_sha256
+from .preprocessing import preprocessor
+from .registry import detector
+
+logger = logging.getLogger(__name__)
+
+# Overlays live under MEDIA_ROOT/heatmaps/<model version>/<sha256>.png
+HEATMAP_DIR = 'heatmaps'
+OVERLAY_MAX_SIZE = 512
+OVERLAY_ALPHA = 0.45
+
+def heatmap_mode():
+    """'eager' (with the prediction), 'lazy' (when a report asks) or 'off'"""
+    return getattr(settings, 'DEEPIMAGE_HEATMAP_MODE', 'lazy')
+
+def saliency_available():
+    """Heatmaps need the eager torch model"""
+    return detector.engine == 'torch' and detector.model is not None
+
+def heatmap_name(content_hash):
+    """Storage path of an image's overlay, relative to MEDIA_ROOT"""
+    # Heatmaps always come from the eager model, whatever backend serves predictions
+    version = (detector.model_version or 'unknown').split('+', 1)[0]
+    return f"{HEATMAP_DIR}/{version}/{content_hash}.png"
+
+def heatmap_url(name):
+    return f"{settings.MEDIA_URL}{name}"
+
+def heatmap_file(name):
+    return os.path.join(settings.MEDIA_ROOT, name)
+
+def colorize(cam):
+    """Map values in [0, 1] to RGB with a jet-style colour ramp"""
+    red = np.clip(1.5 - np.abs(4 * cam - 3), 0, 1)
+    green = np.clip(1.5 - np.abs(4 * cam - 2), 0, 1)
+    blue = np.clip(1.5 - np.abs(4 * cam - 1), 0, 1)
+    return (np.stack([red, green, blue], axis=-1) * 255).astype(np.uint8)
+
+def render_overlay(image_path, cam):
+    """Blend a saliency map over a downscaled copy of the image and return palette PNG bytes"""
+    with preprocessor.open(image_path) as source:
+        source.draft('RGB', (OVERLAY_MAX_SIZE, OVERLAY_MAX_SIZE))
+        img = source.convert('RGB')
+    img.thumbnail((OVERLAY_MAX_SIZE, OVERLAY_MAX_SIZE), Image.BILINEAR, reducing_gap=2.0)
+
+    cam = cam - cam.min()
+    peak = cam.max()
+    if peak > 0:
+        cam = cam / peak
+    heat = Image.fromarray((cam * 255).astype(np.uint8)).resize(img.size, Image.BILINEAR)
+    heat = Image.fromarray(colorize(np.asarray(heat, dtype=np.float32) / 255))
+
+    buffer = io.BytesIO()
+    Image.blend(img, heat, OVERLAY_ALPHA).quantize(colors=256).save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+def store_heatmap(name, png):
+    """Write an overlay atomically so concurrent readers never see a partial file"""
+    write_atomic(heatmap_file(name), png)
+
+def save_overlay(name, image_path, cam):
+    """Render and store an overlay, returning False if that fails"""
+    try:
+        store_heatmap(name, render_overlay(image_path, cam))
+        return True
+    except Exception as e:
+        logger.error(f"Heatmap generation error: {str(e)}")
+        return False
+
+def predict_with_heatmap(image_path, content_hash=None):
+    """Return (prediction, heatmap URL), sharing one forward pass when the model has to run.
+
+    Cached overlays and predictions are reused. The URL is empty when no
+    heatmap could be produced.
+    """
+    if not content_hash:
+        content_hash = file_sha256(image_path)
+    name = heatmap_name(content_hash)
+    if os.path.exists(heatmap_file(name)) or not saliency_available():
+        url = heatmap_url(name) if os.path.exists(heatmap_file(name)) else ''
+        return prediction_cache.predict(image_path, content_hash), url
+
+    result, cam = detector.predict_with_saliency(image_path)
+    if 'error' in result:
+        return result, ''
+    if detector.backend == 'eager':
+        prediction_cache.set(content_hash, detector.model_version, result)
+    else:
+        # The serving backend may score slightly differently from eager
+        result = prediction_cache.predict(image_path, content_hash)
+
+    return result, heatmap_url(name) if save_overlay(name, image_path, cam) else ''
+
+def ensure_heatmap(analysis):
+    """Return the storage name of an analysis' heatmap, generating it on first request.
+
+    Returns None when heatmaps are off or cannot be produced.
+    """
+    name = existing_heatmap(analysis)
+    if name is not None:
+        return name
+    if heatmap_mode() == 'off' or not analysis.file_hash_sha256 or not saliency_available():
+        return None
+
+    name = heatmap_name(analysis.file_hash_sha256)
+    image_path = os.path.join(settings.MEDIA_ROOT, analysis.original_file.name)
+    result, cam = detector.predict_with_saliency(image_path)
+    if cam is None or not save_overlay(name, image_path, cam):
+        return None
+    return name
+
+def existing_heatmap(analysis):
+    """Return the storage name of an analysis' heatmap if it has been generated, without running the model"""
+    if heatmap_mode() == 'off' or not analysis.file_hash_sha256:
+        return None
+    name = heatmap_name(analysis.file_hash_sha256)
+    return name if os.path.exists(heatmap_file(name)) else None
+
+def heatmap_pending(analysis):
+    """Whether an analysis' report would show a heatmap that has not been generated yet"""
+    if heatmap_mode() == 'off' or not analysis.file_hash_sha256:
+        return False
+    return existing_heatmap(analysis) is None and saliency_available()
+
+def predict_for_analysis(analysis, image_path):
+    """Predict for a saved forensic analysis and set its heatmap_path for the heatmap mode"""
+    mode = heatmap_mode()
+    if mode == 'eager':
+        result, analysis.heatmap_path = predict_with_heatmap(image_path, analysis.file_hash_sha256)
+        return result
+
+    result = prediction_cache.predict(image_path, analysis.file_hash_sha256)
+    analysis.heatmap_path = deferred_heatmap_path(analysis)
+    return result
+
+def deferred_heatmap_path(analysis):
+    """Heatmap URL of an analysis whose overlay is not rendered with its prediction"""
+    if heatmap_mode() == 'off' or not saliency_available():
+        return ''
+    # Rendered by the heatmap view the first time the report shows it
+    return reverse('analysis_heatmap', args=[analysis.id])
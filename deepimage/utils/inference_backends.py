@@ -0,0 +1,121 @@
+import copy
+import glob
+import io
+import logging
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from .preprocessing import preprocessor
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('eager', 'torchscript', 'channels_last', 'dynamic_int8', 'static_int8')
+# Backends that only run on CPU
+CPU_ONLY_BACKENDS = ('dynamic_int8', 'static_int8')
+
+class ChannelsLast(nn.Module):
+    """Run a model whose weights are in channels_last format on NHWC-strided inputs"""
+
+    def __init__(self, model):
+        super(ChannelsLast, self).__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+class Softmax(nn.Module):
+    """Append the softmax of the eager ResNet wrapper to a bare classifier"""
+
+    def __init__(self, model):
+        super(Softmax, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return torch.softmax(self.model(x), dim=1)
+
+def calibration_batches(directory=None, count=16, batch_size=8):
+    """Yield normalized (N, 3, H, W) batches from a folder, or synthetic images when none is given"""
+    arrays = []
+    if directory:
+        paths = sorted(
+            path for path in glob.glob(os.path.join(directory, '**', '*'), recursive=True)
+            if path.rsplit('.', 1)[-1].lower() in ('jpg', 'jpeg', 'png', 'webp', 'bmp')
+        )
+        for path in paths[:count]:
+            try:
+                arrays.append(preprocessor.load(path))
+            except Exception as e:
+                logger.warning(f"Skipping calibration image {path}: {str(e)}")
+    if not arrays:
+        from .benchmarking import synthetic_image
+        sizes = [(320, 240), (640, 480), (800, 800), (1280, 720)]
+        for index in range(count):
+            width, height = sizes[index % len(sizes)]
+            fmt = 'JPEG' if index % 2 else 'PNG'
+            arrays.append(preprocessor.load(io.BytesIO(synthetic_image(width, height, fmt=fmt, seed=index))))
+
+    for start in range(0, len(arrays), batch_size):
+        chunk = arrays[start:start + batch_size]
+        yield torch.from_numpy(preprocessor.normalize(chunk, out=np.empty((len(chunk), 3) + preprocessor.size[::-1], dtype=np.float32)))
+
+def build_backend(mode, model, calibration_dir=None):
+    """Return a module running ``model`` (the eager ResNet wrapper) with the given backend"""
+    if mode not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{mode}'. Choose from: {', '.join(BACKENDS)}")
+    if mode == 'eager':
+        return model
+
+    if mode == 'channels_last':
+        return ChannelsLast(copy.deepcopy(model)).eval()
+
+    if mode == 'torchscript':
+        example = next(calibration_batches(calibration_dir, count=2, batch_size=2))
+        example = example.to(next(model.parameters()).device)
+        with torch.no_grad():
+            traced = torch.jit.trace(copy.deepcopy(model).eval(), example)
+            frozen = torch.jit.freeze(traced)
+            return torch.jit.optimize_for_inference(frozen)
+
+    if mode == 'dynamic_int8':
+        # Only nn.Linear (the classifier head) supports dynamic quantization;
+        # the convolutions stay in fp32
+        return torch.ao.quantization.quantize_dynamic(
+            copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8
+        )
+
+    # static_int8: post-training static quantization of the whole ResNet-50
+    from torchvision.models.quantization import resnet50 as quantizable_resnet50
+    engine = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'fbgemm'
+    torch.backends.quantized.engine = engine
+
+    resnet = model.model
+    quantizable = quantizable_resnet50(weights=None, quantize=False, num_classes=resnet.fc.out_features)
+    quantizable.load_state_dict(resnet.state_dict())
+    quantizable.eval()
+    quantizable.fuse_model()
+    quantizable.qconfig = torch.ao.quantization.get_default_qconfig(engine)
+    torch.ao.quantization.prepare(quantizable, inplace=True)
+    with torch.no_grad():
+        for batch in calibration_batches(calibration_dir, count=32):
+            quantizable(batch)
+    torch.ao.quantization.convert(quantizable, inplace=True)
+    return Softmax(quantizable).eval()
+
+def check_agreement(reference, candidate, batches, device='cpu'):
+    """Compare a backend with the eager model on the same inputs"""
+    matches, total, max_diff = 0, 0, 0.0
+    with torch.no_grad():
+        for batch in batches:
+            expected = reference(batch.to(device)).cpu()
+            actual = candidate(batch.to(device)).cpu()
+            matches += int((expected.argmax(1) == actual.argmax(1)).sum())
+            total += len(batch)
+            max_diff = max(max_diff, float((expected - actual).abs().max()))
+    return {
+        'images': total,
+        'agreement': round(matches / total, 4) if total else None,
+        'max_probability_diff': round(max_diff, 6),
+    }
@@ -0,0 +1,71 @@
+import hashlib
+import io
+import logging
+
+import exifread
+from PIL import Image as PILImage
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# EXIF (JPEG APP1 is capped at 64 KB) and the image dimensions live near the
+# start of the file, so this much of the stream is kept for metadata parsing
+HEADER_BYTES = 256 * 1024
+CHUNK_SIZE = 64 * 1024
+
+class IngestResult:
+    """Everything the forensic record needs from a single pass over an upload"""
+
+    def __init__(self, source, sha256, md5, size, header):
+        self.source = source
+        self.sha256 = sha256
+        self.md5 = md5
+        self.size = size
+        self.header = header
+        # True when the header holds the whole file
+        self.complete = size <= len(header)
+
+    def _full_file(self):
+        logger.info("Metadata not contained in header bytes, reading full file")
+        self.source.open('rb')
+        self.source.seek(0)
+        return self.source
+
+    def image_info(self):
+        """Return (format, width, height) parsed from the header without decoding pixels"""
+        try:
+            with PILImage.open(io.BytesIO(self.header)) as img:
+                return img.format, img.width, img.height
+        except Exception:
+            if self.complete:
+                raise
+        with PILImage.open(self._full_file()) as img:
+            return img.format, img.width, img.height
+
+    def exif_tags(self):
+        """Parse EXIF tags from the captured header, re-reading the file only if that fails"""
+        with metrics.timed('exif'):
+            try:
+                return exifread.process_file(io.BytesIO(self.header))
+            except Exception:
+                if self.complete:
+                    raise
+            return exifread.process_file(self._full_file())
+
+def ingest_file(source, header_bytes=HEADER_BYTES, chunk_size=CHUNK_SIZE):
+    """Stream a Django file once, hashing it and keeping its leading bytes"""
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    header = bytearray()
+    size = 0
+
+    with metrics.timed('hash'):
+        for chunk in source.chunks(chunk_size):
+            sha256.update(chunk)
+            md5.update(chunk)
+            if len(header) < header_bytes:
+                header += chunk[:header_bytes - len(header)]
+            size += len(chunk)
+
+    return IngestResult(source, sha256.hexdigest(), md5.hexdigest(), size, bytes(header))
@@ -0,0 +1,130 @@
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Jobs queued before this moment belong to an earlier process
+PROCESS_STARTED = timezone.now()
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the pending queue is at capacity"""
+
+class JobQueue:
+    """Bounded in-process job queue served by a pool of worker threads.
+
+    ``submit`` never blocks: once ``max_pending`` jobs are waiting it raises
+    QueueFull so callers can shed load (e.g. answer 503) instead of letting
+    latency grow without bound. Workers start lazily on the first submit.
+    """
+
+    def __init__(self, name, workers=2, max_pending=32):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._running = 0
+        self._wait_seconds = 0.0
+        self._counters = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+
+    def submit(self, func, *args, **kwargs):
+        """Queue ``func(*args, **kwargs)`` for a worker, raising QueueFull when saturated"""
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((func, args, kwargs, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise QueueFull(f"{self.name} queue is full ({self.max_pending} pending jobs)")
+        with self._lock:
+            self._counters['submitted'] += 1
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work, name=f"deepimage-{self.name}-{len(self._threads)}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            func, args, kwargs, queued_at = self._queue.get()
+            with self._lock:
+                self._running += 1
+                self._wait_seconds += time.perf_counter() - queued_at
+            close_old_connections()
+            outcome = 'failed'
+            try:
+                func(*args, **kwargs)
+                outcome = 'completed'
+            except Exception as e:
+                logger.exception(f"{self.name} job failed: {str(e)}")
+            finally:
+                close_old_connections()
+                with self._lock:
+                    self._running -= 1
+                    self._counters[outcome] += 1
+                self._queue.task_done()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            started = self._counters['completed'] + self._counters['failed'] + self._running
+            return {
+                'name': self.name,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._queue.qsize(),
+                'running': self._running,
+                'mean_queue_wait_ms': round(self._wait_seconds * 1000 / started, 3) if started else 0.0,
+                **self._counters,
+            }
+
+analysis_queue = JobQueue(
+    'analysis',
+    workers=getattr(settings, 'DEEPIMAGE_ANALYSIS_WORKERS', 2),
+    max_pending=getattr(settings, 'DEEPIMAGE_ANALYSIS_QUEUE_SIZE', 32),
+)
+
+_recovered = False
+_recover_lock = threading.Lock()
+
+def fail_interrupted_analyses(**kwargs):
+    """Mark analyses an earlier process left queued or running as failed.
+
+    Queued jobs only live in memory, so after a restart or crash nothing
+    would ever run them. Connected to request_started, it runs once per
+    process and only touches rows created before the process started; a job
+    that another live process is still running overwrites the failure when
+    it completes.
+    """
+    global _recovered
+    if _recovered:
+        return
+    with _recover_lock:
+        if _recovered:
+            return
+        _recovered = True
+    from ..models import ForensicAnalysis
+    try:
+        failed = ForensicAnalysis.objects.filter(
+            status__in=('queued', 'running'), analysis_date__lt=PROCESS_STARTED
+        ).update(status='failed', raw_prediction_data={'error': 'Interrupted by a server restart, please resubmit'})
+    except Exception as e:
+        logger.error(f"Could not recover interrupted analyses: {str(e)}")
+        return
+    if failed:
+        logger.warning(f"Marked {failed} analyses interrupted by a restart as failed")
@@ -0,0 +1,185 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+# Upper bounds in seconds; the +Inf bucket is implicit
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def enabled():
+    return getattr(settings, 'DEEPIMAGE_METRICS', True)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Timer:
+    """Context manager observing the seconds spent in its block"""
+
+    __slots__ = ('histogram', 'value', 'started')
+
+    def __init__(self, histogram, value):
+        self.histogram = histogram
+        self.value = value
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(self.value, time.perf_counter() - self.started)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_null_timer = _NullTimer()
+
+class Histogram:
+    """Latency histogram with one label, kept as per-bucket counts.
+
+    An observation is a bisect and two additions under a lock; cumulative
+    bucket counts are only computed when the metrics are scraped.
+    """
+
+    def __init__(self, name, documentation, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def time(self, value):
+        return _Timer(self, value)
+
+    def render(self):
+        with self._lock:
+            series = {value: (list(counts), total) for value, (counts, total) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for value, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _labels((self.label, 'le'), (value, _number(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels((self.label,), (value,))
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Counter:
+    """Monotonic counter with one label"""
+
+    def __init__(self, name, documentation, label):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value, amount=1):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for value, count in sorted(values.items()):
+            lines.append(f"{self.name}{_labels((self.label,), (value,))} {count}")
+        return lines
+
+step_seconds = Histogram(
+    'deepimage_step_duration_seconds',
+    "Time spent in each processing step (decode, transform, forward, hash, exif, db_write, pdf_render)", 'step',
+)
+request_seconds = Histogram('deepimage_request_duration_seconds', "Time spent handling requests per view", 'view')
+errors = Counter('deepimage_errors_total', "Errors per processing step", 'step')
+
+def timed(step):
+    """Context manager adding the duration of its block to the step's histogram"""
+    if not enabled():
+        return _null_timer
+    return step_seconds.time(step)
+
+def error(step):
+    if enabled():
+        errors.inc(step)
+
+def _family(name, kind, documentation, samples):
+    """Exposition lines of a metric family computed at scrape time from (labels, value) samples"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+    return lines
+
+def _state_lines():
+    """Queue depths and cache counters read from the components' own statistics"""
+    from .async_inference import inference_executor
+    from .export_utils import report_queue
+    from .job_queue import analysis_queue
+    from .persistence import result_writer
+    from .prediction_cache import prediction_cache
+    from .registry import detector
+
+    queues = [
+        (analysis_queue.name, analysis_queue.depth), (report_queue.name, report_queue.depth),
+        ('inference_executor', inference_executor.depth),
+    ]
+    # Only started engines have a batcher; don't load the model for a scrape
+    if detector.loaded and detector.batcher is not None:
+        queues.append(('inference_batcher', detector.batcher.depth))
+    if result_writer is not None:
+        queues.append(('result_writer', result_writer.batcher.depth))
+
+    jobs = []
+    for job_queue in (analysis_queue, report_queue):
+        stats = job_queue.stats()
+        jobs += [({'queue': job_queue.name, 'outcome': outcome}, stats[outcome])
+                 for outcome in ('completed', 'failed', 'rejected')]
+
+    cache = prediction_cache.stats()
+    return (
+        _family('deepimage_queue_depth', 'gauge', "Jobs waiting (or, for the inference executor, in flight) in each in-process queue",
+                [({'queue': name}, depth) for name, depth in queues])
+        + _family('deepimage_jobs_total', 'counter', "Background jobs by queue and outcome", jobs)
+        + _family('deepimage_prediction_cache_lookups_total', 'counter', "Prediction cache lookups by result", [
+            ({'result': 'memory_hit'}, cache['memory_hits']),
+            ({'result': 'db_hit'}, cache['db_hits']),
+            ({'result': 'miss'}, cache['misses']),
+        ])
+    )
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4).
+
+    Each process keeps its own metrics, so with several server processes
+    every one of them must be scraped.
+    """
+    lines = step_seconds.render() + request_seconds.render() + errors.render() + _state_lines()
+    return '\n'.join(lines) + '\n'
@@ -2,11 +2,15 @@ import torch
 import torch.nn as nn
 from torchvision.models import resnet50
 from torchvision import transforms
-from PIL import Image
 import numpy as np
 import os
+import hashlib
 from django.conf import settings
 import logging
+from .engine import BaseDetector
+from .registry import detector, get_model_path
+from .preprocessing import preprocessor
+from . import inference_backends, metrics
 
 logger = logging.getLogger(__name__)
 
@@ -18,18 +22,111 @@ class ResNet(nn.Module):
     def forward(self, x):
         return torch.softmax(self.model(x), dim=1)
 
-class DeepFakeDetector:
+def load_checkpoint(model_path, device='cpu'):
+    """Build the two-class ResNet-50 from a saved checkpoint, ready for inference"""
+    checkpoint = torch.load(model_path, map_location=device)
+
+    # Initialize model architecture
+    resnet = resnet50(weights=None)
+    num_ftrs = resnet.fc.in_features
+    resnet.fc = nn.Linear(num_ftrs, 2)
+
+    # Handle different save formats
+    if 'model_state_dict' in checkpoint:
+        resnet.load_state_dict(checkpoint['model_state_dict'])
+    else:
+        # Assume it's a direct state dict
+        resnet.load_state_dict(checkpoint)
+
+    model = ResNet(resnet)
+    model.eval()
+    return model.to(device)
+
+def checkpoint_version(model_path):
+    """Identify a checkpoint by a digest of its contents"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"resnet50-{digest.hexdigest()[:16]}"
+
+def dummy_model():
+    """Two-class ResNet-50 with a random head, on ImageNet weights if DEEPIMAGE_DUMMY_PRETRAINED allows"""
+    resnet = None
+    if getattr(settings, 'DEEPIMAGE_DUMMY_PRETRAINED', False):
+        try:
+            resnet = resnet50(weights='IMAGENET1K_V2')
+        except Exception as e:
+            logger.warning(f"Could not fetch ImageNet weights, using random initialisation: {str(e)}")
+    if resnet is None:
+        resnet = resnet50(weights=None)
+    num_ftrs = resnet.fc.in_features
+    resnet.fc = nn.Linear(num_ftrs, 2)
+    model = ResNet(resnet)
+    model.eval()
+    return model
+
+class DeepFakeDetector(BaseDetector):
+    engine = 'torch'
+
     def __init__(self):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.transform = self.get_transform()
-        self.index_label = {0: "real", 1: "deepfake"}
         self.model = None
+        self.model_version = None
+        self.runner = None
+        self.backend = 'eager'
+        self.backend_check = None
+        self.batcher = None
+        self.configure_threads()
         self.load_model()
+        self.configure_backend()
+        self.configure_batching()
+
+    def configure_threads(self):
+        """Apply the configured intra-op thread count for CPU inference"""
+        threads = getattr(settings, 'DEEPIMAGE_TORCH_THREADS', None)
+        if threads:
+            torch.set_num_threads(int(threads))
+
+    def configure_backend(self):
+        """Build the configured inference backend, falling back to eager if it fails or disagrees"""
+        self.runner = self.model
+        self.backend = 'eager'
+        mode = getattr(settings, 'DEEPIMAGE_INFERENCE_BACKEND', 'eager')
+        if self.model is None or mode == 'eager':
+            return
+        if self.device != 'cpu' and mode in inference_backends.CPU_ONLY_BACKENDS:
+            logger.warning(f"Inference backend '{mode}' is CPU only; using eager on {self.device}")
+            return
+
+        calibration_dir = getattr(settings, 'DEEPIMAGE_CALIBRATION_DIR', None)
+        try:
+            runner = inference_backends.build_backend(mode, self.model, calibration_dir)
+        except Exception as e:
+            logger.error(f"Could not build inference backend '{mode}', using eager: {str(e)}")
+            return
+
+        if getattr(settings, 'DEEPIMAGE_VERIFY_BACKEND', True):
+            self.backend_check = inference_backends.check_agreement(
+                self.model, runner, inference_backends.calibration_batches(calibration_dir), self.device
+            )
+            min_agreement = getattr(settings, 'DEEPIMAGE_BACKEND_MIN_AGREEMENT', 0.95)
+            logger.info(f"Inference backend '{mode}' vs eager: {self.backend_check}")
+            if self.backend_check['agreement'] < min_agreement:
+                logger.error(f"Inference backend '{mode}' agrees with eager on only "
+                             f"{self.backend_check['agreement']:.0%} of images, using eager")
+                return
+
+        self.runner = runner
+        self.backend = mode
+        # Quantized and fused backends produce slightly different scores
+        self.model_version = f"{self.model_version}+{mode}"
         
     def load_model(self):
         """Load the pre-trained model"""
         try:
-            model_path = os.path.join(settings.BASE_DIR, 'deepimage', 'utils', 'best_model.pth')
+            model_path = get_model_path()
             
             if not os.path.exists(model_path):
                 logger.warning("Model file not found. Using dummy model for testing.")
@@ -38,25 +135,9 @@ class DeepFakeDetector:
             
             logger.info(f"Loading model from: {model_path}")
             
-            # Load the checkpoint
-            checkpoint = torch.load(model_path, map_location=self.device)
-            
-            # Initialize model architecture
-            resnet = resnet50(weights=None)
-            num_ftrs = resnet.fc.in_features
-            resnet.fc = nn.Linear(num_ftrs, 2)
-            
-            # Handle different save formats
-            if 'model_state_dict' in checkpoint:
-                resnet.load_state_dict(checkpoint['model_state_dict'])
-            else:
-                # Assume it's a direct state dict
-                resnet.load_state_dict(checkpoint)
-            
-            model = ResNet(resnet)
-            model.eval()
-            self.model = model.to(self.device)
-            logger.info("Model loaded successfully")
+            self.model = load_checkpoint(model_path, self.device)
+            self.model_version = checkpoint_version(model_path)
+            logger.info(f"Model loaded successfully (version {self.model_version})")
             
         except Exception as e:
             logger.error(f"Error loading model: {str(e)}")
@@ -65,61 +146,95 @@ class DeepFakeDetector:
     def create_dummy_model(self):
         """Create a dummy model for testing"""
         logger.info("Creating dummy model for testing")
-        resnet = resnet50(weights='IMAGENET1K_V2')
-        num_ftrs = resnet.fc.in_features
-        resnet.fc = nn.Linear(num_ftrs, 2)
-        self.model = ResNet(resnet)
-        self.model.eval()
-        self.model = self.model.to(self.device)
+        self.model = dummy_model().to(self.device)
+        # The classification head is randomly initialised, so results are only
+        # stable for the lifetime of this instance
+        self.model_version = f"dummy-{os.getpid()}-{id(self):x}"
+
+    @property
+    def is_dummy(self):
+        return bool(self.model_version) and self.model_version.startswith('dummy-')
     
     def get_transform(self):
-        """Define image transformations"""
+        """Define image transformations for PIL images (resize before tensor conversion)"""
         return transforms.Compose([
-            transforms.ToPILImage(),
-            transforms.ToTensor(),
             transforms.Resize((224, 224)),
+            transforms.ToTensor(),
             transforms.Normalize(mean=[0.485, 0.456, 0.406], 
                                std=[0.229, 0.224, 0.225])
         ])
     
-    def predict(self, image_path):
-        """Make prediction on a single image"""
+    def allocate_batch(self, batch_size):
+        """Batch buffers are page-locked on CUDA so host to device copies can run asynchronously"""
+        if self.device != 'cuda':
+            return super().allocate_batch(batch_size)
+        return torch.empty((batch_size, 3) + preprocessor.size[::-1], dtype=torch.float32).pin_memory().numpy()
+
+    def forward_normalized(self, batch):
+        """Run one forward pass over a normalized NumPy batch"""
+        return self.forward(torch.from_numpy(batch)).numpy()
+
+    def forward(self, batch):
+        """Run one forward pass over an (N, C, H, W) batch and return CPU probabilities"""
+        with metrics.timed('forward'):
+            batch = batch.to(self.device, non_blocking=True)
+            with torch.no_grad():
+                output = self.runner(batch)
+            return output.cpu()
+
+    def feature_maps(self, batch):
+        """Run the eager backbone and return the (N, 2048, 7, 7) output of the last conv block"""
+        resnet = self.model.model
+        x = resnet.maxpool(resnet.relu(resnet.bn1(resnet.conv1(batch))))
+        return resnet.layer4(resnet.layer3(resnet.layer2(resnet.layer1(x))))
+
+    @property
+    def has_features(self):
+        return self.model is not None
+
+    def forward_with_features(self, arrays):
+        """Run the eager model once and return probabilities with the pooled penultimate features"""
+        resnet = self.model.model
+        batch = torch.from_numpy(preprocessor.normalize(arrays)).to(self.device)
+        with metrics.timed('forward'), torch.no_grad():
+            features = torch.flatten(resnet.avgpool(self.feature_maps(batch)), 1)
+            probabilities = torch.softmax(resnet.fc(features), dim=1)
+        return probabilities.cpu().numpy(), features.cpu().numpy()
+
+    def forward_with_saliency(self, arrays):
+        """Run the eager model once and return probabilities with Grad-CAM maps of the last conv block.
+
+        The maps explain each image's predicted class and are (N, 7, 7) arrays
+        at layer4 resolution. Because the head is global average pooling
+        followed by one linear layer, the Grad-CAM channel weights (the
+        spatially averaged gradients of the class score) are the fc weights
+        of that class divided by H*W, so no backward pass is needed.
+        """
+        resnet = self.model.model
+        batch = torch.from_numpy(preprocessor.normalize(arrays)).to(self.device)
+        with metrics.timed('forward'), torch.no_grad():
+            features = self.feature_maps(batch)
+            logits = resnet.fc(torch.flatten(resnet.avgpool(features), 1))
+            probabilities = torch.softmax(logits, dim=1)
+            weights = resnet.fc.weight[logits.argmax(1)] / (features.shape[2] * features.shape[3])
+            cams = torch.relu(torch.einsum('nc,nchw->nhw', weights, features))
+        return probabilities.cpu().numpy(), cams.cpu().numpy()
+
+    def predict_with_saliency(self, image_path):
+        """Make a prediction and its saliency map from a single eager forward pass"""
         if self.model is None:
-            return {'error': 'Model not loaded'}
-        
+            return {'error': 'Model not loaded'}, None
         try:
-            # Load and preprocess image
-            img = Image.open(image_path).convert("RGB")
-            img = np.array(img)
-            img = self.transform(img)
-            img = img.unsqueeze(0)  # Add batch dimension
-            
-            # Move to device
-            if torch.cuda.is_available():
-                img = img.cuda()
-            
-            # Predict
-            with torch.no_grad():
-                output = self.model(img)
-            
-            # Debug output
-            logger.info(f"Model output: {output.cpu().numpy()}")
-            
-            # Get results
-            pred_index = output.argmax(1).item()
-            confidence = round(output[0][pred_index].item() * 100, 2)
-            label = self.index_label[pred_index]
-            
-            return {
-                'label': label,
-                'confidence': confidence,
-                'is_deepfake': pred_index == 1,
-                'raw_output': output.cpu().numpy().tolist()  # For debugging
-            }
-            
+            probabilities, cams = self.forward_with_saliency([self.preprocess(image_path)])
+            return self.format_output(probabilities[0]), cams[0]
         except Exception as e:
             logger.error(f"Prediction error: {str(e)}")
-            return {'error': str(e)}
+            metrics.error('predict')
+            return {'error': str(e)}, None
 
-# Create detector instance
-detector = DeepFakeDetector()
\ No newline at end of file
+    def stats(self):
+        """Return inference engine statistics"""
+        stats = super().stats()
+        if self.backend_check is not None:
+            stats['backend_check'] = self.backend_check
+        return stats
@@ -0,0 +1,409 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import heatmaps
+from .prediction_cache import prediction_cache
+from .preprocessing import preprocessor
+from .registry import detector
+
+logger = logging.getLogger(__name__)
+
+# Bits per perceptual hash and per embedding code
+CODE_BITS = 64
+_BYTE_BITS = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+def enabled():
+    return getattr(settings, 'DEEPIMAGE_NEAR_DUPLICATES', True)
+
+def popcount(values):
+    """Set bits of each uint64 in an array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _BYTE_BITS[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+def to_signed(code):
+    """Store a 64-bit code in a signed BigIntegerField"""
+    return code - (1 << CODE_BITS) if code >= 1 << (CODE_BITS - 1) else code
+
+def _bits(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+def image_hashes(array):
+    """64-bit pHash and dHash of a (H, W, 3) uint8 image"""
+    gray = cv2.cvtColor(np.ascontiguousarray(array), cv2.COLOR_RGB2GRAY).astype(np.float32)
+    low = cv2.dct(cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA))[:8, :8]
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits(low > np.median(low)), _bits(small[:, 1:] > small[:, :-1])
+
+def normalize_embedding(features):
+    features = np.asarray(features, dtype=np.float32)
+    norm = np.linalg.norm(features)
+    return features / norm if norm else features
+
+_planes = {}
+
+def embedding_code(embedding):
+    """64-bit random-hyperplane hash of an embedding; its Hamming distances follow the angles between embeddings"""
+    size = embedding.shape[0]
+    if size not in _planes:
+        _planes[size] = np.random.default_rng(0).standard_normal((CODE_BITS, size)).astype(np.float32)
+    return _bits(_planes[size] @ embedding > 0)
+
+class Fingerprint:
+    """Hashes of an analysed image and, once the model has run, its embedding.
+
+    ``code`` is the embedding's hyperplane hash, computed when the
+    embedding is set.
+    """
+
+    def __init__(self, phash, dhash, embedding=None):
+        self.phash = phash
+        self.dhash = dhash
+        self.embedding = embedding
+
+    @property
+    def embedding(self):
+        return self._embedding
+
+    @embedding.setter
+    def embedding(self, embedding):
+        self._embedding = embedding
+        self.code = None if embedding is None else embedding_code(embedding)
+
+def fingerprint(image, content_hash=None):
+    """Hash an image for near-duplicate search, or return None if it cannot be read.
+
+    The embedding stored for earlier analyses of the same content, if any,
+    is attached so that it takes part in the search before the model runs.
+    """
+    if not enabled():
+        return None
+    try:
+        return Fingerprint(*image_hashes(preprocessor.load(image)), stored_embedding(content_hash))
+    except Exception as e:
+        logger.error(f"Fingerprint error: {str(e)}")
+        return None
+
+class NearDuplicateIndex:
+    """Fingerprint codes of past analyses in NumPy arrays, searched by vectorized Hamming distance.
+
+    The arrays take about 41 bytes per analysis, and a search XORs and
+    popcounts all of them at once, a few milliseconds per million analyses.
+    They are loaded from ImageFingerprint on first use and, at most every
+    ``refresh_seconds``, updated with rows written or rewritten since the
+    last refresh, including by other processes. Rows are kept sorted by
+    primary key so that a rewritten row replaces its old codes in place.
+    """
+
+    # Rows updated this long before the watermark are read again, so that a
+    # transaction committing after a later one is not missed
+    REFRESH_OVERLAP = timedelta(seconds=10)
+    ARRAYS = ('_pks', '_ids', '_phash', '_dhash', '_codes', '_has_code')
+
+    def __init__(self, refresh_seconds=5.0):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._size = 0
+        self._pks = np.empty(0, dtype=np.int64)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._phash = np.empty(0, dtype=np.uint64)
+        self._dhash = np.empty(0, dtype=np.uint64)
+        self._codes = np.empty(0, dtype=np.uint64)
+        self._has_code = np.empty(0, dtype=bool)
+        self._watermark = None
+        self._refreshed = None
+        self._invalidations = 0
+
+    def _upsert(self, rows):
+        """Replace the codes of known rows and add new ones; called with the index lock held"""
+        if not rows:
+            return
+        pks, analysis_ids, phashes, dhashes, codes, _ = zip(*rows)
+        pks = np.array(pks, dtype=np.int64)
+        values = {
+            '_ids': np.array(analysis_ids, dtype=np.int64),
+            # Signed database values reinterpreted as the original 64-bit codes
+            '_phash': np.array(phashes, dtype=np.int64).view(np.uint64),
+            '_dhash': np.array(dhashes, dtype=np.int64).view(np.uint64),
+            '_codes': np.array([code or 0 for code in codes], dtype=np.int64).view(np.uint64),
+            '_has_code': np.array([code is not None for code in codes], dtype=bool),
+        }
+
+        positions = np.searchsorted(self._pks[:self._size], pks)
+        known = positions < self._size
+        known[known] = self._pks[positions[known]] == pks[known]
+        for name, value in values.items():
+            getattr(self, name)[positions[known]] = value[known]
+
+        new = ~known
+        added = int(new.sum())
+        if not added:
+            return
+        size = self._size + added
+        if size > len(self._ids):
+            capacity = max(size, 2 * len(self._ids), 1024)
+            for name in self.ARRAYS:
+                grown = np.zeros(capacity, dtype=getattr(self, name).dtype)
+                grown[:self._size] = getattr(self, name)[:self._size]
+                setattr(self, name, grown)
+        tail = slice(self._size, size)
+        in_order = self._size == 0 or pks[new].min() > self._pks[self._size - 1]
+        self._pks[tail] = pks[new]
+        for name, value in values.items():
+            getattr(self, name)[tail] = value[new]
+        self._size = size
+        if not in_order or not np.all(np.diff(self._pks[tail]) > 0):
+            # Rows committed out of primary key order; rare, so a full re-sort is fine
+            order = np.argsort(self._pks[:size], kind='stable')
+            for name in self.ARRAYS:
+                getattr(self, name)[:size] = getattr(self, name)[:size][order]
+
+    def _refresh(self):
+        """Load rows written since the last refresh; the query runs without the index lock held"""
+        from ..models import ImageFingerprint
+        with self._lock:
+            if self._refreshed is not None and time.monotonic() - self._refreshed < self.refresh_seconds:
+                return
+            initial = self._watermark is None
+        # Only the first load must finish before searching; later a search
+        # uses the current arrays while another thread refreshes them
+        if not self._refresh_lock.acquire(blocking=initial):
+            return
+        try:
+            with self._lock:
+                watermark = self._watermark
+                invalidations = self._invalidations
+                if self._refreshed is not None and time.monotonic() - self._refreshed < self.refresh_seconds:
+                    return
+            rows = ImageFingerprint.objects.order_by('updated_at', 'pk')
+            if watermark is not None:
+                rows = rows.filter(updated_at__gte=watermark - self.REFRESH_OVERLAP)
+            rows = rows.values_list('pk', 'analysis_id', 'phash', 'dhash', 'embedding_code', 'updated_at')
+            batch = []
+            for row in rows.iterator(chunk_size=10000):
+                batch.append(row)
+                if len(batch) >= 10000:
+                    with self._lock:
+                        self._upsert(batch)
+                    watermark = batch[-1][-1]
+                    batch = []
+            with self._lock:
+                self._upsert(batch)
+                if batch:
+                    watermark = batch[-1][-1]
+                self._watermark = watermark or timezone.now()
+                # Rows recorded while the query ran may have been missed
+                if invalidations == self._invalidations:
+                    self._refreshed = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def invalidate(self):
+        """Pick up new fingerprints on the next search"""
+        with self._lock:
+            self._refreshed = None
+            self._invalidations += 1
+
+    def search(self, fingerprint, max_distance, max_code_distance, limit=10, exclude=None):
+        """Closest analyses within either hash distance or the embedding code distance, best first.
+
+        Returns (analysis ID, pHash distance, dHash distance, code distance)
+        tuples; the code distance is None for a fingerprint without embedding.
+        """
+        code = fingerprint.code
+        self._refresh()
+        with self._lock:
+            size = self._size
+            phash_distance = popcount(self._phash[:size] ^ np.uint64(fingerprint.phash)).astype(np.int16)
+            dhash_distance = popcount(self._dhash[:size] ^ np.uint64(fingerprint.dhash)).astype(np.int16)
+            hits = (phash_distance <= max_distance) | (dhash_distance <= max_distance)
+            score = phash_distance + dhash_distance
+            if code is not None:
+                code_distance = popcount(self._codes[:size] ^ np.uint64(code)).astype(np.int16)
+                code_distance[~self._has_code[:size]] = CODE_BITS
+                hits |= code_distance <= max_code_distance
+                score = np.minimum(score, 2 * code_distance)
+            if exclude is not None:
+                hits &= self._ids[:size] != exclude
+            found = np.flatnonzero(hits)
+            found = found[np.argsort(score[found], kind='stable')][:limit]
+            return [
+                (int(self._ids[i]), int(phash_distance[i]), int(dhash_distance[i]),
+                 int(code_distance[i]) if code is not None else None)
+                for i in found
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {'fingerprints': self._size, 'memory_bytes': int(
+                sum(getattr(self, name).nbytes for name in self.ARRAYS)
+            )}
+
+index = NearDuplicateIndex(refresh_seconds=getattr(settings, 'DEEPIMAGE_NEAR_DUPLICATE_REFRESH_SECONDS', 5.0))
+
+def find_matches(analysis, fingerprint):
+    """Earlier analyses of the same or a near-identical image, closest first.
+
+    Candidates from the index are confirmed by both perceptual hashes or,
+    when both images have embeddings, by their cosine similarity. Search
+    errors are logged and yield no matches.
+    """
+    if fingerprint is None:
+        return []
+    try:
+        return _find_matches(analysis, fingerprint)
+    except Exception as e:
+        logger.error(f"Near-duplicate search error: {str(e)}")
+        return []
+
+def _find_matches(analysis, fingerprint):
+    from ..models import ImageFingerprint
+    max_distance = getattr(settings, 'DEEPIMAGE_NEAR_DUPLICATE_MAX_DISTANCE', 10)
+    min_similarity = getattr(settings, 'DEEPIMAGE_NEAR_DUPLICATE_SIMILARITY', 0.95)
+    candidates = index.search(
+        fingerprint, max_distance, getattr(settings, 'DEEPIMAGE_NEAR_DUPLICATE_CODE_DISTANCE', 12),
+        limit=getattr(settings, 'DEEPIMAGE_NEAR_DUPLICATE_MAX_MATCHES', 10), exclude=analysis.id,
+    )
+    if not candidates:
+        return []
+    rows = {
+        row.analysis_id: row
+        for row in ImageFingerprint.objects.filter(analysis_id__in=[c[0] for c in candidates]).select_related('analysis')
+    }
+
+    matches = []
+    for analysis_id, phash_distance, dhash_distance, _ in candidates:
+        row = rows.get(analysis_id)
+        if row is None:
+            continue
+        similarity = None
+        if fingerprint.embedding is not None and row.embedding:
+            stored = np.frombuffer(bytes(row.embedding), dtype=np.float16).astype(np.float32)
+            similarity = round(float(stored @ fingerprint.embedding), 4)
+        exact = bool(analysis.file_hash_sha256) and row.content_hash == analysis.file_hash_sha256
+        if not (exact or (phash_distance <= max_distance and dhash_distance <= max_distance)
+                or (similarity is not None and similarity >= min_similarity)):
+            continue
+        previous = row.analysis
+        matches.append({
+            'analysis_id': analysis_id,
+            'report_id': previous.report_id,
+            'match': 'exact' if exact else 'near',
+            'phash_distance': phash_distance,
+            'dhash_distance': dhash_distance,
+            'embedding_similarity': similarity,
+            'classification': previous.classification,
+            'authenticity_score': round(previous.authenticity_score, 2),
+            'confidence_level': previous.confidence_level,
+            'status': previous.status,
+            'model_version': row.model_version,
+            'analysis_date': previous.analysis_date.isoformat() if previous.analysis_date else None,
+        })
+    return matches
+
+def reused_verdict(matches):
+    """The prediction of a confident earlier analysis of a near-identical image, if there is one.
+
+    ``matches`` come from find_matches before the model runs. Only hash
+    distances are compared; the earlier analysis must be done, highly
+    confident and made by the serving model.
+    """
+    from ..models import ForensicAnalysis
+    distance = getattr(settings, 'DEEPIMAGE_NEAR_DUPLICATE_REUSE_DISTANCE', 4)
+    if not matches or distance < 0:
+        return None
+    model_version = detector.model_version or 'unknown'
+    for match in matches:
+        if (match['status'] != 'done' or match['confidence_level'] != 'high'
+                or match['model_version'] != model_version
+                or max(match['phash_distance'], match['dhash_distance']) > distance):
+            continue
+        result = (ForensicAnalysis.objects.filter(id=match['analysis_id'])
+                  .values_list('raw_prediction_data', flat=True).first())
+        if result and 'label' in result and 'error' not in result:
+            logger.info(f"Reusing the verdict of near-duplicate {match['report_id']}")
+            return {**result, 'near_duplicate_of': match['report_id']}
+    return None
+
+def stored_embedding(content_hash):
+    """Embedding recorded for earlier analyses of the same content"""
+    from ..models import ImageFingerprint
+    if not content_hash:
+        return None
+    stored = (ImageFingerprint.objects.filter(content_hash=content_hash).exclude(embedding=None)
+              .values_list('embedding', flat=True).first())
+    return None if stored is None else np.frombuffer(bytes(stored), dtype=np.float16).astype(np.float32)
+
+def predict(analysis, image, embedding=None):
+    """Predict for an analysis and return the result with the image's embedding.
+
+    ``embedding`` is the one stored for the content, if any, and is returned
+    as is. Otherwise the embedding comes from the same eager forward pass as
+    the prediction. It is None when the engine exposes no features, or when
+    the prediction comes from elsewhere (a faster backend, the cache, eager
+    heatmaps).
+    """
+    if (embedding is not None or not enabled() or not detector.has_features or detector.backend != 'eager'
+            or heatmaps.heatmap_mode() == 'eager'):
+        return heatmaps.predict_for_analysis(analysis, image), embedding
+
+    analysis.heatmap_path = heatmaps.deferred_heatmap_path(analysis)
+    model_version = detector.model_version or 'unknown'
+    cached = prediction_cache.get(analysis.file_hash_sha256, model_version)
+    if cached is not None:
+        cached['cached'] = True
+        return cached, None
+    result, features = detector.predict_with_features(image)
+    if 'error' in result:
+        return result, None
+    prediction_cache.set(analysis.file_hash_sha256, model_version, result)
+    return result, normalize_embedding(features)
+
+def fingerprint_fields(analysis, fingerprint):
+    """ImageFingerprint field values for an analysis' fingerprint"""
+    embedding = fingerprint.embedding
+    return {
+        'content_hash': analysis.file_hash_sha256,
+        'model_version': detector.model_version or 'unknown',
+        'phash': to_signed(fingerprint.phash),
+        'dhash': to_signed(fingerprint.dhash),
+        'embedding_code': None if embedding is None else to_signed(fingerprint.code),
+        'embedding': None if embedding is None else embedding.astype(np.float16).tobytes(),
+    }
+
+def record(analysis, fingerprint):
+    """Store an analysis' fingerprint and make it searchable"""
+    from ..models import ImageFingerprint
+    ImageFingerprint.objects.update_or_create(analysis=analysis, defaults=fingerprint_fields(analysis, fingerprint))
+    index.invalidate()
+
+def add_embedding(analysis, fingerprint, embedding, matches):
+    """Attach the embedding from an analysis' forward pass and return its matches.
+
+    The search before the model only has an embedding when the same content
+    was analysed before, so re-encoded, resized or cropped copies of new
+    content are found by embedding similarity in a second search once the
+    model has produced one. ``matches`` are returned as they are otherwise.
+    """
+    if fingerprint is None or embedding is None or fingerprint.embedding is not None:
+        return matches
+    fingerprint.embedding = embedding
+    return find_matches(analysis, fingerprint)
+
+def correlate(analysis, fingerprint, matches):
+    """Index an analysed image and return its matches for cross_correlation"""
+    if fingerprint is None:
+        return []
+    try:
+        record(analysis, fingerprint)
+    except Exception as e:
+        logger.error(f"Near-duplicate index error: {str(e)}")
+    return matches
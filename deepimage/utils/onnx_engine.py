@@ -0,0 +1,93 @@
+import logging
+import os
+
+from django.conf import settings
+
+from . import metrics
+from .engine import BaseDetector
+
+logger = logging.getLogger(__name__)
+
+def get_onnx_path():
+    """Path of the exported ONNX detector"""
+    return getattr(
+        settings, 'DEEPIMAGE_ONNX_PATH',
+        os.path.join(settings.BASE_DIR, 'deepimage', 'utils', 'best_model.onnx')
+    )
+
+def session_options(intra_op_threads=None, inter_op_threads=None):
+    """onnxruntime session options with full graph optimization and the given thread counts"""
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if intra_op_threads:
+        options.intra_op_num_threads = int(intra_op_threads)
+    if inter_op_threads:
+        options.inter_op_num_threads = int(inter_op_threads)
+    return options
+
+def create_session(path, intra_op_threads=None, inter_op_threads=None):
+    """Open an onnxruntime CPU inference session for an exported detector"""
+    import onnxruntime as ort
+    return ort.InferenceSession(
+        path, sess_options=session_options(intra_op_threads, inter_op_threads),
+        providers=['CPUExecutionProvider'],
+    )
+
+class OnnxDetector(BaseDetector):
+    """Detector served by onnxruntime on CPU, without importing torch"""
+
+    engine = 'onnx'
+    backend = 'onnxruntime'
+
+    def __init__(self):
+        self.device = 'cpu'
+        self.model = None
+        self.model_version = None
+        self.input_name = None
+        self.batcher = None
+        self.load_model()
+        self.configure_batching()
+
+    def load_model(self):
+        """Open the exported model; predictions report 'Model not loaded' if it is missing"""
+        model_path = get_onnx_path()
+        if not os.path.exists(model_path):
+            logger.error(f"ONNX model not found at {model_path}. Run 'manage.py export_onnx' first.")
+            return
+
+        try:
+            logger.info(f"Loading ONNX model from: {model_path}")
+            session = create_session(
+                model_path,
+                getattr(settings, 'DEEPIMAGE_ONNX_INTRA_OP_THREADS', None),
+                getattr(settings, 'DEEPIMAGE_ONNX_INTER_OP_THREADS', None),
+            )
+        except Exception as e:
+            logger.error(f"Error loading ONNX model: {str(e)}")
+            return
+
+        self.model = session
+        self.input_name = session.get_inputs()[0].name
+        # The export records the checkpoint version so cached predictions are
+        # shared with the torch engine
+        metadata = session.get_modelmeta().custom_metadata_map
+        self.model_version = metadata.get('model_version') or f"onnx-{os.path.basename(model_path)}"
+        logger.info(f"ONNX model loaded successfully (version {self.model_version})")
+
+    def forward_normalized(self, batch):
+        """Run one forward pass over a normalized batch"""
+        with metrics.timed('forward'):
+            return self.model.run(None, {self.input_name: batch})[0]
+
+    def stats(self):
+        """Return inference engine statistics"""
+        stats = super().stats()
+        if self.model is not None:
+            options = self.model.get_session_options()
+            stats['threads'] = {
+                'intra_op': options.intra_op_num_threads,
+                'inter_op': options.inter_op_num_threads,
+            }
+        return stats
@@ -0,0 +1,117 @@
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import metrics, rollups
+from .batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+# ForensicAnalysis fields written once an analysis has been enriched
+RESULT_FIELDS = [
+    'authenticity_score', 'classification', 'confidence_level', 'detected_artifacts',
+    'heatmap_path', 'model_ensemble_results', 'detected_toolkit', 'cross_correlation', 'summary',
+    'recommended_action', 'raw_prediction_data', 'stage_timings', 'status',
+]
+
+def _result_write(analysis, artifacts):
+    from ..models import ArtifactDetection
+    fields = {field: getattr(analysis, field) for field in RESULT_FIELDS}
+    counts = rollups.analysis_counts(analysis, [artifact['type'] for artifact in artifacts])
+    rows = [
+        ArtifactDetection(
+            analysis_id=analysis.pk,
+            artifact_type=artifact['type'],
+            confidence=artifact['confidence'],
+            location=artifact.get('location', ''),
+            description=artifact['description']
+        )
+        for artifact in artifacts
+    ]
+    return analysis.pk, fields, rows, counts
+
+def _apply(writes):
+    """Apply prepared writes: one UPDATE per analysis, one bulk INSERT for all artifacts and rollup increments"""
+    from ..models import ForensicAnalysis, ArtifactDetection
+    artifacts = []
+    counts = Counter()
+    for pk, fields, rows, write_counts in writes:
+        ForensicAnalysis.objects.filter(pk=pk).update(**fields)
+        artifacts.extend(rows)
+        counts.update(write_counts)
+    if artifacts:
+        ArtifactDetection.objects.bulk_create(artifacts)
+    rollups.increment(counts)
+
+def save_analysis_results(analysis, artifacts):
+    """Persist an analysis' results and its artifacts as one atomic unit"""
+    with metrics.timed('db_write'), transaction.atomic():
+        _apply([_result_write(analysis, artifacts)])
+
+def mark_done(analysis):
+    """Mark an analysis whose results are committed as done, counting it in the rollups in the same transaction"""
+    from ..models import ForensicAnalysis
+    analysis.status = 'done'
+    counts = rollups.analysis_counts(analysis, [artifact['type'] for artifact in analysis.detected_artifacts])
+    with metrics.timed('db_write'), transaction.atomic():
+        # The prediction is written again in case the row was marked failed meanwhile
+        ForensicAnalysis.objects.filter(pk=analysis.pk).update(
+            status='done', raw_prediction_data=analysis.raw_prediction_data
+        )
+        rollups.increment(counts)
+
+class ResultWriter:
+    """Coalesce result writes from concurrent analyses into shared transactions.
+
+    Each caller blocks until its write is committed. If a combined
+    transaction fails, the writes in it are retried one by one so that a
+    single bad row does not fail its neighbours.
+    """
+
+    def __init__(self, max_batch_size=32, max_wait_ms=5):
+        self.batcher = MicroBatcher(self._write_batch, max_batch_size, max_wait_ms, name='result-writer')
+
+    def _write_batch(self, writes):
+        close_old_connections()
+        try:
+            with metrics.timed('db_write'), transaction.atomic():
+                _apply(writes)
+            return [None] * len(writes)
+        except Exception as e:
+            logger.warning(f"Coalesced result write failed, retrying individually: {str(e)}")
+            metrics.error('db_write')
+
+        outcomes = []
+        for write in writes:
+            try:
+                with transaction.atomic():
+                    _apply([write])
+                outcomes.append(None)
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+
+    def save(self, analysis, artifacts):
+        """Queue an analysis' results and wait until they are committed"""
+        error = self.batcher.submit(_result_write(analysis, artifacts)).result()
+        if error is not None:
+            raise error
+
+    def stats(self):
+        return self.batcher.stats()
+
+def persist_analysis_results(analysis, artifacts):
+    """Write results through the shared writer when coalescing is enabled"""
+    # Inside an open transaction the rows must be written on the caller's own
+    # connection, or the writer thread could not see the analysis row
+    if result_writer is not None and not transaction.get_connection().in_atomic_block:
+        result_writer.save(analysis, artifacts)
+    else:
+        save_analysis_results(analysis, artifacts)
+
+_batch_size = getattr(settings, 'DEEPIMAGE_RESULT_WRITER_BATCH_SIZE', 32)
+result_writer = ResultWriter(
+    _batch_size, getattr(settings, 'DEEPIMAGE_RESULT_WRITER_WAIT_MS', 5)
+) if _batch_size > 1 else None
@@ -0,0 +1,194 @@
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from .benchmarking import latency_summary, synthetic_image
+
+RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+FORMATS = ['JPEG', 'PNG', 'WEBP']
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+# preprocess, predict and save run on every image; the rest once, as they do
+# not depend on the image
+BENCHMARKS = ['preprocess', 'predict', 'save', 'artifacts', 'export_pdf', 'export_pdf_stored']
+
+# A randomly initialised eager model without batching and no heatmaps, so
+# nothing is downloaded and results do not depend on a checkpoint
+OFFLINE_SETTINGS = {
+    'DEEPIMAGE_MODEL_PATH': '',
+    'DEEPIMAGE_DUMMY_PRETRAINED': False,
+    'DEEPIMAGE_INFERENCE_BACKEND': 'eager',
+    'DEEPIMAGE_INFERENCE_BATCH_SIZE': 1,
+    'DEEPIMAGE_HEATMAP_MODE': 'off',
+    'DEEPIMAGE_PDF_PRERENDER': False,
+}
+
+def time_runs(func, repeats, warmup=1):
+    """Latency summary of ``repeats`` calls of func after ``warmup`` untimed calls"""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return latency_summary(timings)
+
+def random_detector(seed=0):
+    """Eager torch detector with seeded random weights"""
+    import torch
+    from .model_loader import DeepFakeDetector
+    torch.manual_seed(seed)
+    return DeepFakeDetector()
+
+def environment(seed=0):
+    """What a result depends on besides the code: interpreter, libraries, threads and commit"""
+    import torch
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            timeout=10,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'torch': torch.__version__,
+        'torch_threads': torch.get_num_threads(),
+        'cpu_count': os.cpu_count(),
+        'model': f"resnet50-random-seed{seed}",
+    }
+
+def _artifacts(count):
+    from ..models import ArtifactDetection
+    return [
+        {
+            'type': ArtifactDetection.ARTIFACT_TYPES[index % len(ArtifactDetection.ARTIFACT_TYPES)][0],
+            'confidence': 0.75,
+            'location': 'Various',
+            'description': 'Benchmark artifact',
+        }
+        for index in range(count)
+    ]
+
+def _analysis(name, data):
+    from ..models import ForensicAnalysis
+    analysis = ForensicAnalysis(
+        original_file=SimpleUploadedFile(name, data), media_source='benchmark', analyst_id='benchmark-pipeline',
+    )
+    analysis.save()
+    return analysis
+
+def _finish(analysis, artifacts):
+    """Give an analysis the results a completed analysis would have"""
+    analysis.authenticity_score = 42.0
+    analysis.classification = 'suspected_fake'
+    analysis.confidence_level = 'medium'
+    analysis.summary = 'Benchmark result'
+    analysis.recommended_action = 'Benchmark'
+    analysis.raw_prediction_data = {'label': 'deepfake', 'confidence': 58.0, 'is_deepfake': True}
+    analysis.detected_artifacts = artifacts
+    analysis.status = 'done'
+
+def run_suite(resolutions=RESOLUTIONS, formats=FORMATS, benchmarks=BENCHMARKS, repeats=5, artifacts=4, seed=0,
+              log=None):
+    """Time the detection pipeline on synthetic images and return the results as a dict.
+
+    Everything runs against a temporary MEDIA_ROOT inside a transaction that
+    is rolled back, so neither stored files nor database rows are left behind.
+    """
+    from .export_utils import remove_stale_pdfs
+    from .persistence import save_analysis_results
+    from .preprocessing import preprocessor
+
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    results = []
+
+    def record(benchmark, summary, fmt=None, resolution=None, size=None):
+        row = {'benchmark': benchmark, 'format': fmt, 'resolution': resolution, 'bytes': size, **summary}
+        results.append(row)
+        if log is not None:
+            log(row)
+
+    with tempfile.TemporaryDirectory() as media_root, \
+            override_settings(MEDIA_ROOT=media_root, **OFFLINE_SETTINGS):
+        detector = random_detector(seed) if 'predict' in benchmarks else None
+        with transaction.atomic():
+            for fmt in formats:
+                for width, height in resolutions:
+                    resolution = f"{width}x{height}"
+                    data = synthetic_image(width, height, fmt=fmt, seed=seed)
+                    path = os.path.join(media_root, f"input-{resolution}.{EXTENSIONS.get(fmt, fmt.lower())}")
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                    if 'preprocess' in benchmarks:
+                        record('preprocess', time_runs(lambda: preprocessor(path), repeats), fmt, resolution, len(data))
+                    if 'predict' in benchmarks:
+                        record('predict', time_runs(lambda: detector.predict(path), repeats), fmt, resolution, len(data))
+                    if 'save' in benchmarks:
+                        # Hashing and EXIF parsing of a fresh upload, plus its storage and INSERT
+                        name = os.path.basename(path)
+                        record('save', time_runs(lambda: _analysis(name, data), repeats), fmt, resolution, len(data))
+
+            data = synthetic_image(640, 480, seed=seed)
+            analysis = _analysis('report.jpg', data)
+            rows = _artifacts(artifacts)
+            _finish(analysis, rows)
+            if 'artifacts' in benchmarks:
+                record('artifacts', time_runs(lambda: save_analysis_results(analysis, rows), repeats))
+            else:
+                save_analysis_results(analysis, rows)
+
+            client = Client()
+            url = reverse('export_pdf', args=[analysis.id])
+
+            def download():
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise RuntimeError(f"export_pdf returned {response.status_code}")
+                # Consuming the content also closes the file, as a WSGI server would
+                b''.join(response.streaming_content)
+
+            def render_and_download():
+                remove_stale_pdfs(analysis)
+                download()
+
+            if 'export_pdf' in benchmarks:
+                record('export_pdf', time_runs(render_and_download, repeats))
+            if 'export_pdf_stored' in benchmarks:
+                record('export_pdf_stored', time_runs(download, repeats))
+            transaction.set_rollback(True)
+
+    return {
+        'environment': environment(seed),
+        'settings': {'repeats': repeats, 'artifacts': artifacts, 'seed': seed},
+        'results': results,
+    }
+
+def _key(row):
+    return row['benchmark'], row['format'], row['resolution']
+
+def compare(baseline, current, threshold=1.2):
+    """Rows of ``current`` whose median latency is at least ``threshold`` times the baseline's"""
+    previous = {_key(row): row for row in baseline['results']}
+    regressions = []
+    for row in current['results']:
+        before = previous.get(_key(row))
+        if before is None or not before.get('p50_ms'):
+            continue
+        ratio = row['p50_ms'] / before['p50_ms']
+        if ratio >= threshold:
+            regressions.append({**row, 'baseline_p50_ms': before['p50_ms'], 'ratio': round(ratio, 3)})
+    return regressions
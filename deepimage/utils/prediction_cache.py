@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .registry import detector
+
+logger = logging.getLogger(__name__)
+
+def file_sha256(source, chunk_size=1024 * 1024):
+    """Stream a file path, Django file, binary file object or decoded image's file through SHA-256"""
+    digest = hashlib.sha256()
+    with metrics.timed('hash'):
+        if hasattr(source, 'chunks'):
+            for chunk in source.chunks(chunk_size):
+                digest.update(chunk)
+        elif hasattr(source, 'read'):
+            source.seek(0)
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                digest.update(chunk)
+        else:
+            # A DecodedImage is hashed from the file it was decoded from
+            with open(getattr(source, 'path', source), 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+class PredictionCache:
+    """Two-tier prediction cache keyed on (content SHA-256, model version).
+
+    The first tier is an in-process LRU; the second is the PredictionCache
+    table, which survives restarts and is shared between worker processes.
+    Results from a dummy model are never persisted.
+    """
+
+    def __init__(self, max_entries=1024, persist=True):
+        self.max_entries = max(0, int(max_entries))
+        self.persist = persist
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _remember(self, key, result):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, content_hash, model_version):
+        """Return a cached result or None, checking memory before the database"""
+        key = (content_hash, model_version)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return dict(result)
+
+        if self.persist and not model_version.startswith('dummy-'):
+            from ..models import PredictionCache as CachedPrediction
+            try:
+                entries = CachedPrediction.objects.filter(
+                    content_hash=content_hash, model_version=model_version
+                )
+                cached = entries.values_list('result', flat=True).first()
+                if cached is not None:
+                    entries.update(hit_count=F('hit_count') + 1, last_hit_at=timezone.now())
+                    self._remember(key, cached)
+                    self._count('db_hits')
+                    return dict(cached)
+            except Exception as e:
+                logger.error(f"Prediction cache lookup error: {str(e)}")
+                self._count('errors')
+
+        self._count('misses')
+        return None
+
+    def set(self, content_hash, model_version, result):
+        """Store a successful prediction in both tiers"""
+        key = (content_hash, model_version)
+        self._remember(key, dict(result))
+        self._count('stores')
+
+        if self.persist and not model_version.startswith('dummy-'):
+            from ..models import PredictionCache as CachedPrediction
+            try:
+                CachedPrediction.objects.update_or_create(
+                    content_hash=content_hash, model_version=model_version,
+                    defaults={'result': result}
+                )
+            except Exception as e:
+                logger.error(f"Prediction cache store error: {str(e)}")
+                self._count('errors')
+
+    def key(self, image_path, content_hash=None):
+        """Cache key of an image: its content SHA-256, hashed unless given, and the serving model version"""
+        return content_hash or file_sha256(image_path), detector.model_version or 'unknown'
+
+    def predict(self, image_path, content_hash=None):
+        """Return the cached prediction for an image, running the model only on a miss"""
+        content_hash, model_version = self.key(image_path, content_hash)
+
+        cached = self.get(content_hash, model_version)
+        if cached is not None:
+            cached['cached'] = True
+            return cached
+
+        result = detector.predict(image_path)
+        if 'error' not in result:
+            self.set(content_hash, model_version, result)
+        return result
+
+    def clear(self):
+        """Drop the in-process tier"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._entries)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['max_entries'] = self.max_entries
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['db_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+prediction_cache = PredictionCache(
+    max_entries=getattr(settings, 'DEEPIMAGE_PREDICTION_CACHE_SIZE', 1024),
+    persist=getattr(settings, 'DEEPIMAGE_PREDICTION_CACHE_PERSIST', True),
+)
@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+
+from .preprocessing import preprocessor
+from .registry import detector
+
+logger = logging.getLogger(__name__)
+
+class PrefetchPipeline:
+    """Decode images on a worker pool into preallocated batch buffers ahead of the model.
+
+    ``imap`` takes items and a ``load`` function that returns an item's
+    (H, W, 3) uint8 image, or None when the item needs no model pass (a
+    cache hit, a duplicate). Workers run ``load`` and normalize the image
+    straight into its row of a batch buffer, up to ``prefetch_batches``
+    batches ahead of the consumer, while the calling thread runs the model
+    on the batch before. The buffers come from the detector, so they are
+    page-locked when it runs on CUDA.
+
+    Decoding runs on threads: PIL and NumPy release the GIL while decoding,
+    resizing and normalizing, and the ONNX engine must not import torch.
+    """
+
+    def __init__(self, model, batch_size=8, workers=4, prefetch_batches=2, name='prefetch'):
+        self.model = model
+        self.batch_size = max(1, int(batch_size))
+        self.workers = max(1, int(workers))
+        self.prefetch_batches = max(1, int(prefetch_batches))
+        self.name = name
+        self._executor = None
+        self._lock = threading.Lock()
+        self._counters = {
+            'runs': 0, 'images': 0, 'batches': 0, 'errors': 0,
+            'decode_seconds': 0.0, 'model_seconds': 0.0, 'wait_seconds': 0.0, 'wall_seconds': 0.0,
+        }
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"deepimage-{self.name}")
+            return self._executor
+
+    def _count(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                self._counters[name] += value
+
+    def _load(self, load, item, buffer, row):
+        started = time.perf_counter()
+        try:
+            image = load(item)
+            if image is None:
+                return False, None
+            preprocessor.normalize([image], out=buffer[row:row + 1])
+            return True, None
+        except Exception as e:
+            return False, e
+        finally:
+            self._count(decode_seconds=time.perf_counter() - started)
+
+    def imap(self, items, load):
+        """Yield ``(item, probabilities, error)`` for every item, in input order.
+
+        ``probabilities`` is the item's row of model output, or None when
+        ``load`` returned None or raised; ``error`` is the exception that
+        ``load`` or the forward pass raised, if any.
+        """
+        items = iter(items)
+        buffers = [self.model.allocate_batch(self.batch_size) for _ in range(self.prefetch_batches + 1)]
+        pending = deque()
+        next_buffer = 0
+        exhausted = False
+        started = time.perf_counter()
+        self._count(runs=1)
+        try:
+            while True:
+                # Keep the workers up to prefetch_batches batches ahead; a
+                # buffer is refilled only after its batch went through the model
+                while not exhausted and len(pending) <= self.prefetch_batches:
+                    chunk = list(islice(items, self.batch_size))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    buffer = buffers[next_buffer]
+                    next_buffer = (next_buffer + 1) % len(buffers)
+                    futures = [self.executor.submit(self._load, load, item, buffer, row) for row, item in enumerate(chunk)]
+                    pending.append((buffer, chunk, futures))
+                if not pending:
+                    break
+
+                buffer, chunk, futures = pending.popleft()
+                tick = time.perf_counter()
+                loaded = [future.result() for future in futures]
+                self._count(wait_seconds=time.perf_counter() - tick)
+
+                rows = [row for row, (ok, _) in enumerate(loaded) if ok]
+                outputs, model_error = {}, None
+                if rows:
+                    batch = buffer[:len(chunk)] if len(rows) == len(chunk) else buffer[rows]
+                    tick = time.perf_counter()
+                    try:
+                        outputs = dict(zip(rows, self.model.forward_normalized(batch)))
+                    except Exception as e:
+                        logger.error(f"Prediction error: {str(e)}")
+                        model_error = e
+                    self._count(model_seconds=time.perf_counter() - tick, batches=1)
+
+                errors = sum(1 for row, (ok, error) in enumerate(loaded) if error is not None or (ok and model_error))
+                self._count(images=len(chunk), errors=errors)
+                for row, item in enumerate(chunk):
+                    error = loaded[row][1] or (model_error if loaded[row][0] else None)
+                    yield item, outputs.get(row), error
+        finally:
+            self._count(wall_seconds=time.perf_counter() - started)
+
+    def stats(self):
+        """Counters with the share of wall time the model and the decode workers were busy"""
+        with self._lock:
+            stats = dict(self._counters)
+        wall = stats['wall_seconds']
+        stats.update({
+            'batch_size': self.batch_size,
+            'workers': self.workers,
+            'prefetch_batches': self.prefetch_batches,
+            'model_utilization': round(stats['model_seconds'] / wall, 4) if wall else 0.0,
+            'decode_utilization': round(stats['decode_seconds'] / (wall * self.workers), 4) if wall else 0.0,
+            'model_wait_fraction': round(stats['wait_seconds'] / wall, 4) if wall else 0.0,
+        })
+        for name in ('decode_seconds', 'model_seconds', 'wait_seconds', 'wall_seconds'):
+            stats[name] = round(stats[name], 3)
+        return stats
+
+inference_pipeline = PrefetchPipeline(
+    detector,
+    batch_size=getattr(settings, 'DEEPIMAGE_INFERENCE_BATCH_SIZE', 8),
+    workers=getattr(settings, 'DEEPIMAGE_PREFETCH_WORKERS', 4),
+    prefetch_batches=getattr(settings, 'DEEPIMAGE_PREFETCH_BATCHES', 2),
+    name='prefetch',
+)
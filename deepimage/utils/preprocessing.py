@@ -0,0 +1,138 @@
+import math
+import threading
+
+import numpy as np
+from PIL import Image
+
+from . import metrics
+
+INPUT_SIZE = (224, 224)
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+class DecodedImage:
+    """An image decoded once and shared by every step that analyses it.
+
+    ``rgb`` holds the pixels at full resolution, or at a reduced JPEG DCT
+    scale when the image has more than the decoder's pixel limit, in which
+    case ``native`` is False. ``format``, ``size`` and ``info`` keep what PIL
+    read from the file so metadata checks need not open it again.
+    ``ImagePreprocessor.open`` and ``load`` accept it in place of a path.
+    """
+
+    def __init__(self, rgb, format=None, size=None, info=None, native=True, path=None):
+        self.rgb = rgb
+        self.format = format
+        self.size = size or (rgb.shape[1], rgb.shape[0])
+        self.info = info or {}
+        self.native = native
+        self.path = path
+        # Model inputs resized from the pixels, by input size
+        self.resized = {}
+
+    def image(self):
+        """PIL view of the pixels carrying the file's format and metadata"""
+        img = Image.fromarray(self.rgb)
+        img.format = self.format
+        img.info = dict(self.info)
+        return img
+
+class ImagePreprocessor:
+    """Decode and resize images in uint8 before normalizing them for the model.
+
+    JPEGs are decoded at a reduced DCT scale through ``Image.draft`` and other
+    formats are shrunk with ``Image.reduce`` (via ``reducing_gap``), so a large
+    upload is never expanded into a full-resolution float tensor. Normalized
+    batches are written into preallocated per-thread buffers.
+    """
+
+    def __init__(self, size=INPUT_SIZE, reducing_gap=2.0):
+        self.size = tuple(size)
+        self.reducing_gap = reducing_gap
+        self.scale = (1.0 / (255.0 * STD)).reshape(3, 1, 1)
+        self.offset = (MEAN / STD).reshape(3, 1, 1)
+        self._local = threading.local()
+
+    def open(self, source):
+        """Open a path, file object, PIL image or DecodedImage without decoding the pixel data"""
+        if isinstance(source, Image.Image):
+            return source
+        if isinstance(source, DecodedImage):
+            return source.image()
+        return Image.open(source)
+
+    def decode(self, source, max_pixels=4_000_000):
+        """Decode an image once into a DecodedImage.
+
+        JPEGs over ``max_pixels`` are decoded at the 1/2, 1/4 or 1/8 DCT
+        scale that brings them under the limit.
+        """
+        with metrics.timed('decode'):
+            with self.open(source) as img:
+                size = img.size
+                native = img.width * img.height <= max_pixels
+                if not native and img.format == 'JPEG':
+                    scale = min(8, 2 ** math.ceil(math.log2((img.width * img.height / max_pixels) ** 0.5)))
+                    img.draft('RGB', (img.width // scale, img.height // scale))
+                rgb = np.asarray(img.convert('RGB'))
+                # Text chunks that follow the pixel data are only read by the decode
+                return DecodedImage(
+                    rgb, img.format, size, dict(img.info), native, source if isinstance(source, str) else None
+                )
+
+    def load(self, source):
+        """Return the resized image as a (H, W, 3) uint8 array"""
+        if isinstance(source, DecodedImage):
+            # Resized from the shared pixels once per input size
+            if self.size not in source.resized:
+                with metrics.timed('decode'):
+                    source.resized[self.size] = self.resize(source.image())
+            return source.resized[self.size]
+
+        with metrics.timed('decode'), self.open(source) as img:
+            width, height = self.size
+
+            if img.format == 'JPEG' and img.mode in ('RGB', 'L', 'YCbCr', 'CMYK'):
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying above
+                # reducing_gap times the target size
+                img.draft('RGB', (int(width * self.reducing_gap), int(height * self.reducing_gap)))
+            return self.resize(img)
+
+    def resize(self, img):
+        """Resize a PIL image to the model input as a (H, W, 3) uint8 array"""
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img = img.resize(self.size, Image.BILINEAR, reducing_gap=self.reducing_gap)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        return np.asarray(img)
+
+    def buffer(self, batch_size):
+        """Return a reusable (N, 3, H, W) float32 buffer owned by the calling thread"""
+        buf = getattr(self._local, 'buffer', None)
+        if buf is None or buf.shape[0] < batch_size:
+            buf = np.empty((batch_size, 3) + self.size[::-1], dtype=np.float32)
+            self._local.buffer = buf
+        return buf[:batch_size]
+
+    def normalize(self, arrays, out=None):
+        """Normalize uint8 HWC arrays into an (N, 3, H, W) float32 batch.
+
+        The result is a view of the calling thread's buffer unless ``out`` is
+        given, so it is only valid until the next call on the same thread.
+        """
+        with metrics.timed('transform'):
+            if out is None:
+                out = self.buffer(len(arrays))
+            for index, array in enumerate(arrays):
+                target = out[index]
+                target[...] = array.transpose(2, 0, 1)
+                target *= self.scale
+                target -= self.offset
+            return out
+
+    def __call__(self, source):
+        """Load and normalize a single image into a fresh (3, H, W) array"""
+        return self.normalize([self.load(source)], out=np.empty((1, 3) + self.size[::-1], dtype=np.float32))[0]
+
+preprocessor = ImagePreprocessor()
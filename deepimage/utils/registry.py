@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .preprocessing import preprocessor
+
+logger = logging.getLogger(__name__)
+
+def get_model_path():
+    """Path of the detector checkpoint"""
+    return getattr(
+        settings, 'DEEPIMAGE_MODEL_PATH',
+        os.path.join(settings.BASE_DIR, 'deepimage', 'utils', 'best_model.pth')
+    )
+
+class LazyDetector:
+    """Registry that builds the configured detector on first use.
+
+    Attribute access is forwarded to the real detector, loading it if needed,
+    so importing this module costs nothing beyond the imports themselves.
+    ``warm_up`` loads the model ahead of the first request and runs one
+    forward pass; load and warm-up timings are reported by ``stats``.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+    @property
+    def loaded(self):
+        return self._instance is not None
+
+    def get(self):
+        """Return the detector, constructing it on the first call"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    instance = self._factory()
+                    self.load_seconds = time.perf_counter() - started
+                    logger.info(f"Detector loaded in {self.load_seconds:.2f}s")
+                    self._instance = instance
+        return self._instance
+
+    def warm_up(self):
+        """Load the model and run one forward pass so the first request pays no setup cost"""
+        instance = self.get()
+        if instance.model is None or self.warmup_seconds is not None:
+            return
+        started = time.perf_counter()
+        instance.forward_arrays([np.zeros(preprocessor.size[::-1] + (3,), dtype=np.uint8)])
+        self.warmup_seconds = time.perf_counter() - started
+        logger.info(f"Detector warm-up forward pass took {self.warmup_seconds:.2f}s")
+
+    def stats(self):
+        """Return detector statistics without forcing the model to load"""
+        if self._instance is None:
+            stats = {'model_loaded': False}
+        else:
+            stats = self._instance.stats()
+        stats['startup'] = {
+            'loaded': self.loaded,
+            'load_seconds': None if self.load_seconds is None else round(self.load_seconds, 3),
+            'warmup_seconds': None if self.warmup_seconds is None else round(self.warmup_seconds, 3),
+        }
+        return stats
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+def create_detector():
+    """Build the detector for the configured inference engine"""
+    engine = getattr(settings, 'DEEPIMAGE_INFERENCE_ENGINE', 'torch')
+    if engine == 'onnx':
+        from .onnx_engine import OnnxDetector
+        return OnnxDetector()
+    if engine != 'torch':
+        raise ValueError(f"Unknown inference engine '{engine}'. Choose 'torch' or 'onnx'")
+    from .model_loader import DeepFakeDetector
+    return DeepFakeDetector()
+
+# Shared detector, loaded on first use or by DeepimageConfig.ready()
+detector = LazyDetector(create_detector)
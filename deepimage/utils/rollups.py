@@ -0,0 +1,98 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .analysis_search import day_start
+
+TOTAL = 'analyses'
+# Rollup dimension -> ForensicAnalysis field
+ANALYSIS_DIMENSIONS = {
+    'classification': 'classification',
+    'confidence_level': 'confidence_level',
+    'toolkit': 'detected_toolkit',
+}
+ARTIFACT_DIMENSION = 'artifact_type'
+
+def analysis_counts(analysis, artifact_types):
+    """Rollup increments, keyed on (day, dimension, value), of one completed analysis"""
+    if analysis.status != 'done' or analysis.analysis_date is None:
+        return Counter()
+    day = timezone.localdate(analysis.analysis_date)
+    counts = Counter({(day, TOTAL, ''): 1})
+    for dimension, field in ANALYSIS_DIMENSIONS.items():
+        value = getattr(analysis, field)
+        if value:
+            counts[(day, dimension, value[:100])] += 1
+    for artifact_type in artifact_types:
+        counts[(day, ARTIFACT_DIMENSION, artifact_type)] += 1
+    return counts
+
+def increment(counts):
+    """Add counts to their rollup rows, creating missing rows.
+
+    Call it inside the transaction that writes the analyses, so the counts
+    commit or roll back with them.
+    """
+    from ..models import DailyRollup
+    for (day, dimension, value), count in sorted(counts.items()):
+        rows = DailyRollup.objects.filter(day=day, dimension=dimension, value=value)
+        if rows.update(count=F('count') + count):
+            continue
+        try:
+            with transaction.atomic():
+                DailyRollup.objects.create(day=day, dimension=dimension, value=value, count=count)
+        except IntegrityError:
+            # Created by a concurrent writer since the update
+            rows.update(count=F('count') + count)
+
+def rebuild(date_from, date_to):
+    """Recompute the rollup rows of the days from date_from to date_to with GROUP BY queries"""
+    from ..models import ArtifactDetection, DailyRollup, ForensicAnalysis
+    analyses = ForensicAnalysis.objects.filter(
+        status='done',
+        analysis_date__gte=day_start(date_from),
+        analysis_date__lt=day_start(date_to + timedelta(days=1)),
+    ).annotate(day=TruncDate('analysis_date'))
+
+    counts = Counter()
+    for row in analyses.values('day').annotate(count=Count('id')):
+        counts[(row['day'], TOTAL, '')] = row['count']
+    for dimension, field in ANALYSIS_DIMENSIONS.items():
+        for row in analyses.exclude(**{field: ''}).values('day', field).annotate(count=Count('id')):
+            counts[(row['day'], dimension, row[field][:100])] += row['count']
+    artifacts = (ArtifactDetection.objects.filter(analysis__in=analyses.values('id'))
+                 .annotate(day=TruncDate('analysis__analysis_date')))
+    for row in artifacts.values('day', 'artifact_type').annotate(count=Count('id')):
+        counts[(row['day'], ARTIFACT_DIMENSION, row['artifact_type'])] = row['count']
+
+    with transaction.atomic():
+        DailyRollup.objects.filter(day__gte=date_from, day__lte=date_to).delete()
+        DailyRollup.objects.bulk_create([
+            DailyRollup(day=day, dimension=dimension, value=value, count=count)
+            for (day, dimension, value), count in counts.items()
+        ], batch_size=1000)
+    return len(counts)
+
+def summarize(date_from, date_to):
+    """Per-day and total counts of each dimension between two days, read from the rollup rows only"""
+    from ..models import DailyRollup
+    days = {}
+    totals = {TOTAL: 0, **{dimension: {} for dimension in (*ANALYSIS_DIMENSIONS, ARTIFACT_DIMENSION)}}
+    rows = (DailyRollup.objects.filter(day__gte=date_from, day__lte=date_to)
+            .order_by('day', 'dimension', 'value').values_list('day', 'dimension', 'value', 'count'))
+    for day, dimension, value, count in rows:
+        entry = days.setdefault(day, {
+            'date': day.isoformat(), TOTAL: 0,
+            **{name: {} for name in (*ANALYSIS_DIMENSIONS, ARTIFACT_DIMENSION)},
+        })
+        if dimension == TOTAL:
+            entry[TOTAL] += count
+            totals[TOTAL] += count
+        elif dimension in totals:
+            entry[dimension][value] = count
+            totals[dimension][value] = totals[dimension].get(value, 0) + count
+    return {'totals': totals, 'days': list(days.values())}
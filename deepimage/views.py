@@ -1,13 +1,26 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, FileResponse, HttpResponse
+from django.urls import reverse
 from django.conf import settings
+from django.utils import timezone
 from .forms import ImageUploadForm, ForensicUploadForm
 from .models import UploadedImage, ForensicAnalysis, ArtifactDetection
-from .utils.model_loader import detector
+from .utils.registry import detector
+from .utils.prediction_cache import prediction_cache
+from .utils.job_queue import analysis_queue, QueueFull
+from .utils.async_inference import inference_executor, streaming_content
+from .utils import analysis_search, artifact_detection, batch_predict, heatmaps, metrics, near_duplicates, rollups
+from .utils.persistence import mark_done, persist_analysis_results, result_writer
+from .utils.analysis_pipeline import analysis_pipeline
+from .utils.ensemble import ensemble
+from .utils.prefetch import inference_pipeline
+from .utils.preprocessing import preprocessor
+from .utils.export_utils import report_queue, schedule_pdf
 import os
 import json
-import random
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 
 # Add these helper functions to views.py
 def get_artifact_display_name(artifact_type):
@@ -20,52 +33,89 @@ def get_artifact_display_name(artifact_type):
         'background_mismatch': 'Background Mismatch',
         'blink_pattern': 'Blink Pattern Anomalies',
         'color_inconsistency': 'Color Inconsistency',
+        'error_level': 'Error Level Anomalies',
+        'jpeg_grid': 'JPEG Grid Artifacts',
     }
     return artifact_names.get(artifact_type, artifact_type)
 
 def home(request):
     return render(request, 'index.html')
 
+def retry_later(message):
+    """503 response telling the client to retry a request we are too busy to start"""
+    response = JsonResponse({'success': False, 'error': message}, status=503)
+    response['Retry-After'] = '5'
+    return response
+
+def queue_analysis(form):
+    """Save a valid forensic upload as a queued analysis and hand it to the analysis workers.
+
+    Raises QueueFull, after removing the upload again, when the queue is saturated.
+    """
+    analysis = form.save(commit=False)
+    analysis.status = 'queued'
+    analysis.save()
+
+    try:
+        analysis_queue.submit(run_analysis_job, analysis.id)
+    except QueueFull:
+        # Shed load instead of accepting work we cannot start soon
+        analysis.original_file.delete(save=False)
+        analysis.delete()
+        raise
+    return analysis
+
+def upload_busy(request, form):
+    """Upload form asking the user to retry because the analysis queue is full"""
+    response = render(request, 'forensic_upload.html', {
+        'form': form,
+        'error': 'The server is busy analysing other uploads, please retry shortly.'
+    }, status=503)
+    response['Retry-After'] = '5'
+    return response
+
 def upload_image(request):
     if request.method == 'POST':
         form = ForensicUploadForm(request.POST, request.FILES)
         if form.is_valid():
-            # Save the analysis record with forensic data
-            analysis = form.save()
-            
-            # Get full path to the image
-            image_path = os.path.join(settings.MEDIA_ROOT, analysis.original_file.name)
-            
-            # Make prediction
-            result = detector.predict(image_path)
-            
-            if 'error' not in result:
-                # Enhanced analysis with forensic details
-                enhanced_result = enhance_forensic_analysis(analysis, result, image_path)
-                
-                return render(request, 'forensic_result.html', {
-                    'analysis': analysis,
-                    'result': enhanced_result
-                })
-            else:
-                return render(request, 'forensic_upload.html', {
-                    'form': form,
-                    'error': result['error']
-                })
+            try:
+                analysis = queue_analysis(form)
+            except QueueFull:
+                return upload_busy(request, form)
+            return redirect('analysis_report', analysis.report_id)
     else:
         form = ForensicUploadForm()
     
     return render(request, 'forensic_upload.html', {'form': form})
 
-def api_predict(request):
-    """API endpoint for predictions"""
+async def api_predict(request):
+    """API endpoint for predictions.
+
+    Hashing and the forward pass run on the inference executor; the upload
+    and the prediction cache are read and written through thread-sensitive
+    sync_to_async, on the thread that owns the request's database connection.
+    """
     if request.method == 'POST' and request.FILES.get('image'):
         form = ImageUploadForm(request.POST, request.FILES)
-        if form.is_valid():
-            uploaded_image = form.save()
+        if await sync_to_async(form.is_valid, thread_sensitive=True)():
+            uploaded_image = await sync_to_async(form.save, thread_sensitive=True)()
             image_path = os.path.join(settings.MEDIA_ROOT, uploaded_image.image.name)
             
-            result = detector.predict(image_path)
+            try:
+                content_hash, model_version = await inference_executor.run(prediction_cache.key, image_path)
+                result = await sync_to_async(prediction_cache.get, thread_sensitive=True)(content_hash, model_version)
+                if result is not None:
+                    result['cached'] = True
+                else:
+                    result = await inference_executor.run(detector.predict, image_path)
+                    if 'error' not in result:
+                        await sync_to_async(prediction_cache.set, thread_sensitive=True)(
+                            content_hash, model_version, result
+                        )
+            except QueueFull:
+                await sync_to_async(uploaded_image.image.delete, thread_sensitive=True)(save=False)
+                await sync_to_async(uploaded_image.delete, thread_sensitive=True)()
+                return retry_later('Inference is at capacity, retry later')
             
             if 'error' not in result:
                 return JsonResponse({
@@ -77,66 +127,273 @@ def api_predict(request):
     
     return JsonResponse({'success': False, 'error': 'Invalid request'})
 
-def detect_artifacts(image_path, is_deepfake):
-    """Simulate artifact detection - integrate real artifact detection logic"""
-    artifact_types = [
-        'facial_asymmetry', 'lighting_inconsistency', 'skin_texture',
-        'eye_reflection', 'background_mismatch', 'blink_pattern', 'color_inconsistency'
-    ]
-    
-    detected_artifacts = []
-    
-    # If it's a deepfake, simulate some artifacts
-    if is_deepfake:
-        # Randomly select 2-4 artifacts
-        num_artifacts = random.randint(2, 4)
-        selected_artifacts = random.sample(artifact_types, num_artifacts)
-        
-        for artifact_type in selected_artifacts:
-            detected_artifacts.append({
-                'type': artifact_type,
-                'display_name': get_artifact_display_name(artifact_type),
-                'confidence': round(random.uniform(0.6, 0.95), 2),
-                'location': 'Various',
-                'description': f'Detected {get_artifact_display_name(artifact_type)} anomalies'
-            })
-    
-    return detected_artifacts
+def api_predict_batch(request):
+    """API endpoint streaming NDJSON predictions for many images, in input order"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request'}, status=405)
+
+    try:
+        batch_predict.validate_request(request)
+    except batch_predict.BatchInputError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    # Images are decoded and predicted on the stream's own thread under ASGI
+    entries = batch_predict.iter_request_images(request)
+    response = StreamingHttpResponse(
+        streaming_content(request, batch_predict.stream_predictions(entries)), content_type='application/x-ndjson'
+    )
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def inference_stats(request):
+    """API endpoint exposing inference batching and cache statistics"""
+    stats = detector.stats()
+    stats['prediction_cache'] = prediction_cache.stats()
+    stats['analysis_queue'] = analysis_queue.stats()
+    stats['prefetch_pipeline'] = inference_pipeline.stats()
+    stats['report_queue'] = report_queue.stats()
+    stats['inference_executor'] = inference_executor.stats()
+    stats['near_duplicate_index'] = near_duplicates.index.stats()
+    if result_writer is not None:
+        stats['result_writer'] = result_writer.stats()
+    return JsonResponse(stats)
+
+def prometheus_metrics(request):
+    """Step latency histograms, error counters, queue depths and cache counters for Prometheus"""
+    if not metrics.enabled():
+        return HttpResponse("Metrics are disabled", status=404)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def submit_analysis(request):
+    """API endpoint that queues a forensic analysis and returns its report ID immediately"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request'}, status=405)
+
+    form = ForensicUploadForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+
+    try:
+        analysis = queue_analysis(form)
+    except QueueFull:
+        return retry_later('Analysis queue is full, retry later')
+
+    return JsonResponse({
+        'success': True,
+        'report_id': analysis.report_id,
+        'status': analysis.status,
+        'status_url': reverse('analysis_status', args=[analysis.report_id]),
+    }, status=202)
+
+def run_analysis_job(analysis_id):
+    """Run inference and forensic enrichment for a queued analysis.
+
+    Results are written while the analysis is still 'running'; it only
+    becomes 'done' once they are committed, so a reader never sees a done
+    analysis without results.
+    """
+    analysis = ForensicAnalysis.objects.get(id=analysis_id)
+    analysis.status = 'running'
+    ForensicAnalysis.objects.filter(id=analysis_id).update(status='running')
+
+    try:
+        # Decode the upload once; every stage and the model share the pixels
+        image = preprocessor.decode(
+            os.path.join(settings.MEDIA_ROOT, analysis.original_file.name),
+            getattr(settings, 'DEEPIMAGE_ARTIFACT_MAX_PIXELS', 4_000_000)
+        )
+        result, stages = analyze_image(analysis, image)
+        if 'error' in result:
+            stages.cancel()
+            raise RuntimeError(result['error'])
+
+        enhance_forensic_analysis(analysis, result, image, stages)
+        mark_done(analysis)
+        schedule_pdf(analysis.id)
+    except Exception as e:
+        ForensicAnalysis.objects.filter(id=analysis_id).update(
+            status='failed', raw_prediction_data={'error': str(e)}
+        )
+        raise
+
+def analysis_status(request, report_id):
+    """API endpoint reporting the state of a queued analysis"""
+    try:
+        analysis = ForensicAnalysis.objects.get(report_id=report_id)
+    except ForensicAnalysis.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Report not found'}, status=404)
 
-def forensic_analysis(request):
+    response = {
+        'success': True,
+        'report_id': analysis.report_id,
+        'status': analysis.status,
+    }
+    if analysis.status == 'done':
+        response['result'] = {
+            'prediction': analysis.raw_prediction_data.get('label'),
+            'confidence': analysis.raw_prediction_data.get('confidence'),
+            'is_deepfake': analysis.raw_prediction_data.get('is_deepfake'),
+            'authenticity_score': analysis.authenticity_score,
+            'classification': analysis.classification,
+            'confidence_level': analysis.confidence_level,
+            'detected_artifacts': analysis.detected_artifacts,
+            'summary': analysis.summary,
+            'recommended_action': analysis.recommended_action,
+            'stage_timings': analysis.stage_timings,
+            'pdf_url': reverse('export_pdf', args=[analysis.id]),
+        }
+    elif analysis.status == 'failed':
+        response['error'] = analysis.raw_prediction_data.get('error', 'Analysis failed')
+    return JsonResponse(response)
+
+def search_analyses(request):
+    """API endpoint listing analyses newest first, filtered and keyset-paginated.
+
+    Filters: date_from, date_to, classification, media_source, status,
+    sha256 and ids, each accepting comma separated values. ``limit`` sets
+    the page size; pass ``next_cursor`` back as ``cursor`` for the next page.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'error': 'Invalid request'}, status=405)
+    try:
+        limit = int(request.GET.get('limit', 50))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit must be an integer'}, status=400)
+    try:
+        queryset = analysis_search.filter_analyses(**analysis_search.filters_from_query(request.GET))
+        analyses, next_cursor = analysis_search.search_page(queryset, request.GET.get('cursor'), limit)
+    except analysis_search.FilterError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'results': [analysis_search.result_row(analysis) for analysis in analyses],
+        'next_cursor': next_cursor,
+    })
+
+def analysis_stats(request):
+    """API endpoint with daily analysis counts per classification, confidence level,
+    toolkit and artifact type, read from the rollup table.
+
+    Covers date_from to date_to (YYYY-MM-DD), by default the last 30 days.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'error': 'Invalid request'}, status=405)
+    try:
+        date_to = analysis_search.parse_day(request.GET.get('date_to'), 'date_to') or timezone.localdate()
+        date_from = (analysis_search.parse_day(request.GET.get('date_from'), 'date_from')
+                     or date_to - timedelta(days=29))
+    except analysis_search.FilterError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    if date_from > date_to:
+        return JsonResponse({'success': False, 'error': 'date_from is after date_to'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat(),
+        **rollups.summarize(date_from, date_to),
+    })
+
+def analysis_heatmap(request, analysis_id):
+    """Serve an analysis' Grad-CAM overlay, generating it on first request"""
+    try:
+        analysis = ForensicAnalysis.objects.get(id=analysis_id)
+    except ForensicAnalysis.DoesNotExist:
+        return HttpResponse("Report not found", status=404)
+
+    generated = heatmaps.existing_heatmap(analysis) is None
+    name = heatmaps.ensure_heatmap(analysis)
+    if name is None:
+        return HttpResponse("Heatmap not available", status=404)
+    if generated and analysis.status == 'done':
+        # The report queue waits for the heatmap before pre-rendering the PDF
+        schedule_pdf(analysis.id)
+    return FileResponse(open(heatmaps.heatmap_file(name), 'rb'), content_type='image/png')
+
+def analyze_image(analysis, image):
+    """Predict for a saved analysis while its analysis stages run on the stage pool.
+
+    A confident verdict on a near-identical earlier image is reused instead
+    of running the model, and matching analyses are recorded in
+    cross_correlation. ``image`` is a DecodedImage or a path.
+    """
+    stages = analysis_pipeline.start(image)
+    started = time.perf_counter()
+    fingerprint = near_duplicates.fingerprint(image, analysis.file_hash_sha256)
+    # The search before the model serves the verdict reuse and, unless the
+    # forward pass adds an embedding, cross_correlation
+    matches = near_duplicates.find_matches(analysis, fingerprint)
+    result = near_duplicates.reused_verdict(matches)
+    embedding = None
+    if result is not None:
+        analysis.heatmap_path = heatmaps.deferred_heatmap_path(analysis)
+        stages.record('near_duplicate_reuse', time.perf_counter() - started)
+        started = time.perf_counter()
+    else:
+        result, embedding = near_duplicates.predict(
+            analysis, image, fingerprint.embedding if fingerprint is not None else None
+        )
+        stages.record('inference', time.perf_counter() - started)
+        started = time.perf_counter()
+        result, analysis.model_ensemble_results = ensemble.refine(image, result, analysis.file_hash_sha256)
+        if analysis.model_ensemble_results:
+            stages.record('ensemble', time.perf_counter() - started)
+            started = time.perf_counter()
+    if 'error' not in result:
+        matches = near_duplicates.add_embedding(analysis, fingerprint, embedding, matches)
+        analysis.cross_correlation = near_duplicates.correlate(analysis, fingerprint, matches)
+        stages.record('near_duplicates', time.perf_counter() - started)
+    return result, stages
+
+@analysis_pipeline.stage('artifacts', timeout_ms=1000, default=([], {}))
+def detect_artifacts(image):
+    """Run the artifact detectors and return the artifacts found with the analysis timings"""
+    detected_artifacts, report = artifact_detection.analyze(image)
+    for artifact in detected_artifacts:
+        artifact['display_name'] = get_artifact_display_name(artifact['type'])
+    return detected_artifacts, report
+
+async def forensic_analysis(request):
+    """Queue an uploaded image for analysis and send the user to its report page"""
     if request.method == 'POST':
         form = ForensicUploadForm(request.POST, request.FILES)
-        if form.is_valid():
-            # Save the analysis record
-            analysis = form.save()
-            
-            # Get full path to the image
-            image_path = os.path.join(settings.MEDIA_ROOT, analysis.original_file.name)
-            
-            # Make prediction
-            result = detector.predict(image_path)
-            
-            if 'error' not in result:
-                # Enhanced analysis with forensic details
-                enhanced_result = enhance_forensic_analysis(analysis, result, image_path)
-                
-                return render(request, 'forensic_result.html', {
-                    'analysis': analysis,
-                    'result': enhanced_result
-                })
-            else:
-                return render(request, 'forensic_upload.html', {
-                    'form': form,
-                    'error': result['error']
-                })
+        if await sync_to_async(form.is_valid)():
+            try:
+                analysis = await sync_to_async(queue_analysis)(form)
+            except QueueFull:
+                return await sync_to_async(upload_busy)(request, form)
+            return redirect('analysis_report', analysis.report_id)
     else:
         form = ForensicUploadForm()
     
-    return render(request, 'forensic_upload.html', {'form': form})
+    return await sync_to_async(render)(request, 'forensic_upload.html', {'form': form})
 
-def enhance_forensic_analysis(analysis, basic_result, image_path):
+def analysis_report(request, report_id):
+    """Result page of an analysis, or a page that waits for a queued analysis to finish"""
+    try:
+        analysis = ForensicAnalysis.objects.get(report_id=report_id)
+    except ForensicAnalysis.DoesNotExist:
+        return HttpResponse("Report not found", status=404)
+
+    if analysis.status == 'done':
+        return render(request, 'forensic_result.html', {
+            'analysis': analysis,
+            'result': analysis.raw_prediction_data
+        })
+    return render(request, 'analysis_pending.html', {
+        'analysis': analysis,
+        'error': analysis.raw_prediction_data.get('error', 'Analysis failed') if analysis.status == 'failed' else '',
+    })
+
+def enhance_forensic_analysis(analysis, basic_result, image, stages=None):
     """Enhance basic prediction with forensic analysis"""
     
+    # Independent analysis stages, normally started alongside the prediction
+    if stages is None:
+        stages = analysis_pipeline.start(image)
+    stage_results = stages.collect()
+    
     # Calculate authenticity score (invert if deepfake)
     authenticity_score = basic_result['confidence'] 
     if basic_result['is_deepfake']:
@@ -145,14 +402,14 @@ def enhance_forensic_analysis(analysis, basic_result, image_path):
     # Determine classification and confidence
     classification, confidence_level = determine_classification(authenticity_score, basic_result['confidence'], basic_result['is_deepfake'])
     
-    # Detect artifacts (simulated - you'd integrate real artifact detection)
-    detected_artifacts = detect_artifacts(image_path, basic_result['is_deepfake'])
+    # Detected artifacts
+    detected_artifacts, artifact_report = stage_results['artifacts']
     
-    # Generate heatmap path (simulated)
-    heatmap_path = generate_heatmap(image_path)
+    # Grad-CAM heatmap, set by heatmaps.predict_for_analysis
+    heatmap_path = analysis.heatmap_path
     
-    # Detect toolkit signatures (simulated)
-    toolkit_signature = detect_toolkit_signature(image_path)
+    # Toolkit signatures recorded in the metadata
+    toolkit_signature = stage_results['toolkit']
     
     # Prepare enhanced result
     enhanced_result = {
@@ -161,13 +418,17 @@ def enhance_forensic_analysis(analysis, basic_result, image_path):
         'classification': classification,
         'confidence_level': confidence_level,
         'detected_artifacts': detected_artifacts,
+        'artifact_analysis': artifact_report,
         'heatmap_path': heatmap_path,
         'toolkit_signature': toolkit_signature,
+        'model_ensemble_results': analysis.model_ensemble_results,
+        'cross_correlation': analysis.cross_correlation,
+        'stage_timings': stages.report(),
         'summary': generate_summary(classification, authenticity_score, detected_artifacts),
         'recommended_action': determine_recommended_action(classification, confidence_level)
     }
     
-    # Save enhanced results to database
+    # Save enhanced results and artifacts to database in one transaction
     analysis.authenticity_score = authenticity_score
     analysis.classification = classification
     analysis.confidence_level = confidence_level
@@ -176,17 +437,8 @@ def enhance_forensic_analysis(analysis, basic_result, image_path):
     analysis.summary = enhanced_result['summary']
     analysis.recommended_action = enhanced_result['recommended_action']
     analysis.raw_prediction_data = basic_result
-    analysis.save()
-    
-    # Save artifacts to database
-    for artifact in detected_artifacts:
-        ArtifactDetection.objects.create(
-            analysis=analysis,
-            artifact_type=artifact['type'],
-            confidence=artifact['confidence'],
-            location=artifact.get('location', ''),
-            description=artifact['description']
-        )
+    analysis.stage_timings = enhanced_result['stage_timings']
+    persist_analysis_results(analysis, detected_artifacts)
     
     return enhanced_result
 
@@ -217,14 +469,10 @@ def determine_classification(authenticity_score, model_confidence, is_deepfake):
     
     return classification, confidence_level
 
-def generate_heatmap(image_path):
-    """Simulate heatmap generation - integrate real heatmap generation"""
-    return "/static/detection_app/images/heatmap-placeholder.png"
-
-def detect_toolkit_signature(image_path):
-    """Simulate toolkit detection - integrate real signature analysis"""
-    toolkits = ['DeepFaceLab', 'StyleGAN', 'FaceSwap', 'DFaker', 'Unknown']
-    return random.choice(toolkits) if random.random() > 0.5 else ""
+@analysis_pipeline.stage('toolkit', timeout_ms=250, default='')
+def detect_toolkit_signature(image):
+    """Name the generation toolkit recorded in the image metadata, if any"""
+    return artifact_detection.detect_toolkit(image)
 
 def generate_summary(classification, authenticity_score, artifacts):
     """Generate plain-language summary"""